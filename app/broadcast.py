@@ -0,0 +1,318 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import deque
+from app.ratelimit import TokenBucket
+from app.metrics import BROADCAST_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+# ===== إعدادات البث =====
+BROADCAST_DB_PATH = os.getenv("BROADCAST_DB_PATH", "./medbot-broadcast.db")
+# حصة البث من حد البوت العام (TELEGRAM_GLOBAL_RATE) حتى تبقى ردود المحادثات سريعة
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))            # رسالة/ثانية
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))         # طلبات متزامنة
+BROADCAST_CHECKPOINT_EVERY = int(os.getenv("BROADCAST_CHECKPOINT_EVERY", "50"))
+BROADCAST_CHECKPOINT_INTERVAL = float(os.getenv("BROADCAST_CHECKPOINT_INTERVAL", "1"))  # ثواني
+
+# حالة المستلم داخل مهمة البث
+PENDING, SENT, FAILED = 0, 1, 2
+
+# المستخدم حظر البوت أو حذف المحادثة: لا فائدة من إبقاء اشتراكاته
+_GONE_CODES = (403,)
+
+
+class BroadcastStore:
+    """
+    الاشتراكات ومهام البث في ملف SQLite محلي.
+    المستلمون يُثبّتون عند إنشاء المهمة، وحالة كل مستلم تُحفظ على دفعات
+    فتستكمل المهمة بعد إعادة التشغيل من حيث توقفت.
+    course = "" يعني الاشتراك في كل مقررات السمستر.
+    """
+
+    def __init__(self, path=BROADCAST_DB_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS subscriptions ("
+            "chat_id INTEGER NOT NULL, semester TEXT NOT NULL, course TEXT NOT NULL, "
+            "created REAL NOT NULL, PRIMARY KEY (semester, course, chat_id));"
+            "CREATE INDEX IF NOT EXISTS ix_subscriptions_chat ON subscriptions (chat_id);"
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, semester TEXT NOT NULL, course TEXT NOT NULL, "
+            "type TEXT NOT NULL, files INTEGER NOT NULL, admin_chat INTEGER, "
+            "status TEXT NOT NULL DEFAULT 'queued', total INTEGER NOT NULL DEFAULT 0, "
+            "sent INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, "
+            "created REAL NOT NULL, started REAL, finished REAL);"
+            "CREATE TABLE IF NOT EXISTS recipients ("
+            "job_id INTEGER NOT NULL, chat_id INTEGER NOT NULL, status INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (job_id, chat_id)) WITHOUT ROWID;"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    # ----- الاشتراكات -----
+    def subscribe(self, chat_id, semester, course=""):
+        """True إن كان اشتراكاً جديداً."""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO subscriptions (chat_id, semester, course, created) VALUES (?, ?, ?, ?)",
+                (chat_id, semester, course or "", time.time()))
+            self._conn.commit()
+            return cur.rowcount > 0
+
+    def unsubscribe(self, chat_id, semester=None, course=None):
+        """
+        إلغاء اشتراك واحد، أو كل اشتراكات السمستر (course=None)،
+        أو كل اشتراكات المحادثة (semester=None). يعيد عدد الاشتراكات المحذوفة.
+        """
+        query, params = "DELETE FROM subscriptions WHERE chat_id = ?", [chat_id]
+        if semester is not None:
+            query += " AND semester = ?"
+            params.append(semester)
+            if course is not None:
+                query += " AND course = ?"
+                params.append(course)
+        with self._lock:
+            cur = self._conn.execute(query, params)
+            self._conn.commit()
+            return cur.rowcount
+
+    def subscriptions(self, chat_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT semester, course FROM subscriptions WHERE chat_id = ? ORDER BY semester, course",
+                (chat_id,)).fetchall()
+
+    def subscriber_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(DISTINCT chat_id) FROM subscriptions").fetchone()[0]
+
+    # ----- المهام -----
+    def create_job(self, semester, course, ctype, files, admin_chat=None):
+        """
+        إنشاء مهمة بث لمشتركي المقرر والسمستر كله (كل محادثة مرة واحدة).
+        يعيد (رقم المهمة، عدد المستلمين).
+        """
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO jobs (semester, course, type, files, admin_chat, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (semester, course, ctype, files, admin_chat, time.time()))
+            job_id = cur.lastrowid
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO recipients (job_id, chat_id) SELECT DISTINCT ?, chat_id "
+                "FROM subscriptions WHERE semester = ? AND course IN ('', ?)",
+                (job_id, semester, course))
+            total = cur.rowcount
+            self._conn.execute("UPDATE jobs SET total = ? WHERE id = ?", (total, job_id))
+            self._conn.commit()
+            return job_id, total
+
+    def pending_jobs(self):
+        """المهام غير المكتملة بالترتيب (بما فيها ما انقطع أثناء التشغيل السابق)."""
+        with self._lock:
+            cur = self._conn.execute("SELECT * FROM jobs WHERE status != 'done' ORDER BY id")
+            names = [d[0] for d in cur.description]
+            return [dict(zip(names, row)) for row in cur.fetchall()]
+
+    def pending_recipients(self, job_id):
+        with self._lock:
+            return [chat_id for (chat_id,) in self._conn.execute(
+                "SELECT chat_id FROM recipients WHERE job_id = ? AND status = ?", (job_id, PENDING))]
+
+    def start_job(self, job_id):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', started = COALESCE(started, ?) WHERE id = ?",
+                (time.time(), job_id))
+            self._conn.commit()
+
+    def checkpoint(self, job_id, results):
+        """حفظ نتائج دفعة من المستلمين [(chat_id, SENT|FAILED)] في معاملة واحدة."""
+        if not results:
+            return
+        sent = sum(1 for _, status in results if status == SENT)
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE recipients SET status = ? WHERE job_id = ? AND chat_id = ?",
+                [(status, job_id, chat_id) for chat_id, status in results])
+            self._conn.execute("UPDATE jobs SET sent = sent + ?, failed = failed + ? WHERE id = ?",
+                               (sent, len(results) - sent, job_id))
+            self._conn.commit()
+
+    def finish_job(self, job_id):
+        """إغلاق المهمة وحذف قائمة مستلميها. يعيد صف المهمة النهائي."""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'done', finished = ? WHERE id = ?",
+                               (time.time(), job_id))
+            self._conn.execute("DELETE FROM recipients WHERE job_id = ?", (job_id,))
+            self._conn.commit()
+            cur = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            return dict(zip([d[0] for d in cur.description], cur.fetchone()))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Broadcaster:
+    """
+    مُنفذ مهام البث: مهمة واحدة في كل مرة (فيصل ترتيب الإشعارات لكل محادثة
+    كما أُنشئت)، وعدة عمال يرسلون عبر DeliveryScheduler مع دلو خاص بالبث
+    يتوقف كله عند أي 429. التقدم يُحفظ كل BROADCAST_CHECKPOINT_EVERY رسالة أو
+    BROADCAST_CHECKPOINT_INTERVAL ثانية؛ بعد انقطاع مفاجئ قد تتكرر فقط الرسائل
+    التي أُرسلت بعد آخر حفظ.
+
+    render(job) -> (text, reply_markup) نص الإشعار.
+    on_done(job, report): دالة async اختيارية تُستدعى عند اكتمال كل مهمة.
+    """
+
+    def __init__(self, delivery, store, render, on_done=None, rate=BROADCAST_RATE,
+                 workers=BROADCAST_WORKERS, checkpoint_every=BROADCAST_CHECKPOINT_EVERY,
+                 checkpoint_interval=BROADCAST_CHECKPOINT_INTERVAL):
+        self.delivery = delivery
+        self.store = store
+        self.render = render
+        self.on_done = on_done
+        self.bucket = TokenBucket(rate, max(1.0, rate))
+        self.workers = workers
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+        self._task = None
+        self._wakeup = None
+        self._results = []
+        self._last_checkpoint = 0.0
+        self.active = None        # تقدم المهمة الجارية
+        self.last_report = None
+        self.completed = 0
+
+    # ----- الإضافة -----
+    async def enqueue(self, semester, course, ctype, files, admin_chat=None):
+        """إنشاء مهمة بث وإيقاظ المُنفذ. يعيد (رقم المهمة، عدد المستلمين)."""
+        job_id, total = await asyncio.to_thread(
+            self.store.create_job, semester, course, ctype, files, admin_chat)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id, total
+
+    # ----- التنفيذ -----
+    async def _run(self):
+        while True:
+            # المسح قبل القراءة حتى لا تضيع مهمة أُضيفت أثناءها
+            self._wakeup.clear()
+            jobs = await asyncio.to_thread(self.store.pending_jobs)
+            if not jobs:
+                await self._wakeup.wait()
+                continue
+            for job in jobs:
+                try:
+                    await self._run_job(job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # المهمة تبقى غير مكتملة وتُستأنف في الدورة التالية
+                    logger.exception(f"Broadcast job {job['id']} interrupted: {e!r}")
+                    await asyncio.sleep(5)
+                    break
+
+    async def _run_job(self, job):
+        job_id = job["id"]
+        recipients = deque(await asyncio.to_thread(self.store.pending_recipients, job_id))
+        await asyncio.to_thread(self.store.start_job, job_id)
+        text, markup = self.render(job)
+        started = time.monotonic()
+        self.active = {"job": job_id, "total": job["total"], "sent": job["sent"],
+                       "failed": job["failed"], "started": started, "resumed": job["status"] == "running",
+                       "done_before": job["sent"] + job["failed"]}
+        if self.active["resumed"]:
+            logger.info(f"Resuming broadcast job {job_id}: {len(recipients)}/{job['total']} left")
+        self._last_checkpoint = started
+
+        async def worker():
+            while recipients:
+                chat_id = recipients.popleft()
+                payload = {"chat_id": chat_id, "text": text}
+                if markup:
+                    payload["reply_markup"] = markup
+                r = await self.delivery.call(chat_id, "sendMessage", payload, bucket=self.bucket)
+                await self._record(job_id, chat_id, r)
+
+        try:
+            # خطأ في عامل يلغي الباقين؛ المهمة تُستأنف لاحقاً من آخر حفظ
+            async with asyncio.TaskGroup() as group:
+                for _ in range(min(self.workers, len(recipients))):
+                    group.create_task(worker())
+        finally:
+            # يُنفذ أيضاً عند الإيقاف: حفظ ما أُرسل فعلاً قبل الخروج
+            results, self._results = self._results, []
+            # shield: إلغاء المهمة أثناء الانتظار لا يقطع الحفظ الجاري في الخيط
+            await asyncio.shield(asyncio.to_thread(self.store.checkpoint, job_id, results))
+
+        final = await asyncio.to_thread(self.store.finish_job, job_id)
+        elapsed = time.monotonic() - started
+        # المعدل يُحسب على ما أُرسل في هذا التشغيل فقط (دون ما سبق الاستئناف)
+        done = self.active["sent"] + self.active["failed"] - self.active["done_before"]
+        report = {
+            "job": job_id, "total": final["total"], "sent": final["sent"], "failed": final["failed"],
+            "seconds": round(elapsed, 2),
+            "per_second": round(done / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+        self.active = None
+        self.last_report = report
+        self.completed += 1
+        logger.info(f"Broadcast job {job_id} done: {report['sent']}/{report['total']} sent, "
+                    f"{report['failed']} failed in {report['seconds']}s ({report['per_second']}/s)")
+        if self.on_done:
+            try:
+                await self.on_done(final, report)
+            except Exception as e:
+                logger.warning(f"Broadcast report for job {job_id} failed: {e!r}")
+
+    async def _record(self, job_id, chat_id, r):
+        if r.get("ok"):
+            status = SENT
+            self.active["sent"] += 1
+            BROADCAST_MESSAGES.inc(outcome="sent")
+        else:
+            status = FAILED
+            self.active["failed"] += 1
+            BROADCAST_MESSAGES.inc(outcome=str(r.get("error_code") or "network"))
+            if r.get("error_code") in _GONE_CODES:
+                await asyncio.to_thread(self.store.unsubscribe, chat_id)
+        self._results.append((chat_id, status))
+        now = time.monotonic()
+        if (len(self._results) >= self.checkpoint_every
+                or now - self._last_checkpoint >= self.checkpoint_interval):
+            results, self._results = self._results, []
+            self._last_checkpoint = now
+            await asyncio.to_thread(self.store.checkpoint, job_id, results)
+
+    # ----- دورة الحياة -----
+    def start(self):
+        """بدء المُنفذ (يستأنف المهام غير المكتملة من التشغيل السابق)."""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self):
+        out = {"completed": self.completed, "last": self.last_report, "active": None}
+        active = self.active
+        if active:
+            elapsed = time.monotonic() - active["started"]
+            done = active["sent"] + active["failed"]
+            out["active"] = {
+                "job": active["job"], "total": active["total"], "sent": active["sent"],
+                "failed": active["failed"], "remaining": max(0, active["total"] - done),
+                "seconds": round(elapsed, 2), "resumed": active["resumed"],
+                "per_second": round((done - active["done_before"]) / elapsed, 1) if elapsed > 0 else 0.0,
+            }
+        return out
@@ -0,0 +1,346 @@
+"""
+استيراد وتصدير كتالوج المواد دفعة واحدة (JSONL أو CSV) بذاكرة ثابتة.
+
+الاستخدام:
+    python -m app.bulk import materials.jsonl           # التخزين حسب STORAGE_BACKEND
+    python -m app.bulk import materials.csv --resume    # إكمال استيراد انقطع
+    python -m app.bulk import - --format csv < materials.csv
+    python -m app.bulk import seed.jsonl --url sqlite:///./medbot.db   # بيانات محلية للتجربة
+    python -m app.bulk export backup.jsonl
+    python -m app.bulk export - --format csv > backup.csv
+
+كل سطر مادة بحقول MATERIAL_FIELDS (semester, course, type, file_id إلزامية).
+الصفوف تُتحقق من قائمة السمسترات والمقررات والأنواع في menu، والمكرر
+(نفس file_id أو file_unique_id في نفس المقرر والنوع) يُتجاهل فإعادة نفس الملف آمنة.
+"""
+import os
+import io
+import csv
+import sys
+import json
+import argparse
+from datetime import datetime
+from app import menu
+from app.storage import MATERIAL_FIELDS
+from app.materials_index import material_key
+
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))  # صفوف في كل كتابة
+MAX_REPORTED_ERRORS = 100
+MAX_RECORD_LINES = 100  # أقصى أسطر لسجل CSV واحد (تنصيص غير مغلق لا يبتلع بقية الملف)
+FORMATS = ("jsonl", "csv")
+REQUIRED_FIELDS = ("semester", "course", "type", "file_id")
+
+# مطابقة المقرر والنوع بدون اعتبار لحالة الأحرف: (السمستر، الاسم) -> الاسم في القائمة
+_COURSES = {(semester, course.casefold()): course
+            for semester, courses in menu.COURSES_BY_SEMESTER.items() for course in courses}
+_TYPES = {code.casefold(): code for code in menu.TYPE_LABELS}
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return "csv" if str(path).lower().endswith(".csv") else "jsonl"
+
+
+class RecordReader:
+    """
+    تحليل سطر واحد في كل مرة (لا يحتاج الملف كاملاً في الذاكرة).
+    في CSV قد يمتد الحقل بين علامتي تنصيص لعدة أسطر (وصف ملف من عدة أسطر)،
+    فتُجمع الأسطر حتى يُغلق التنصيص ثم يُحلل السجل كاملاً.
+    """
+
+    def __init__(self, fmt):
+        if fmt not in FORMATS:
+            raise ValueError(f"❌ صيغة غير معروفة: {fmt}")
+        self.fmt = fmt
+        self.header = None
+        self.pending = []  # أسطر سجل CSV لم يكتمل بعد
+
+    def parse(self, line):
+        """
+        dict للسجل، أو None لسطر فارغ أو رأس CSV أو سجل CSV لم يكتمل بعد.
+        ValueError لسجل تالف.
+        """
+        line = line.rstrip("\r\n")
+        if self.fmt == "jsonl":
+            if not line.strip():
+                return None
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("not a JSON object")
+            return record
+        self.pending.append(line)
+        text = "\n".join(self.pending)
+        if not text.strip():
+            self.pending = []
+            return None
+        try:
+            values = next(csv.reader([text], strict=True))
+        except csv.Error as e:
+            if "unexpected end of data" in str(e) and len(self.pending) < MAX_RECORD_LINES:
+                return None  # حقل بين علامتي تنصيص لم يُغلق بعد: ينتظر السطر التالي
+            self.pending = []
+            raise ValueError(str(e)) from None
+        self.pending = []
+        if self.header is None:
+            self.header = [v.strip().lstrip("\ufeff") for v in values]
+            return None
+        return dict(zip(self.header, values))
+
+
+def validate(record):
+    """(قيم الصف بترتيب MATERIAL_FIELDS، None) أو (None، سبب الرفض)."""
+    values = {f: "" if record.get(f) is None else str(record.get(f)) for f in MATERIAL_FIELDS}
+    # المفاتيح تُنظف من المسافات؛ file_name نص حر (وصف الملف) يبقى كما هو
+    values.update({f: v.strip() for f, v in values.items() if f != "file_name"})
+    missing = [f for f in REQUIRED_FIELDS if not values[f]]
+    if missing:
+        return None, f"missing {', '.join(missing)}"
+    semester = values["semester"]
+    if semester not in menu.SEMESTER_LABELS:
+        return None, f"unknown semester {semester!r}"
+    course = _COURSES.get((semester, values["course"].casefold()))
+    if course is None:
+        return None, f"unknown course {values['course']!r} for semester {semester}"
+    ctype = _TYPES.get(values["type"].casefold())
+    if ctype is None:
+        return None, f"unknown type {values['type']!r}"
+    values.update(course=course, type=ctype,
+                  created_at=values["created_at"] or datetime.utcnow().isoformat())
+    return [values[f] for f in MATERIAL_FIELDS], None
+
+
+def _identity(values):
+    """(مفتاح المادة، file_id، file_unique_id) لصف بترتيب MATERIAL_FIELDS."""
+    key = material_key(*values[:3])
+    return key, values[MATERIAL_FIELDS.index("file_id")], values[MATERIAL_FIELDS.index("file_unique_id")]
+
+
+class Importer:
+    """
+    يجمع الصفوف الصالحة في دفعات بحجم batch_size. المُستدعي يمرر كل دفعة
+    على drop_existing ثم يكتبها ويستدعي committed() فيتقدم line (آخر سطر محفوظ، للاستئناف).
+    الذاكرة لا تكبر مع حجم الكتالوج ولا الملف: المكرر يُستبعد داخل الدفعة الحالية
+    وبسؤال التخزين عن مفاتيح الدفعة فقط (وما كُتب من دفعات سابقة صار في التخزين).
+    """
+
+    def __init__(self, fmt, batch_size=BULK_BATCH_SIZE, start_line=0):
+        self.reader = RecordReader(fmt)
+        self.batch_size = batch_size
+        self.start_line = start_line
+        self._seen = set()     # (المفتاح، file_id أو file_unique_id) في الدفعة الحالية
+        self._batch = []
+        self._line = 0
+        self._record_line = 0  # أول سطر في السجل الحالي (لرسائل الخطأ)
+        self._taken_line = 0   # آخر سطر في آخر دفعة (حتى لو كانت كلها مكررة)
+        self.report = {"read": 0, "imported": 0, "duplicates": 0, "invalid": 0,
+                       "line": start_line, "errors": []}
+
+    def _reject(self, line_no, reason):
+        self.report["invalid"] += 1
+        if len(self.report["errors"]) < MAX_REPORTED_ERRORS:
+            self.report["errors"].append({"line": line_no, "error": reason})
+
+    def add(self, line):
+        """تحليل سطر. يعيد دفعة جاهزة للكتابة [(رقم آخر سطر في السجل، القيم)] أو None."""
+        self._line += 1
+        line_no = self._line
+        if not self.reader.pending:
+            self._record_line = line_no
+        if line_no <= self.start_line:
+            # نقطة الاستئناف دائماً بعد سجل كامل؛ رأس CSV مطلوب حتى عند التخطي
+            if self.reader.fmt == "csv" and self.reader.header is None:
+                self.reader.parse(line)
+            return None
+        try:
+            record = self.reader.parse(line)
+        except ValueError as e:
+            self._reject(self._record_line, f"unreadable: {e}")
+            return None
+        if record is None:
+            return None
+        self.report["read"] += 1
+        values, error = validate(record)
+        if error:
+            self._reject(self._record_line, error)
+            return None
+        key, file_id, unique_id = _identity(values)
+        if (key, file_id) in self._seen or (unique_id and (key, unique_id) in self._seen):
+            self.report["duplicates"] += 1
+            return None
+        self._seen.update([(key, file_id), (key, unique_id)] if unique_id else [(key, file_id)])
+        self._batch.append((line_no, values))
+        if len(self._batch) >= self.batch_size:
+            return self.take()
+        return None
+
+    def take(self):
+        """الدفعة الحالية (قد تكون فارغة) وتفريغها."""
+        batch, self._batch = self._batch, []
+        self._seen = set()
+        if batch:
+            self._taken_line = batch[-1][0]
+        return batch
+
+    def drop_existing(self, batch, lookup):
+        """
+        الدفعة بدون الصفوف الموجودة في التخزين (نفس المقرر والنوع و file_id أو file_unique_id).
+        lookup(keys) -> (file_ids, unique_ids) لمفاتيح الدفعة فقط؛ طلب واحد لكل دفعة.
+        """
+        if not batch:
+            return batch
+        file_ids, unique_ids = lookup({_identity(values)[0] for _, values in batch})
+        kept = []
+        for line_no, values in batch:
+            key, file_id, unique_id = _identity(values)
+            if (key, file_id) in file_ids or (unique_id and (key, unique_id) in unique_ids):
+                self.report["duplicates"] += 1
+            else:
+                kept.append((line_no, values))
+        return kept
+
+    def committed(self, batch):
+        """الدفعة حُفظت في التخزين."""
+        self.report["imported"] += len(batch)
+        self.report["line"] = max(self.report["line"], self._taken_line)
+
+    def finished(self):
+        """كل الأسطر عولجت (المرفوضة بعد آخر دفعة لا تحتاج إعادة)."""
+        if self.reader.pending:
+            self.reader.pending = []
+            self._reject(self._record_line, "unreadable: unterminated quoted field")
+        self.report["line"] = max(self.report["line"], self._line)
+        return self.report
+
+
+def export_lines(rows, fmt):
+    """أسطر JSONL أو CSV (مع الرأس) لصفوف المواد، سطراً بسطر."""
+    if fmt == "jsonl":
+        for row in rows:
+            yield json.dumps({f: row.get(f) if row.get(f) is not None else "" for f in MATERIAL_FIELDS},
+                             ensure_ascii=False) + "\n"
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(MATERIAL_FIELDS)
+    for row in rows:
+        writer.writerow(["" if row.get(f) is None else row.get(f) for f in MATERIAL_FIELDS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# ===== سطر الأوامر =====
+def _load_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f).get("line", 0)
+    except FileNotFoundError:
+        return 0
+
+
+def _save_checkpoint(path, report):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def run_import(storage, stream, fmt, batch_size=BULK_BATCH_SIZE, checkpoint=None, resume=False,
+               dry_run=False, progress=None):
+    """
+    استيراد من stream (أسطر نصية) إلى storage.append_materials على دفعات.
+    بعد كل دفعة يُحفظ رقم آخر سطر في checkpoint؛ resume=True يبدأ بعده.
+    dry_run لا يكتب، فالمكرر بين دفعات نفس الملف لا يُحسب فيه (المكرر مع التخزين يُحسب).
+    """
+    start_line = _load_checkpoint(checkpoint) if (checkpoint and resume) else 0
+    importer = Importer(fmt, batch_size, start_line)
+
+    def write(batch):
+        batch = importer.drop_existing(batch, storage.existing_ids)
+        if batch and not dry_run:
+            storage.append_materials([values for _, values in batch])
+        importer.committed(batch)
+        if checkpoint and not dry_run:
+            _save_checkpoint(checkpoint, importer.report)
+        if progress:
+            progress(importer.report)
+
+    for line in stream:
+        batch = importer.add(line)
+        if batch:
+            write(batch)
+    write(importer.take())
+    report = importer.finished()
+    if checkpoint and not dry_run and os.path.exists(checkpoint):
+        os.remove(checkpoint)  # اكتمل: الاستيراد التالي لنفس الملف يبدأ من أوله
+    return report
+
+
+def _storage(url=None):
+    if url:
+        from app.storage_sql import SqlStorage
+        return SqlStorage(url)
+    from app.storage import get_storage
+    return get_storage()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="استيراد/تصدير كتالوج المواد (JSONL أو CSV)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="استيراد مواد من ملف")
+    imp.add_argument("path", help="ملف JSONL/CSV أو - للإدخال القياسي")
+    imp.add_argument("--format", choices=FORMATS)
+    imp.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    imp.add_argument("--checkpoint", help="ملف التقدم (الافتراضي <path>.progress.json)")
+    imp.add_argument("--resume", action="store_true", help="إكمال استيراد سابق من آخر دفعة محفوظة")
+    imp.add_argument("--dry-run", action="store_true", help="تحقق فقط بدون كتابة")
+    imp.add_argument("--url", help="قاعدة SQL هدف بدل STORAGE_BACKEND")
+    exp = sub.add_parser("export", help="تصدير كل المواد")
+    exp.add_argument("path", nargs="?", default="-", help="ملف الإخراج أو - للإخراج القياسي")
+    exp.add_argument("--format", choices=FORMATS)
+    exp.add_argument("--url", help="قاعدة SQL مصدر بدل STORAGE_BACKEND")
+    args = parser.parse_args(argv)
+
+    fmt = detect_format(args.path, args.format)
+    storage = _storage(args.url)
+    if args.url:
+        storage.init_schema()
+
+    if args.command == "export":
+        out = sys.stdout if args.path == "-" else open(args.path, "w", encoding="utf-8", newline="")
+        exported = 0
+
+        def counted(rows):
+            nonlocal exported
+            for row in rows:
+                exported += 1
+                yield row
+
+        try:
+            out.writelines(export_lines(counted(storage.iter_materials()), fmt))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print(f"✅ تم تصدير {exported} مادة", file=sys.stderr)
+        return
+
+    checkpoint = args.checkpoint or (None if args.path == "-" else args.path + ".progress.json")
+    stream = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8-sig", newline="")
+    try:
+        report = run_import(storage, stream, fmt, args.batch_size, checkpoint, args.resume, args.dry_run,
+                            progress=lambda r: print(f"… {r['imported']} مادة حتى السطر {r['line']}",
+                                                     file=sys.stderr))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    for error in report["errors"]:
+        print(f"⚠️ السطر {error['line']}: {error['error']}", file=sys.stderr)
+    print(f"{'🔎 تحقق' if args.dry_run else '✅ استيراد'}: {report['imported']} جديدة، "
+          f"{report['duplicates']} مكررة، {report['invalid']} مرفوضة من {report['read']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
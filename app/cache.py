@@ -0,0 +1,151 @@
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# كل الكاشات المُنشأة (لعرض الإحصائيات)
+REGISTRY = []
+
+
+class _Flight:
+    """تحميل جارٍ لمفتاح واحد؛ الطلبات الأخرى تنتظره بدل تكرار الجلب."""
+
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Cache:
+    """
+    كاش آمن بين الخيوط مع:
+      - صلاحية (ttl) وحد أقصى للحجم مع إخلاء الأقدم استخداماً (LRU)
+      - تخزين النتائج الفارغة أيضاً (negative caching) بصلاحية negative_ttl
+      - تحميل واحد فقط لكل مفتاح في نفس الوقت (single-flight)
+      - إرجاع القيمة القديمة خلال stale_ttl مع تحديثها في الخلفية
+      - عدادات hits / misses / stale_hits / evictions / load_errors
+    """
+
+    def __init__(self, name, ttl=60, max_entries=1024, stale_ttl=300, negative_ttl=None):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._data = OrderedDict()  # key -> (value, fresh_until, stale_until)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.loads = 0
+        self.load_errors = 0
+        REGISTRY.append(self)
+
+    def _store(self, key, value):
+        now = time.monotonic()
+        fresh_until = now + (self.ttl if value else self.negative_ttl)
+        self._data[key] = (value, fresh_until, fresh_until + self.stale_ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, key, value):
+        """
+        كتابة مباشرة (write-through) بعد تعديل المصدر. تحميل جارٍ لنفس المفتاح
+        بدأ قبل التعديل لا يستبدل هذه القيمة بنتيجته القديمة.
+        """
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._store(key, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._data.pop(key, None)
+
+    def _load(self, key, loader, flight):
+        try:
+            value = loader()
+        except Exception as e:
+            logger.warning(f"Cache {self.name}: loading {key!r} failed: {e!r}")
+            flight.error = e
+            with self._lock:
+                self.load_errors += 1
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+        else:
+            flight.value = value
+            with self._lock:
+                self.loads += 1
+                # set/invalidate أثناء التحميل أسقطت هذا التحميل: لا نخزن قيمته
+                if self._inflight.get(key) is flight:
+                    self._store(key, value)
+                    del self._inflight[key]
+        finally:
+            flight.event.set()
+
+    def _refresh_in_background(self, key, loader):
+        """تحديث القيمة القديمة في خيط خلفي (يُستدعى والقفل محجوز)."""
+        if key in self._inflight:
+            return
+        flight = _Flight()
+        self._inflight[key] = flight
+        threading.Thread(target=self._load, args=(key, loader, flight),
+                         name=f"cache-refresh-{self.name}", daemon=True).start()
+
+    def get_or_load(self, key, loader):
+        """
+        القيمة من الكاش أو من loader(). عند فشل التحميل تُعاد القيمة القديمة
+        إن وُجدت ضمن stale_ttl، وإلا يُرفع الاستثناء.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            now = time.monotonic()
+            if entry is not None:
+                value, fresh_until, stale_until = entry
+                if now < fresh_until:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if now < stale_until:
+                    self.stale_hits += 1
+                    self._refresh_in_background(key, loader)
+                    return value
+            self.misses += 1
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+
+        if leader:
+            self._load(key, loader, flight)
+        else:
+            flight.event.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+def all_stats():
+    return {cache.name: cache.stats() for cache in REGISTRY}
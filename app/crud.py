@@ -1,89 +1,118 @@
 import os
-import threading
 import json
-import gspread
-from google.oauth2.service_account import Credentials
+import threading
+import functools
 from datetime import datetime
-import time
+from app.cache import Cache
+from app.metrics import CRUD_SECONDS
+from app.materials_index import MaterialsIndex, material_key
+from app.search import SearchIndex
+from app import menu
+from app.storage import get_storage, operation, StorageUnavailable, MATERIAL_FIELDS
+from app.journal import WriteBehindJournal, NOT_PENDING
+from app.filecheck import FileRegistry
 
 # 🔒 قفل لتفادي التداخل بين الطلبات
 LOCK = threading.Lock()
 
-# ===== إعداد Google Sheets =====
-GOOGLE_SHEET_NAME = os.getenv("GOOGLE_SHEET_NAME", "MedBot Files")
-SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive"
-]
-SERVICE_ACCOUNT_JSON = os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON")
-
-if not SERVICE_ACCOUNT_JSON:
-    raise ValueError("❌ متغير البيئة GOOGLE_SERVICE_ACCOUNT_JSON غير موجود!")
+# ===== محرك التخزين (Google Sheets أو SQL حسب STORAGE_BACKEND) =====
+STORAGE = get_storage()
 
-creds_info = json.loads(SERVICE_ACCOUNT_JSON)
-credentials = Credentials.from_service_account_info(creds_info, scopes=SCOPES)
-client = gspread.authorize(credentials)
+# ===== الكتابة المؤجلة (write-behind) =====
+# الكتابات تُحفظ في سجل محلي ويُرد فوراً، ثم تُرسل للتخزين على دفعات في الخلفية.
+# مفعّلة افتراضياً مع Google Sheets فقط (كتابات SQL محلية وسريعة أصلاً).
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "1" if STORAGE.name == "sheets" else "0") == "1"
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "./medbot-journal.db")
+JOURNAL = WriteBehindJournal(JOURNAL_PATH, STORAGE) if WRITE_BEHIND else None
 
 # ===== كاش داخلي لتقليل طلبات القراءة =====
-_cache = {}
-CACHE_TTL = 60  # ثواني
+# يخزّن صف الانتظار لكل محادثة (أو None إن لم يوجد) ويُلغى عند كل كتابة محلية.
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))              # ثواني
+CACHE_STALE_TTL = float(os.getenv("CACHE_STALE_TTL", "300"))  # مدة إرجاع القيمة القديمة مع التحديث بالخلفية
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+WAITING_CACHE = Cache("waiting", ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES,
+                      stale_ttl=CACHE_STALE_TTL)
 
-def _get_cache(key):
-    if key in _cache and (time.time() - _cache[key]['time'] < CACHE_TTL):
-        return _cache[key]['value']
-    return None
+# ===== فهرس المواد في الذاكرة (semester, course, type) -> صفوف =====
+MATERIALS = MaterialsIndex()
+# فهرس البحث يُبنى من MATERIALS عند أول بحث بعد أي تغيير فيه
+SEARCH = SearchIndex()
+_SEARCH_LOCK = threading.Lock()
+# حالة file_id لكل ملف (يملؤها الفحص الدوري): الملفات المعزولة لا تُعرض ولا تُرسل
+FILES = FileRegistry()
+# خيط خلفي يفحص نسخة المصدر دورياً ويعيد بناء الفهرس فقط عند تغيّرها
+MATERIALS_REFRESH_INTERVAL = float(os.getenv("MATERIALS_REFRESH_INTERVAL", "30"))  # ثواني
+_REFRESH_STOP = threading.Event()
+_refresher = None
+# لقطة محلية لصفوف المواد تُحمَّل فوراً عند بدء التشغيل (قبل أي طلب لـ Google)
+MATERIALS_SNAPSHOT_PATH = os.getenv("MATERIALS_SNAPSHOT_PATH", "./medbot-materials.json")
 
-def _set_cache(key, value):
-    _cache[key] = {'value': value, 'time': time.time()}
+def _operation(fn):
+    """
+    تسمية طلبات API التي تتم داخل الدالة باسمها (لإحصائيات STORAGE.stats())
+    وقياس زمنها في medbot_crud_seconds.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with operation(fn.__name__), CRUD_SECONDS.time(function=fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+# ===== تهيئة قاعدة البيانات =====
+INIT_RETRY = float(os.getenv("INIT_RETRY", "15"))  # ثواني قبل إعادة فحص الجداول بعد فشل (تتضاعف)
+INIT_MAX_RETRY = 600
+_INIT_STOP = threading.Event()
 
-# ===== تهيئة الورقة =====
-def init_db():
+@_operation
+def init_schema():
+    """فحص/إنشاء الجداول مرة واحدة. يعيد True عند النجاح."""
     with LOCK:
         try:
-            try:
-                spreadsheet = client.open(GOOGLE_SHEET_NAME)
-            except gspread.SpreadsheetNotFound:
-                spreadsheet = client.create(GOOGLE_SHEET_NAME)
-
-            sheet_titles = [s.title for s in spreadsheet.worksheets()]
-
-            # materials - الهيكل الجديد: semester, course, type, file_id, created_at
-            if "materials" not in sheet_titles:
-                spreadsheet.add_worksheet(title="materials", rows=5000, cols=5)
-                sheet = spreadsheet.worksheet("materials")
-                sheet.append_row(["semester", "course", "type", "file_id", "created_at"])
-            else:
-                sheet = spreadsheet.worksheet("materials")
-                header = sheet.row_values(1)
-                expected = ["semester", "course", "type", "file_id", "created_at"]
-                if header[: len(expected)] != expected:
-                    try:
-                        sheet.delete_rows(1)
-                    except Exception:
-                        pass
-                    sheet.insert_row(expected, 1)
-
-            # waiting_files - الهيكل الجديد: chat_id, file_id, type, semester
-            if "waiting_files" not in sheet_titles:
-                spreadsheet.add_worksheet(title="waiting_files", rows=1000, cols=4)
-                sheet2 = spreadsheet.worksheet("waiting_files")
-                sheet2.append_row(["chat_id", "file_id", "type", "semester"])
-            else:
-                sheet2 = spreadsheet.worksheet("waiting_files")
-                header2 = sheet2.row_values(1)
-                if header2[:4] != ["chat_id", "file_id", "type", "semester"]:
-                    try:
-                        sheet2.delete_rows(1)
-                    except Exception:
-                        pass
-                    sheet2.insert_row(["chat_id", "file_id", "type", "semester"], 1)
-
-            print("✅ Google Sheet جاهز للاستخدام")
-
+            STORAGE.init_schema()
+            print(f"✅ قاعدة البيانات ({STORAGE.name}) جاهزة للاستخدام")
+            return True
         except Exception as e:
             print(f"❌ خطأ أثناء التهيئة: {e}")
+            return False
+
+def init_db(retry=INIT_RETRY):
+    """
+    السجل المؤجل يبدأ مهما كانت نتيجة فحص الجداول (التفريغ يعيد المحاولة بنفسه)
+    حتى لا تبقى كتابات الأدمن محلية إلى الإيقاف بسبب 429 عابر عند البدء.
+    فحص الجداول الفاشل يُعاد في نفس الخيط بمهلة متضاعفة حتى ينجح أو يُغلق التطبيق.
+    """
+    if JOURNAL:
+        JOURNAL.start()
+    _INIT_STOP.clear()
+    ready = init_schema()
+    start_materials_refresher()
+    delay = retry
+    while not ready and retry > 0:
+        if _INIT_STOP.wait(delay):
+            return
+        ready = init_schema()
+        delay = min(delay * 2, INIT_MAX_RETRY)
+
+def start(background=True):
+    """
+    بدء سريع: تحميل لقطة المواد من القرص فوراً، ثم init_db (فحص الجداول
+    والمزامنة مع المصدر) في خيط خلفي حتى يبدأ استقبال الطلبات مباشرة.
+    """
+    load_materials_snapshot()
+    if background:
+        threading.Thread(target=init_db, name="init-db", daemon=True).start()
+    else:
+        init_db(retry=0)  # بدون انتظار: المُستدعي يقرر عند الفشل
+
+def close():
+    """تفريغ الكتابات المعلّقة قبل الإيقاف."""
+    _INIT_STOP.set()
+    stop_materials_refresher()
+    if JOURNAL:
+        JOURNAL.stop()
 
 # ========== مواد دائمة ==========
+@_operation
 def add_material(semester, course, type_, file_id):
     """
     إضافة مادة جديدة للنظام
@@ -92,129 +121,303 @@ def add_material(semester, course, type_, file_id):
     type_: نوع الملف (pdf, video, reference)
     file_id: معرف الملف في تلجرام
     """
+    add_materials([(semester, course, type_, file_id)])
+
+@_operation
+def add_materials(items):
+    """
+    إضافة مجموعة مواد بطلب append_rows واحد وتحت قفل واحد
+    (أو بقيد واحد في سجل الكتابة المؤجلة إن كان مفعّلاً).
+    items: قائمة (semester, course, type_, file_id) أو مع بيانات الملف
+           (semester, course, type_, file_id, file_name, file_size, file_unique_id)
+    يعيد نتيجة لكل صف بنفس الترتيب: {"file_id", "ok", "error"}
+    """
+    results = []
+    rows = []
+    seen = set()
+    created_at = datetime.utcnow().isoformat()
+    for semester, course, type_, file_id, *meta in items:
+        file_name, file_size, unique_id = (list(meta) + ["", "", ""])[:3]
+        result = {"file_id": file_id, "ok": False, "error": None}
+        results.append(result)
+        if not (semester and course and type_ and file_id):
+            result["error"] = "missing fields"
+        elif file_id in seen or (unique_id and unique_id in seen):
+            result["error"] = "duplicate"
+        else:
+            seen.update(filter(None, (file_id, unique_id)))
+            rows.append((result, [semester, course, type_, file_id, created_at,
+                                  file_name or "", "" if file_size is None else str(file_size),
+                                  unique_id or ""]))
+    if not rows:
+        return results
+
     with LOCK:
         try:
-            sheet = client.open(GOOGLE_SHEET_NAME).worksheet("materials")
-            created_at = datetime.utcnow().isoformat()
-            sheet.append_row([semester, course, type_, file_id, created_at])
-            # تحديث الكاش
-            _cache.pop("materials", None)
-            _cache.pop(f"materials_{semester}_{course}_{type_}", None)
+            if JOURNAL:
+                JOURNAL.append_materials([values for _, values in rows])
+            else:
+                STORAGE.append_materials([values for _, values in rows])
         except Exception as e:
-            print(f"❌ خطأ أثناء إضافة المادة: {e}")
+            print(f"❌ خطأ أثناء إضافة المواد: {e}")
+            for result, _ in rows:
+                result["error"] = str(e)
+            return results
+        for result, _ in rows:
+            result["ok"] = True
+        FILES.remember([(values[3], values[7], values[6]) for _, values in rows if values[7]])
+        # تحديث الفهرس مرة واحدة للدفعة كلها (إن كان محمّلاً؛ وإلا ستُقرأ الصفوف عند التحميل)
+        if MATERIALS.loaded:
+            MATERIALS.add_many([dict(zip(MATERIAL_FIELDS, values)) for _, values in rows])
+    return results
 
-def get_materials(semester, course, type_, use_cache=False):
+@_operation
+def import_materials(rows):
     """
-    جلب المواد من قاعدة البيانات
+    كتابة دفعة استيراد (قيم بترتيب MATERIAL_FIELDS) مباشرة للتخزين بطلب واحد،
+    بدون السجل المؤجل: الاستيراد يتقدم فقط بعد تأكيد الكتابة في المصدر.
     """
-    key = f"materials_{semester}_{course}_{type_}"
-    
-    if use_cache:
-        cached = _get_cache(key)
-        if cached:
-            return cached
-    
-    rows = _fetch_materials_from_sheet()
-    results = [
-        {"semester": row.get("semester"), "course": row.get("course"),
-         "type": row.get("type"), "file_id": row.get("file_id"),
-         "created_at": row.get("created_at")}
-        for row in rows
-        if str(row.get("semester")) == str(semester) 
-        and str(row.get("course")) == str(course) 
-        and str(row.get("type")) == str(type_)
-    ]
-    
-    if use_cache:
-        _set_cache(key, results)
-    
-    return results
+    if not rows:
+        return
+    with LOCK:
+        STORAGE.append_materials(rows)
+        if MATERIALS.loaded:
+            MATERIALS.add_many([dict(zip(MATERIAL_FIELDS, values)) for values in rows])
+        unique = MATERIAL_FIELDS.index("file_unique_id")
+        FILES.remember([(values[3], values[unique], values[6]) for values in rows if values[unique]])
 
-def _fetch_materials_from_sheet():
-    """جلب جميع المواد من الورقة"""
+@_operation
+def existing_material_ids(keys):
+    """
+    للاستيراد: ({(المفتاح، file_id)}, {(المفتاح، file_unique_id)}) الموجودة في مفاتيح keys.
+    من الفهرس في الذاكرة إن كان محمّلاً (بدون نسخة ثانية من الكتالوج)، وإلا من المصدر.
+    """
+    if not MATERIALS.loaded:
+        return STORAGE.existing_ids(keys)
+    file_ids, unique_ids = set(), set()
+    for key in keys:
+        for row in MATERIALS.get(*key):
+            file_ids.add((key, row.get("file_id")))
+            if row.get("file_unique_id"):
+                unique_ids.add((key, row.get("file_unique_id")))
+    return file_ids, unique_ids
+
+def export_materials():
+    """كل صفوف المواد للتصدير: من الفهرس في الذاكرة إن كان محمّلاً (بدون طلب للمصدر)."""
+    if MATERIALS.loaded:
+        return MATERIALS.rows()
+    return STORAGE.iter_materials()
+
+@_operation
+def rebuild_materials_index(if_unloaded=False, if_changed=False):
+    """
+    إعادة بناء فهرس المواد من محرك التخزين (قراءة واحدة) واستبداله دفعة واحدة.
+    عند الفشل يبقى الفهرس السابق كما هو.
+    if_unloaded=True: لا شيء إن كان الفهرس قد حُمّل (من طلب آخر سبقنا للقفل).
+    if_changed=True: لا تنزيل إن لم تتغير نسخة المصدر منذ آخر تحميل.
+    """
     with LOCK:
+        if if_unloaded and MATERIALS.loaded:
+            return True
         try:
-            sheet = client.open(GOOGLE_SHEET_NAME).worksheet("materials")
-            return sheet.get_all_records()
+            # النسخة تُقرأ قبل الصفوف: أي تغيير أثناء التنزيل يُلتقط في الدورة التالية
+            version = STORAGE.source_version()
+            if (if_changed and MATERIALS.loaded and version is not None
+                    and version == MATERIALS.source_version):
+                return True
+            if JOURNAL:
+                # نمنع التفريغ أثناء القراءة حتى لا تضيع أو تتكرر الصفوف المعلّقة
+                with JOURNAL.flush_lock:
+                    rows = STORAGE.fetch_materials()
+                    pending = [dict(zip(MATERIAL_FIELDS, values)) for values in JOURNAL.pending_material_rows()]
+                MATERIALS.load(rows + pending, version)
+            else:
+                rows = STORAGE.fetch_materials()
+                MATERIALS.load(rows, version)
         except Exception as e:
-            print(f"❌ خطأ أثناء جلب المواد: {e}")
-            return []
+            print(f"❌ خطأ أثناء بناء فهرس المواد: {e}")
+            return False
+        _save_materials_snapshot(rows, version)
+        return True
+
+def _save_materials_snapshot(rows, version):
+    """حفظ صفوف المصدر (بدون المعلّقة في السجل) بكتابة ذرية: ملف مؤقت ثم استبدال."""
+    if not MATERIALS_SNAPSHOT_PATH:
+        return
+    tmp = MATERIALS_SNAPSHOT_PATH + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"source_version": version, "saved_at": datetime.utcnow().isoformat(),
+                       "rows": [{k: row.get(k) for k in MATERIAL_FIELDS} for row in rows]},
+                      f, ensure_ascii=False)
+        os.replace(tmp, MATERIALS_SNAPSHOT_PATH)
+    except Exception as e:
+        print(f"❌ خطأ أثناء حفظ لقطة المواد: {e}")
+
+def load_materials_snapshot():
+    """
+    تحميل الفهرس من آخر لقطة محلية (مع الكتابات المعلّقة في السجل).
+    الخيط الخلفي يقارن نسختها بالمصدر لاحقاً ويحدّث إن لزم.
+    """
+    if not MATERIALS_SNAPSHOT_PATH or not os.path.exists(MATERIALS_SNAPSHOT_PATH):
+        return False
+    with LOCK:
+        if MATERIALS.loaded:
+            return True
+        try:
+            with open(MATERIALS_SNAPSHOT_PATH, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            rows = snapshot["rows"]
+            if JOURNAL:
+                rows = rows + [dict(zip(MATERIAL_FIELDS, values)) for values in JOURNAL.pending_material_rows()]
+            MATERIALS.load(rows, snapshot.get("source_version"))
+            return True
+        except Exception as e:
+            print(f"❌ خطأ أثناء قراءة لقطة المواد: {e}")
+            return False
+
+def _refresh_loop():
+    while True:
+        rebuild_materials_index(if_changed=True)
+        if _REFRESH_STOP.wait(MATERIALS_REFRESH_INTERVAL):
+            return
+
+def start_materials_refresher():
+    """تحميل الفهرس ثم متابعة تغيّرات المصدر في الخلفية (طلبات القراءة لا تنتظر Google)."""
+    global _refresher
+    if _refresher is not None or MATERIALS_REFRESH_INTERVAL <= 0:
+        return
+    _REFRESH_STOP.clear()
+    _refresher = threading.Thread(target=_refresh_loop, name="materials-refresher", daemon=True)
+    _refresher.start()
+
+def stop_materials_refresher():
+    global _refresher
+    if _refresher is not None:
+        _REFRESH_STOP.set()
+        _refresher.join(timeout=5)
+        _refresher = None
+
+@_operation
+def get_materials(semester, course, type_, use_cache=False):
+    """
+    جلب المواد من الفهرس في الذاكرة (O(1) بدون طلب شبكة).
+    use_cache=False يقرأ مباشرة من محرك التخزين.
+    StorageUnavailable إن لم يكن الفهرس محمّلاً وتعذر تحميله (بدل إرجاع قائمة فارغة).
+    """
+    if not use_cache:
+        results = STORAGE.get_materials(semester, course, type_)
+        if JOURNAL:
+            key = material_key(semester, course, type_)
+            results += [dict(zip(MATERIAL_FIELDS, values)) for values in JOURNAL.pending_material_rows()
+                        if material_key(*values[:3]) == key]
+        return _live(results)
+    if not MATERIALS.loaded:
+        # الطلبات المتزامنة تنتظر نفس التحميل بدل تكرار القراءة
+        if not rebuild_materials_index(if_unloaded=True):
+            raise StorageUnavailable("materials index is not loaded")
+    return _live(MATERIALS.get(semester, course, type_))
+
+def _live(rows):
+    """الصفوف بدون الملفات المعزولة (نفس الترتيب تستخدمه القوائم والبحث)."""
+    dead = FILES.dead
+    if not dead:
+        return rows
+    return [row for row in rows if row.get("file_id") not in dead]
+
+def find_duplicate(semester, course, type_, file_unique_id):
+    """
+    صف موجود لنفس الملف (file_unique_id) في المقرر والنوع، أو None.
+    الصفوف المعزولة لا تُحسب حتى يستطيع الأدمن إعادة رفع الملف التالف.
+    """
+    if not file_unique_id:
+        return None
+    for row in _live(MATERIALS.get(semester, course, type_)):
+        if (row.get("file_unique_id") or FILES.unique_id(row.get("file_id"))) == file_unique_id:
+            return row
+    return None
+
+def _search_text(key, row):
+    semester, course, type_ = key
+    return " ".join([course, type_, menu.TYPE_LABELS.get(type_, ""), menu.SEMESTER_LABELS.get(semester, ""),
+                     str(row.get("file_name") or "")])
+
+@_operation
+def search_materials(query, limit=10):
+    """
+    بحث نصي في المواد من الذاكرة فقط (بدون طلب للمصدر).
+    يعيد [(semester, course, type, الترتيب داخل قائمة المقرر، الصف)].
+    """
+    if not MATERIALS.loaded and not rebuild_materials_index(if_unloaded=True):
+        raise StorageUnavailable("materials index is not loaded")
+    version = (MATERIALS.version, FILES.dead_version)
+    if SEARCH.version != version:
+        with _SEARCH_LOCK:
+            version = (MATERIALS.version, FILES.dead_version)
+            if SEARCH.version != version:
+                SEARCH.build([(key, _live(rows)) for key, rows in MATERIALS.groups()], _search_text, version)
+    return [(*key, position, row) for key, position, row in SEARCH.search(query, limit)]
 
 # ======= الملفات المؤقتة =======
+def _current_waiting(chat_id):
+    """صف المحادثة كما سيكون بعد تفريغ الكتابات المعلّقة."""
+    if JOURNAL:
+        pending = JOURNAL.pending_waiting(chat_id)
+        if pending is not NOT_PENDING:
+            return pending
+    return STORAGE.get_waiting(chat_id)
+
+def _put_waiting(chat_id, file_id="", type_="", semester=""):
+    row = {"chat_id": chat_id, "file_id": file_id or "", "type": type_ or "", "semester": semester or ""}
+    if JOURNAL:
+        JOURNAL.put_waiting(chat_id, row)
+    else:
+        STORAGE.upsert_waiting(chat_id, file_id, type_, semester)
+    # نعرف القيمة الجديدة: تُكتب في الكاش بدل إسقاطه وإعادة قراءتها
+    WAITING_CACHE.set(chat_id, row)
+
+def _delete_waiting(chat_id):
+    if JOURNAL:
+        JOURNAL.put_waiting(chat_id, None)
+    else:
+        STORAGE.delete_waiting(chat_id)
+    WAITING_CACHE.set(chat_id, None)
+
+@_operation
 def set_waiting_file(chat_id, flag):
     """تعيين أو إلغاء حالة انتظار ملف"""
-    with LOCK:
-        sheet = client.open(GOOGLE_SHEET_NAME).worksheet("waiting_files")
-        all_rows = sheet.get_all_records()
-        if not flag:
-            new_rows = [r for r in all_rows if str(r.get("chat_id")) != str(chat_id)]
-            sheet.clear()
-            sheet.append_row(["chat_id", "file_id", "type", "semester"])
-            for row in new_rows:
-                sheet.append_row([row.get("chat_id"), row.get("file_id"), 
-                                row.get("type"), row.get("semester") or ""])
-        else:
-            for r in all_rows:
-                if str(r.get("chat_id")) == str(chat_id):
-                    return
-            sheet.append_row([chat_id, "", "", ""])
-        _cache.pop(f"waiting_file_{chat_id}", None)
-        _cache.pop(f"waiting_data_{chat_id}", None)
+    if not flag:
+        _delete_waiting(chat_id)
+    elif _current_waiting(chat_id) is None:
+        _put_waiting(chat_id)
 
+@_operation
 def set_waiting_file_fileid(chat_id, file_id, type_, semester=None):
     """تحديث معلومات الملف المؤقت"""
-    with LOCK:
-        sheet = client.open(GOOGLE_SHEET_NAME).worksheet("waiting_files")
-        all_rows = sheet.get_all_records()
-        for i, row in enumerate(all_rows, start=2):
-            if str(row.get("chat_id")) == str(chat_id):
-                sheet.update(f"A{i}:D{i}", [[chat_id, file_id, type_, semester or ""]])
-                _cache.pop(f"waiting_data_{chat_id}", None)
-                return
-        sheet.append_row([chat_id, file_id, type_, semester or ""])
-        _cache.pop(f"waiting_data_{chat_id}", None)
+    _put_waiting(chat_id, file_id, type_, semester or "")
 
+@_operation
 def set_waiting_file_semester(chat_id, semester):
     """تحديث السمستر للملف المؤقت"""
-    with LOCK:
-        sheet = client.open(GOOGLE_SHEET_NAME).worksheet("waiting_files")
-        all_rows = sheet.get_all_records()
-        for i, row in enumerate(all_rows, start=2):
-            if str(row.get("chat_id")) == str(chat_id):
-                sheet.update(f"D{i}:D{i}", [[semester]])
-                _cache.pop(f"waiting_data_{chat_id}", None)
-                return
+    row = _current_waiting(chat_id)
+    if row is not None:
+        _put_waiting(chat_id, row.get("file_id"), row.get("type"), semester)
 
+@_operation
 def is_waiting_file(chat_id, use_cache=False):
     """التحقق من وجود حالة انتظار"""
-    key = f"waiting_file_{chat_id}"
     if use_cache:
-        cached = _get_cache(key)
-        if cached is not None:
-            return cached
-    with LOCK:
-        sheet = client.open(GOOGLE_SHEET_NAME).worksheet("waiting_files")
-        rows = sheet.get_all_records()
-        exists = any(str(r.get("chat_id")) == str(chat_id) for r in rows)
-    if use_cache:
-        _set_cache(key, exists)
-    return exists
+        return WAITING_CACHE.get_or_load(chat_id, lambda: _current_waiting(chat_id)) is not None
+    return _current_waiting(chat_id) is not None
 
+@_operation
 def get_waiting_file(chat_id, use_cache=False):
     """جلب بيانات الملف المؤقت"""
-    key = f"waiting_data_{chat_id}"
     if use_cache:
-        cached = _get_cache(key)
-        if cached:
-            return cached
-    with LOCK:
-        sheet = client.open(GOOGLE_SHEET_NAME).worksheet("waiting_files")
-        rows = sheet.get_all_records()
-        for r in rows:
-            if str(r.get("chat_id")) == str(chat_id):
-                result = {"file_id": r.get("file_id"), "type": r.get("type"), 
-                         "semester": r.get("semester")}
-                if use_cache:
-                    _set_cache(key, result)
-                return result
-    return None
+        r = WAITING_CACHE.get_or_load(chat_id, lambda: _current_waiting(chat_id))
+    else:
+        r = _current_waiting(chat_id)
+    if r is None:
+        return None
+    return {"file_id": r.get("file_id"), "type": r.get("type"),
+            "semester": r.get("semester")}
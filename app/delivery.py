@@ -0,0 +1,134 @@
+import os
+import asyncio
+import logging
+import random
+from collections import OrderedDict
+from app.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# ===== حدود Telegram (قابلة للتعديل من البيئة) =====
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "28"))     # رسالة/ثانية لكل البوت
+CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))          # رسالة/ثانية لكل محادثة
+CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "5"))
+MEDIA_GROUP_SIZE = 10  # أقصى عدد عناصر في sendMediaGroup
+MAX_CHAT_BUCKETS = 10000
+
+
+def media_kind(content_type):
+    """نوع الوسائط في Telegram حسب نوع المحتوى في قاعدة البيانات."""
+    return "video" if content_type == "video" else "document"
+
+
+def plan_requests(chat_id, file_ids, content_type):
+    """
+    تقسيم الملفات إلى طلبات: ألبومات sendMediaGroup حتى 10 ملفات،
+    والملف المنفرد يُرسل بـ sendDocument / sendVideo.
+    يعيد قائمة (method, payload, file_ids).
+    """
+    kind = media_kind(content_type)
+    single = "sendVideo" if kind == "video" else "sendDocument"
+    out = []
+    for i in range(0, len(file_ids), MEDIA_GROUP_SIZE):
+        chunk = file_ids[i:i + MEDIA_GROUP_SIZE]
+        if len(chunk) == 1:
+            out.append((single, {"chat_id": chat_id, kind: chunk[0]}, chunk))
+        else:
+            media = [{"type": kind, "media": fid} for fid in chunk]
+            out.append(("sendMediaGroup", {"chat_id": chat_id, "media": media}, chunk))
+    return out
+
+
+class DeliveryScheduler:
+    """
+    مُجدول الإرسال الصادر: يحترم حد البوت العام وحد كل محادثة،
+    ويعيد المحاولة عند 429 حسب retry_after وعند أخطاء الشبكة/الخادم.
+    """
+
+    def __init__(self, client, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE,
+                 chat_burst=CHAT_BURST, max_retries=MAX_RETRIES):
+        self.client = client
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets = OrderedDict()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+            if len(self._chat_buckets) > MAX_CHAT_BUCKETS:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def call(self, chat_id, method, payload, cost=1, bucket=None):
+        """
+        إرسال طلب واحد مع احترام الحدود وإعادة المحاولة. يعيد رد Telegram.
+        cost: عدد الرسائل التي يحسبها Telegram للطلب (عناصر الألبوم).
+        bucket: دلو إضافي اختياري (مثل حصة البث) يُؤخذ منه أولاً ويُوقف كله عند 429.
+        """
+        chat_bucket = self._chat_bucket(chat_id)
+        r = {"ok": False}
+        for attempt in range(self.max_retries + 1):
+            if bucket is not None:
+                await bucket.acquire(cost)
+            await self.global_bucket.acquire(cost)
+            await chat_bucket.acquire(cost)
+            r = await self.client.call(method, payload)
+            if r.get("ok"):
+                return r
+            code = r.get("error_code")
+            if code == 429:
+                retry_after = (r.get("parameters") or {}).get("retry_after", 1)
+                logger.warning(f"{method} to {chat_id} throttled, retry after {retry_after}s")
+                # الانتظار يتم مرة واحدة عبر الدلو في المحاولة التالية (ويشمل بقية الإرسال لنفس المحادثة)
+                chat_bucket.penalize(retry_after)
+                if bucket is not None:
+                    bucket.penalize(retry_after)
+                continue
+            if code is None or code >= 500:
+                # خطأ شبكة أو خادم: تراجع أُسّي مع عشوائية
+                await asyncio.sleep(min(30, 0.5 * 2 ** attempt) * (0.5 + random.random()))
+                continue
+            return r  # خطأ نهائي (400/403...) لا فائدة من إعادته
+        return r
+
+    async def send_materials(self, chat_id, file_ids, content_type, progress=None):
+        """
+        إرسال قائمة ملفات على شكل ألبومات.
+        progress: دالة async اختيارية تُستدعى (done, total, sent) بعد كل طلب.
+        يعيد {"sent": n, "failed": [file_ids], "requests": n}.
+        """
+        plan = plan_requests(chat_id, file_ids, content_type)
+        report = {"sent": 0, "failed": [], "requests": 0}
+        for done, (method, payload, chunk) in enumerate(plan, start=1):
+            # Telegram يحسب كل عنصر في الألبوم رسالة مستقلة
+            r = await self.call(chat_id, method, payload, cost=len(chunk))
+            report["requests"] += 1
+            if r.get("ok"):
+                report["sent"] += len(chunk)
+            elif method == "sendMediaGroup":
+                # ملف واحد تالف يُسقط الألبوم كله: نعيد الإرسال فرادى حتى لا يضيع الباقي
+                await self._send_singly(chat_id, chunk, content_type, report)
+            else:
+                report["failed"].extend(chunk)
+            if progress:
+                await progress(done, len(plan), report["sent"])
+        return report
+
+    async def _send_singly(self, chat_id, chunk, content_type, report):
+        kind = media_kind(content_type)
+        method = "sendVideo" if kind == "video" else "sendDocument"
+        for fid in chunk:
+            r = await self.call(chat_id, method, {"chat_id": chat_id, kind: fid})
+            report["requests"] += 1
+            if r.get("ok"):
+                report["sent"] += 1
+            else:
+                logger.warning(f"Failed to deliver {fid} to {chat_id}: {r.get('description')}")
+                report["failed"].append(fid)
@@ -0,0 +1,138 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+MAX_QUEUED_UPDATES = int(os.getenv("MAX_QUEUED_UPDATES", "10000"))
+SEEN_UPDATES = int(os.getenv("SEEN_UPDATES", "20000"))  # حجم ذاكرة update_id لكشف التكرار
+
+
+def update_chat_id(update):
+    """معرّف المحادثة التي يخصها التحديث (للترتيب داخل المحادثة)."""
+    for field in ("message", "edited_message", "channel_post"):
+        if field in update:
+            return update[field].get("chat", {}).get("id")
+    if "callback_query" in update:
+        cq = update["callback_query"]
+        return (cq.get("message") or {}).get("chat", {}).get("id") or cq.get("from", {}).get("id")
+    for field in ("inline_query", "chosen_inline_result"):
+        if field in update:
+            return update[field].get("from", {}).get("id")
+    return None
+
+
+class UpdateDispatcher:
+    """
+    طابور التحديثات: الـ webhook يضيف التحديث ويرد فوراً، ومجموعة عمال
+    تعالج التحديثات بالترتيب داخل كل محادثة وبالتوازي بين المحادثات.
+    التحديثات المكررة (نفس update_id) تُهمل.
+    """
+
+    def __init__(self, handler, workers=UPDATE_WORKERS, max_queued=MAX_QUEUED_UPDATES,
+                 seen_size=SEEN_UPDATES):
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.seen_size = seen_size
+        self._seen = OrderedDict()
+        self._pending = {}        # chat_id -> deque[(وقت الإضافة، التحديث)]
+        self._scheduled = set()   # محادثات في طابور الجاهزية أو قيد المعالجة
+        self._ready = None
+        self._tasks = []
+        self.queued = 0
+        self.in_flight = 0
+        self.processed = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.failed = 0
+        self.last_lag = 0.0
+
+    # ----- الإضافة -----
+    def _is_duplicate(self, update_id):
+        if update_id is None:
+            return False
+        if update_id in self._seen:
+            self._seen.move_to_end(update_id)
+            return True
+        self._seen[update_id] = None
+        if len(self._seen) > self.seen_size:
+            self._seen.popitem(last=False)
+        return False
+
+    def submit(self, update):
+        """
+        إضافة تحديث للطابور. يعيد "queued" أو "duplicate" أو "full"
+        (عند الامتلاء لا يُسجَّل update_id حتى يقبله Telegram عند إعادة الإرسال).
+        """
+        if self.queued >= self.max_queued:
+            self.rejected += 1
+            return "full"
+        if self._is_duplicate(update.get("update_id")):
+            self.duplicates += 1
+            return "duplicate"
+        key = update_chat_id(update)
+        self._pending.setdefault(key, deque()).append((time.monotonic(), update))
+        self.queued += 1
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            self._ready.put_nowait(key)
+        return "queued"
+
+    # ----- العمال -----
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            queue = self._pending[key]
+            enqueued_at, update = queue.popleft()
+            self.queued -= 1
+            self.in_flight += 1
+            self.last_lag = time.monotonic() - enqueued_at
+            try:
+                await self.handler(update)
+            except Exception as e:
+                self.failed += 1
+                logger.exception(f"Update {update.get('update_id')} failed: {e}")
+            finally:
+                self.in_flight -= 1
+                self.processed += 1
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+                    self._scheduled.discard(key)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=10):
+        """انتظار تفريغ الطابور (حتى timeout) ثم إيقاف العمال."""
+        deadline = time.monotonic() + timeout
+        while (self.queued or self.in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        now = time.monotonic()
+        oldest = min((q[0][0] for q in list(self._pending.values()) if q), default=None)
+        return {
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "chats_pending": len(self._pending),
+            "oldest_lag_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+            "last_lag_seconds": round(self.last_lag, 3),
+            "processed": self.processed,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "workers": self.workers,
+        }
@@ -0,0 +1,222 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from app.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# ===== إعدادات فحص الملفات =====
+FILES_DB_PATH = os.getenv("FILES_DB_PATH", "./medbot-files.db")
+FILE_CHECK_INTERVAL = float(os.getenv("FILE_CHECK_INTERVAL", "600"))   # ثواني بين الدفعات
+FILE_CHECK_BATCH = int(os.getenv("FILE_CHECK_BATCH", "60"))            # ملفات في كل دفعة
+FILE_CHECK_RATE = float(os.getenv("FILE_CHECK_RATE", "1"))             # طلب getFile/ثانية
+FILE_RECHECK_AGE = float(os.getenv("FILE_RECHECK_DAYS", "7")) * 86400  # إعادة فحص الملفات السليمة
+FILE_DEAD_AFTER = int(os.getenv("FILE_DEAD_AFTER", "2"))               # فشل متتالٍ قبل العزل
+
+OK, UNKNOWN, DEAD = "ok", "unknown", "dead"
+
+
+class FileRegistry:
+    """
+    حالة كل file_id في ملف SQLite محلي: file_unique_id والحجم ونتيجة آخر فحص.
+    الملفات المعزولة (dead) و file_unique_id محفوظة أيضاً في الذاكرة
+    لأن التسليم ورفع الملفات يسألان عنها في المسار الساخن.
+    """
+
+    def __init__(self, path=FILES_DB_PATH, dead_after=FILE_DEAD_AFTER):
+        self.dead_after = dead_after
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "file_id TEXT PRIMARY KEY, file_unique_id TEXT NOT NULL DEFAULT '', "
+            "file_size INTEGER, status TEXT NOT NULL DEFAULT 'unknown', "
+            "failures INTEGER NOT NULL DEFAULT 0, checked REAL, error TEXT NOT NULL DEFAULT '')"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.dead = set()
+        self.dead_version = 0   # يتغير مع كل تعديل في self.dead (لإعادة بناء فهرس البحث)
+        self._unique = {}       # file_id -> file_unique_id
+        for file_id, unique_id, status in self._conn.execute(
+                "SELECT file_id, file_unique_id, status FROM files"):
+            if status == DEAD:
+                self.dead.add(file_id)
+            if unique_id:
+                self._unique[file_id] = unique_id
+
+    def unique_id(self, file_id):
+        return self._unique.get(file_id)
+
+    def sync(self, file_ids):
+        """تسجيل الملفات الجديدة في الفهرس كـ unknown (الموجودة لا تتغير)."""
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO files (file_id) VALUES (?)",
+                                   [(file_id,) for file_id in file_ids])
+            self._conn.commit()
+
+    def remember(self, items):
+        """
+        ملفات رُفعت للتو (Telegram أعطانا file_unique_id والحجم فهي سليمة).
+        ملف معزول يُرفع أو يُستورد من جديد يخرج من العزل.
+        items: [(file_id, file_unique_id, file_size)]
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO files (file_id, file_unique_id, file_size, status, checked) "
+                "VALUES (?, ?, ?, 'ok', ?) ON CONFLICT (file_id) DO UPDATE SET "
+                "file_unique_id = excluded.file_unique_id, file_size = excluded.file_size, "
+                "status = 'ok', failures = 0, checked = excluded.checked, error = ''",
+                [(file_id, unique_id or "", size or None, now) for file_id, unique_id, size in items])
+            self._conn.commit()
+            for file_id, unique_id, _ in items:
+                if unique_id:
+                    self._unique[file_id] = unique_id
+            revived = self.dead & {file_id for file_id, _, _ in items}
+            if revived:
+                self.dead = self.dead - revived
+                self.dead_version += 1
+
+    def due(self, limit, recheck_age=FILE_RECHECK_AGE):
+        """
+        الملفات التي تحتاج فحصاً: لم تُفحص بعد، أو فشلت مؤخراً، أو مر على
+        فحصها recheck_age. المعزولة لا تُعاد.
+        """
+        with self._lock:
+            return [file_id for (file_id,) in self._conn.execute(
+                "SELECT file_id FROM files WHERE status != 'dead' "
+                "AND (checked IS NULL OR failures > 0 OR checked < ?) ORDER BY checked LIMIT ?",
+                (time.time() - recheck_age, limit))]
+
+    def suspect(self, file_id):
+        """فشل إرسال الملف لطالب: تقديمه في الدفعة التالية."""
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO files (file_id) VALUES (?)", (file_id,))
+            self._conn.execute("UPDATE files SET checked = NULL WHERE file_id = ? AND status != 'dead'",
+                               (file_id,))
+            self._conn.commit()
+
+    def record(self, results):
+        """
+        حفظ نتائج دفعة فحص: [(file_id, ok, file_unique_id, file_size, error)].
+        الملف يُعزل بعد dead_after فشلاً متتالياً. يعيد الملفات التي عُزلت الآن.
+        """
+        now = time.time()
+        quarantined = []
+        with self._lock:
+            for file_id, ok, unique_id, size, error in results:
+                if ok:
+                    self._conn.execute(
+                        "UPDATE files SET status = 'ok', failures = 0, checked = ?, error = '', "
+                        "file_unique_id = COALESCE(NULLIF(?, ''), file_unique_id), "
+                        "file_size = COALESCE(?, file_size) WHERE file_id = ?",
+                        (now, unique_id or "", size, file_id))
+                    if unique_id:
+                        self._unique[file_id] = unique_id
+                    continue
+                self._conn.execute("UPDATE files SET failures = failures + 1, checked = ?, error = ? "
+                                   "WHERE file_id = ?", (now, error or "", file_id))
+                failures = self._conn.execute("SELECT failures FROM files WHERE file_id = ?",
+                                              (file_id,)).fetchone()
+                if failures and failures[0] >= self.dead_after:
+                    self._conn.execute("UPDATE files SET status = 'dead' WHERE file_id = ?", (file_id,))
+                    quarantined.append(file_id)
+            self._conn.commit()
+            if quarantined:
+                self.dead = self.dead | set(quarantined)
+                self.dead_version += 1
+        return quarantined
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in (OK, UNKNOWN, DEAD)}
+
+
+def classify(r):
+    """
+    (ok, file_unique_id, file_size, error) من رد getFile، أو None لخطأ مؤقت
+    (429 / 5xx / شبكة) لا يُحكم به على الملف.
+    """
+    if r.get("ok"):
+        result = r.get("result") or {}
+        return True, result.get("file_unique_id"), result.get("file_size"), None
+    code = r.get("error_code")
+    description = str(r.get("description") or "")
+    if code == 400:
+        # getFile يرفض الملفات > 20MB لكنها صالحة للإرسال بـ file_id
+        if "too big" in description.lower():
+            return True, None, None, None
+        return False, None, None, description
+    return None
+
+
+class FileChecker:
+    """
+    فحص دوري في الخلفية: كل FILE_CHECK_INTERVAL ثانية يُفحص حتى FILE_CHECK_BATCH
+    ملفاً بـ getFile بمعدل FILE_CHECK_RATE، وتُسجل النتائج في FileRegistry.
+    rows() تعيد صفوف المواد الحالية (لتسجيل الملفات الجديدة قبل كل دفعة).
+    """
+
+    def __init__(self, client, registry, rows, interval=FILE_CHECK_INTERVAL,
+                 batch=FILE_CHECK_BATCH, rate=FILE_CHECK_RATE):
+        self.client = client
+        self.registry = registry
+        self.rows = rows
+        self.interval = interval
+        self.batch = batch
+        self.bucket = TokenBucket(rate, 1)
+        self._task = None
+        self.checked = 0
+        self.quarantined = 0
+
+    async def check_batch(self):
+        """فحص دفعة واحدة. يعيد عدد الملفات التي فُحصت."""
+        file_ids = [row["file_id"] for row in self.rows() if row.get("file_id")]
+        await asyncio.to_thread(self.registry.sync, file_ids)
+        due = await asyncio.to_thread(self.registry.due, self.batch)
+        results = []
+        for file_id in due:
+            await self.bucket.acquire()
+            r = await self.client.call("getFile", {"file_id": file_id})
+            verdict = classify(r)
+            if verdict is None:
+                if r.get("error_code") == 429:
+                    # نتوقف ونكمل في الدفعة التالية بدل منافسة الرسائل على الحصة
+                    self.bucket.penalize((r.get("parameters") or {}).get("retry_after", 1))
+                    break
+                continue
+            results.append((file_id, *verdict))
+        quarantined = await asyncio.to_thread(self.registry.record, results)
+        self.checked += len(results)
+        self.quarantined += len(quarantined)
+        for file_id in quarantined:
+            logger.warning(f"Quarantined dead file_id {file_id}")
+        return len(results)
+
+    async def _run(self):
+        # الدفعة الأولى بعد قليل من بدء التشغيل حتى لا تنافس التحميل والطلبات الأولى
+        await asyncio.sleep(min(60, self.interval))
+        while True:
+            try:
+                await self.check_batch()
+            except Exception as e:
+                logger.warning(f"File check batch failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self):
+        return self.registry.stats() | {"checked": self.checked, "quarantined": self.quarantined}
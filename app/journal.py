@@ -0,0 +1,170 @@
+import json
+import random
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+NOT_PENDING = object()  # لا توجد كتابة معلّقة لهذه المحادثة
+
+
+class WriteBehindJournal:
+    """
+    سجل كتابة مؤجلة (write-behind): كل كتابة تُحفظ أولاً في ملف SQLite محلي
+    ويُرد بالنجاح فوراً، ثم يقوم خيط خلفي بدمج الكتابات وإرسالها للتخزين
+    على دفعات (append_materials / upsert_waiting_many) مع إعادة المحاولة.
+    الكتابات المعلّقة تُعاد عند بدء التشغيل التالي.
+
+    العمليات:
+      materials: قائمة صفوف مواد تُضاف
+      waiting:   الحالة النهائية لصف محادثة (dict) أو None للحذف
+    """
+
+    def __init__(self, path, storage, flush_interval=1.0, linger=0.5, batch_size=500, max_backoff=60):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.linger = linger  # مهلة قصيرة بعد أول كتابة لتجميع ما يليها في نفس الدفعة
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, "
+            "key TEXT, payload TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()        # يحمي الاتصال والنسخة المعلّقة
+        self.flush_lock = threading.Lock()   # عملية تفريغ واحدة في كل مرة
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # chat_id -> (رقم القيد، الصف أو None) لكتابات waiting التي لم تُفرَّغ بعد
+        self._waiting = {}
+        self._load_pending()
+
+    # ----- الكتابة -----
+    def _append(self, op, key, payload):
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO journal (op, key, payload) VALUES (?, ?, ?)",
+                (op, key, json.dumps(payload, ensure_ascii=False)),
+            )
+            self._conn.commit()
+            entry_id = cur.lastrowid
+            if op == "waiting":
+                self._waiting[key] = (entry_id, payload)
+        self._wakeup.set()
+        return entry_id
+
+    def append_materials(self, rows):
+        return self._append("materials", None, rows)
+
+    def put_waiting(self, chat_id, row):
+        """تسجيل الحالة النهائية لصف المحادثة (row=None يعني حذف)."""
+        return self._append("waiting", str(chat_id), row)
+
+    # ----- القراءة -----
+    def _load_pending(self):
+        for entry_id, key, payload in self._conn.execute(
+                "SELECT id, key, payload FROM journal WHERE op = 'waiting' ORDER BY id"):
+            self._waiting[key] = (entry_id, json.loads(payload))
+
+    def pending_waiting(self, chat_id):
+        """الصف المعلّق للمحادثة (أو None إن كان محذوفاً) أو NOT_PENDING."""
+        entry = self._waiting.get(str(chat_id))
+        if entry is None:
+            return NOT_PENDING
+        return dict(entry[1]) if entry[1] is not None else None
+
+    def pending_material_rows(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM journal WHERE op = 'materials' ORDER BY id").fetchall()
+        return [row for (payload,) in rows for row in json.loads(payload)]
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+    # ----- التفريغ -----
+    def _done(self, ids):
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM journal WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+            done = set(ids)
+            for key in [k for k, (entry_id, _) in self._waiting.items() if entry_id in done]:
+                del self._waiting[key]
+
+    def flush(self):
+        """تفريغ دفعة من القيود للتخزين. يعيد عدد القيود المفرَّغة."""
+        with self.flush_lock:
+            with self._lock:
+                entries = self._conn.execute(
+                    "SELECT id, op, key, payload FROM journal ORDER BY id LIMIT ?",
+                    (self.batch_size,)).fetchall()
+            if not entries:
+                return 0
+
+            material_ids, material_rows = [], []
+            waiting_ids, waiting = [], {}
+            for entry_id, op, key, payload in entries:
+                if op == "materials":
+                    material_ids.append(entry_id)
+                    material_rows.extend(json.loads(payload))
+                elif op == "waiting":
+                    waiting_ids.append(entry_id)
+                    waiting[key] = json.loads(payload)  # الأحدث يغلب
+
+            # المواد أولاً، وتُحذف قيودها فور نجاحها حتى لا تتكرر عند إعادة المحاولة
+            if material_rows:
+                self.storage.append_materials(material_rows)
+                self._done(material_ids)
+
+            puts = {row["chat_id"]: row for row in waiting.values() if row is not None}
+            if puts:
+                self.storage.upsert_waiting_many(puts)
+            for key, row in waiting.items():
+                if row is None:
+                    self.storage.delete_waiting(key)
+            self._done(waiting_ids)
+            return len(entries)
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            if self._wakeup.wait(self.flush_interval):
+                self._stop.wait(self.linger)
+            self._wakeup.clear()
+            try:
+                while self.flush():
+                    pass
+                failures = 0
+            except Exception as e:
+                failures += 1
+                delay = min(self.max_backoff, 2 ** failures) * (0.5 + random.random() / 2)
+                logger.warning(f"Journal flush failed ({e!r}), retrying in {delay:.1f}s")
+                self._stop.wait(delay)
+
+    def start(self):
+        """بدء خيط التفريغ (يعيد تشغيل القيود المعلّقة من التشغيل السابق)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="journal-flush", daemon=True)
+            self._thread.start()
+            self._wakeup.set()
+
+    def stop(self, timeout=10):
+        """إيقاف الخيط مع محاولة تفريغ أخيرة."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        try:
+            while self.flush():
+                pass
+        except Exception as e:
+            logger.warning(f"Final journal flush failed, {self.pending_count()} entries kept: {e!r}")
@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# ===== إعدادات السجلات =====
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()            # text | json
+LOG_MAX_LENGTH = int(os.getenv("LOG_MAX_LENGTH", "500"))        # أقصى طول لرسالة واحدة
+LOG_PAYLOAD_SAMPLE = float(os.getenv("LOG_PAYLOAD_SAMPLE", "0.01"))  # نسبة التحديثات التي يُسجل محتواها
+
+# معرّف التحديث الجاري (يُضاف لكل سطر سجل أثناء معالجته)
+UPDATE_ID = ContextVar("update_id", default=None)
+CHAT_ID = ContextVar("chat_id", default=None)
+
+_listener = None
+
+
+@contextmanager
+def correlation(update_id, chat_id=None):
+    """ربط كل السجلات داخل الكتلة بالتحديث (بما فيها دوال run_in_threadpool)."""
+    tokens = (UPDATE_ID.set(update_id), CHAT_ID.set(chat_id))
+    try:
+        yield
+    finally:
+        UPDATE_ID.reset(tokens[0])
+        CHAT_ID.reset(tokens[1])
+
+
+def sampled(rate=None):
+    """True لنسبة rate من الاستدعاءات (لسجلات المحتوى الكثيرة)."""
+    rate = LOG_PAYLOAD_SAMPLE if rate is None else rate
+    return rate >= 1 or random.random() < rate
+
+
+def truncate(value, limit=LOG_MAX_LENGTH):
+    text = value if isinstance(value, str) else repr(value)
+    return text if len(text) <= limit else f"{text[:limit]}…(+{len(text) - limit})"
+
+
+class _ContextFilter(logging.Filter):
+    """يُنفذ في خيط المُستدعي: ينسخ معرّفات الارتباط إلى السجل قبل وضعه في الطابور."""
+
+    def filter(self, record):
+        record.update_id = UPDATE_ID.get()
+        record.chat_id = CHAT_ID.get()
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    لا يُنسّق الرسالة في خيط المُستدعي (QueueHandler الافتراضي يفعل ذلك)؛
+    التنسيق كله يتم في خيط المستمع. الطابور داخل العملية فلا حاجة للتسلسل.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class CompactFormatter(logging.Formatter):
+    """سطر واحد: الوقت المستوى المصدر [u=update c=chat] الرسالة (مقطوعة)."""
+
+    def format(self, record):
+        message = truncate(record.getMessage())
+        ids = []
+        if getattr(record, "update_id", None) is not None:
+            ids.append(f"u={record.update_id}")
+        if getattr(record, "chat_id", None) is not None:
+            ids.append(f"c={record.chat_id}")
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+        line = f"{stamp}.{int(record.msecs):03d} {record.levelname} {record.name}"
+        if ids:
+            line += f" [{' '.join(ids)}]"
+        line += f" {message}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": truncate(record.getMessage()),
+        }
+        if getattr(record, "update_id", None) is not None:
+            data["update_id"] = record.update_id
+        if getattr(record, "chat_id", None) is not None:
+            data["chat_id"] = record.chat_id
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """
+    السجلات تُوضع في طابور ويكتبها خيط خلفي (QueueListener)، فلا يوقف
+    الكتابة على stderr حلقة الأحداث. يُستدعى مرة واحدة؛ الاستدعاءات التالية لا تفعل شيئاً.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else CompactFormatter())
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    handler.addFilter(_ContextFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    # طلبات httpx لـ Telegram تُسجل بمستوى INFO لكل رسالة
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """تفريغ الطابور وإيقاف خيط الكتابة."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,412 +1,771 @@
 import os
-import requests
+import hmac
+import math
+import asyncio
 import logging
-from fastapi import FastAPI, Header, HTTPException
-from app import crud
-
-# ========= Logging مفصل =========
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from app import crud, cache, metrics, logs, bulk
+from app.telegram import TelegramClient
+from app.delivery import DeliveryScheduler, media_kind
+from app.dispatcher import UpdateDispatcher, update_chat_id
+from app.broadcast import BroadcastStore, Broadcaster
+from app.ratelimit import KeyedThrottle
+from app.filecheck import FileChecker
+from app.state import Session, StateNamespace, get_state_store
+from app.storage import StorageUnavailable
+from app import menu
+
+# ========= Logging (طابور + خيط كتابة خلفي، LOG_LEVEL / LOG_FORMAT) =========
+logs.setup_logging()
 logger = logging.getLogger(__name__)
 
 # ========= الإعدادات الأساسية =========
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", None)
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")  # لنقاط /admin (معطلة إن لم يُضبط)
 ADMIN_USERNAME = "@Mgdad_Ali"
-TELEGRAM_API = f"https://api.telegram.org/bot{BOT_TOKEN}"
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))  # ثواني يحتفظ بها Telegram بنتائج البحث المضمن
+
+# حد التحديثات لكل محادثة قبل الطابور (الأدمن مستثنى)
+CHAT_UPDATES_PER_MINUTE = float(os.getenv("CHAT_UPDATES_PER_MINUTE", "30"))
+CHAT_UPDATES_BURST = float(os.getenv("CHAT_UPDATES_BURST", "12"))
+CHAT_COOLDOWN = float(os.getenv("CHAT_COOLDOWN", "20"))  # ثواني إيقاف المحادثة بعد التجاوز
+
+# عميل Telegram مشترك (اتصالات keep-alive + حد للطلبات المتزامنة)
+tg = TelegramClient(BOT_TOKEN)
+# مُجدول الإرسال (حدود Telegram + إعادة المحاولة عند 429)
+delivery = DeliveryScheduler(tg)
 
 app = FastAPI(title="Med Faculty Bot")
 
 @app.on_event("startup")
 async def startup():
-    crud.init_db()
-    logger.info("✅ Database initialized successfully.")
+    # لقطة المواد من القرص فقط؛ فحص الجداول والمزامنة تكمل في الخلفية
+    await run_in_threadpool(crud.start)
+    logger.info("✅ Materials snapshot loaded, database init running in background.")
+    dispatcher.start()
+    broadcaster.start()
+    file_checker.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await dispatcher.stop()
+    await broadcaster.stop()
+    await file_checker.stop()
+    await tg.close()
+    await run_in_threadpool(crud.close)
+
+# ========= مخزن الحالة (داخل العملية أو مشترك حسب STATE_BACKEND) =========
+STATE_STORE = get_state_store()
 
 # ========= إدارة رفع الملفات المتعددة للأدمن =========
-UPLOAD_SESSION = {}  # keyed by chat_id -> {"semester":..., "course":..., "type":..., "files": [file_id1, file_id2, ...]}
+UPLOAD_SESSION = StateNamespace(STATE_STORE, "upload")  # chat_id -> Session(semester, course, type, files)
 
 # ========= حالة المستخدم لاختيار السمستر والمقرر والنوع =========
-USER_STATE = {}  # keyed by chat_id -> {"semester": ..., "course": ..., "type": ...}
+USER_STATE = StateNamespace(STATE_STORE, "user")  # chat_id -> Session(semester, course, type)
 
 # ========= دوال مساعدة =========
-def send_message(chat_id, text, reply_markup=None):
+async def send_message(chat_id, text, reply_markup=None):
     payload = {"chat_id": chat_id, "text": text}
     if reply_markup:
         payload["reply_markup"] = reply_markup
-    try:
-        r = requests.post(f"{TELEGRAM_API}/sendMessage", json=payload)
-        logger.info(f"Send message status: {r.status_code}, response: {r.text}")
-    except Exception as e:
-        logger.exception(f"Failed to send message: {e}")
-
-def send_file(chat_id, file_id, content_type="pdf"):
-    try:
-        if content_type == "video":
-            r = requests.post(f"{TELEGRAM_API}/sendVideo", json={"chat_id": chat_id, "video": file_id})
-        else:
-            r = requests.post(f"{TELEGRAM_API}/sendDocument", json={"chat_id": chat_id, "document": file_id})
-        logger.info(f"Send file status: {r.status_code}, response: {r.text}")
-    except Exception as e:
-        logger.exception(f"Failed to send file: {e}")
+    r = await delivery.call(chat_id, "sendMessage", payload)
+    _log_response("sendMessage", r)
+    return r
+
+async def send_file(chat_id, file_id, content_type="pdf"):
+    if content_type == "video":
+        r = await delivery.call(chat_id, "sendVideo", {"chat_id": chat_id, "video": file_id})
+    else:
+        r = await delivery.call(chat_id, "sendDocument", {"chat_id": chat_id, "document": file_id})
+    _log_response("sendVideo" if content_type == "video" else "sendDocument", r)
+    if r.get("error_code") == 400:
+        await _suspect_files([file_id])
+    return r
+
+async def _suspect_files(file_ids):
+    """ملفات رفضها Telegram: تُفحص في الدفعة التالية وتُعزل إن تأكد أنها تالفة."""
+    for file_id in file_ids:
+        await run_in_threadpool(crud.FILES.suspect, file_id)
+
+def _log_response(method, r):
+    if not r.get("ok"):
+        logger.warning("%s failed: %s %s", method, r.get("error_code"), logs.truncate(r.get("description"), 200))
+    elif logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s ok: %s", method, logs.truncate(r.get("result"), 200))
 
 def is_admin(user):
     return user.get("username") == ADMIN_USERNAME.replace("@", "")
 
-# ========= القوائم =========
-def get_main_keyboard(is_admin=False):
-    buttons = [[{"text": "ابدأ 🎓"}], [{"text": "تواصل مع المطور 👨‍💻"}]]
-    if is_admin:
-        buttons.append([{"text": "رفع ملف جديد 📤"}])
-    return {"keyboard": buttons, "resize_keyboard": True}
-
-def get_semesters_keyboard():
-    return {
-        "keyboard": [
-            [{"text": "الفصل الأول 1️⃣"}, {"text": "الفصل الثاني 2️⃣"}],
-            [{"text": "الفصل الثالث 3️⃣"}, {"text": "الفصل الرابع 4️⃣"}],
-            [{"text": "الفصل الخامس 5️⃣"}, {"text": "الفصل السادس 6️⃣"}],
-            [{"text": "الفصل السابع 7️⃣"}, {"text": "الفصل الثامن 8️⃣"}],
-            [{"text": "الفصل التاسع 9️⃣"}, {"text": "الفصل العاشر 🔟"}],
-            [{"text": "🏠 القائمة الرئيسية"}]
-        ],
-        "resize_keyboard": True
-    }
-
-def get_courses_keyboard(semester):
-    # تحديد المقررات حسب كل سمستر
-    courses_map = {
-        "1": [
-            [{"text": "🚧 المواد غير متوفرة حالياً"}]
-        ],
-        "2": [
-            [{"text": "English"}, {"text": "Statistic"}],
-            [{"text": "Nutrition"}, {"text": "Ethics"}],
-            [{"text": "Embryology"}, {"text": "Computer"}]
-        ],
-        "3": [
-            [{"text": "دراسات سودانية"}, {"text": "Community"}],
-            [{"text": "Pathology"}, {"text": "musculoskeletal system"}]
-        ],
-        "4": [
-            [{"text": "Primary Health Care"}],
-            [{"text": "Cardiopulmonary"}, {"text": "Hematology"}]
-        ],
-        "5": [
-            [{"text": "Primary Health Care"}, {"text": "Pharmacology"}],
-            [{"text": "Endocrinology"}, {"text": "Cardiopulmonary"}]
-        ],
-        "6": [
-            [{"text": "Gastrointestinal Tract"}]
-        ],
-        "7": [
-            [{"text": "🚧 المواد غير متوفرة حالياً"}]
-        ],
-        "8": [
-            [{"text": "🚧 المواد غير متوفرة حالياً"}]
-        ],
-        "9": [
-            [{"text": "🚧 المواد غير متوفرة حالياً"}]
-        ],
-        "10": [
-            [{"text": "🚧 المواد غير متوفرة حالياً"}]
-        ]
-    }
-    
-    course_buttons = courses_map.get(semester, [[{"text": "لا توجد مقررات"}]])
-    course_buttons.append([{"text": "⬅️ رجوع"}, {"text": "🏠 القائمة الرئيسية"}])
-    
-    return {"keyboard": course_buttons, "resize_keyboard": True}
-
-def get_types_keyboard(course):
-    return {
-        "keyboard": [
-            [{"text": f"{course} 📄 PDF"}, {"text": f"{course} 🎥 فيديو"}],
-            [{"text": f"{course} 📚 مرجع"}],
-            [{"text": "⬅️ رجوع"}, {"text": "🏠 القائمة الرئيسية"}]
-        ],
-        "resize_keyboard": True
-    }
-
-def get_upload_finish_keyboard():
-    return {
-        "keyboard": [
-            [{"text": "✅ انتهيت من الرفع"}],
-            [{"text": "❌ إلغاء العملية"}]
-        ],
-        "resize_keyboard": True
-    }
-
-# ========= Webhook =========
-@app.post("/webhook")
-async def webhook(update: dict, x_telegram_bot_api_secret_token: str = Header(None)):
+# ========= سياق التحديث =========
+class Ctx:
+    """بيانات الرسالة الحالية التي تحتاجها المعالجات."""
+
+    __slots__ = ("chat_id", "text", "user", "msg", "admin", "session")
+
+    def __init__(self, msg):
+        self.msg = msg
+        self.chat_id = msg["chat"]["id"]
+        self.text = msg.get("text", "")
+        self.user = msg.get("from", {})
+        self.admin = is_admin(self.user)
+        self.session = None  # جلسة الرفع النشطة للأدمن (تُحمّل في load)
+
+    @classmethod
+    async def load(cls, msg):
+        ctx = cls(msg)
+        if ctx.admin:
+            ctx.session = await UPLOAD_SESSION.get(ctx.chat_id)
+        return ctx
+
+async def on_unknown(ctx, arg=None):
+    await send_message(ctx.chat_id, "🤔 لم أفهم الأمر، يرجى اختيار من القائمة.")
+
+# ===== استقبال الملفات من الأدمن أثناء جلسة رفع نشطة =====
+async def on_upload_file(ctx, file_info, content_type):
+    chat_id, session = ctx.chat_id, ctx.session
+    file_id = file_info.get("file_id")
+    unique_id = file_info.get("file_unique_id") or ""
+
+    # تأكد من أن النوع متطابق (المراجع و PDF كلاهما مستندات)
+    if session.type and media_kind(session.type) == media_kind(content_type):
+        # نفس الملف (file_unique_id) مرفوع مسبقاً في الجلسة أو في المقرر والنوع
+        if unique_id and (any(isinstance(f, dict) and f.get("file_unique_id") == unique_id for f in session.files)
+                          or crud.find_duplicate(session.semester, session.course, session.type, unique_id)):
+            await send_message(chat_id, "⚠️ هذا الملف موجود مسبقاً لنفس المقرر والنوع، تم تجاهله.",
+                               reply_markup=menu.UPLOAD_FINISH_KEYBOARD)
+            return
+        session.files.append({
+            "file_id": file_id,
+            "file_name": file_info.get("file_name") or ctx.msg.get("caption") or "",
+            "file_size": file_info.get("file_size") or "",
+            "file_unique_id": unique_id,
+        })
+        await UPLOAD_SESSION.put(chat_id, session)
+        files_count = len(session.files)
+        await send_message(
+            chat_id, 
+            f"✅ تم استلام الملف #{files_count}\n\n"
+            f"📊 إجمالي الملفات المستلمة: {files_count}\n\n"
+            f"يمكنك إرسال المزيد أو اضغط '✅ انتهيت من الرفع' للحفظ.",
+            reply_markup=menu.UPLOAD_FINISH_KEYBOARD
+        )
+    else:
+        await send_message(chat_id, f"⚠️ نوع الملف غير متطابق! اخترت {session.type} ولكن أرسلت {content_type}")
+
+# ===== زر "انتهيت من الرفع" - حفظ كل الملفات =====
+async def on_upload_finish(ctx, arg):
+    chat_id, session = ctx.chat_id, ctx.session
+    if not session:
+        return await on_unknown(ctx)
+    semester = session.semester
+    course = session.course
+    ctype = session.type
+    files = session.files
+
+    if not files:
+        await send_message(chat_id, "⚠️ لم يتم رفع أي ملفات! أرسل الملفات أولاً.")
+        return
+
+    # حفظ كل الملفات في قاعدة البيانات دفعة واحدة
+    results = await run_in_threadpool(crud.add_materials, [
+        (semester, course, ctype, f["file_id"], f.get("file_name"), f.get("file_size"), f.get("file_unique_id"))
+        if isinstance(f, dict) else (semester, course, ctype, f)
+        for f in files
+    ])
+    saved_count = sum(1 for r in results if r["ok"])
+    failed = [r for r in results if not r["ok"]]
+    for r in failed:
+        logger.warning("Failed to save file %s: %s", r["file_id"], r["error"])
+
+    # فشل الحفظ بالكامل: نُبقي الجلسة ليعيد الأدمن المحاولة
+    if not saved_count:
+        await send_message(chat_id, "❌ تعذر حفظ الملفات، حاول الضغط على '✅ انتهيت من الرفع' مرة أخرى.",
+                           reply_markup=menu.UPLOAD_FINISH_KEYBOARD)
+        return
+
+    # مسح الجلسة
+    await UPLOAD_SESSION.pop(chat_id)
+
+    # إشعار المشتركين في الخلفية (يُستأنف بعد إعادة التشغيل)
+    subscribers = 0
     try:
-        if WEBHOOK_SECRET_TOKEN and x_telegram_bot_api_secret_token != WEBHOOK_SECRET_TOKEN:
-            logger.warning("Invalid secret token received.")
-            raise HTTPException(status_code=401, detail="Invalid secret header")
-
-        logger.debug(f"Received update: {update}")
+        _, subscribers = await broadcaster.enqueue(semester, course, ctype, saved_count, chat_id)
+    except Exception as e:
+        logger.warning("Failed to queue broadcast for %s/%s: %r", semester, course, e)
+
+    # رسالة تأكيد
+    await send_message(
+        chat_id,
+        f"✅ تم حفظ {saved_count} ملف بنجاح!\n"
+        + (f"⚠️ لم يُحفظ {len(failed)} ملف (مكرر أو غير صالح)\n" if failed else "")
+        + f"\n📚 السمستر: {semester}\n"
+        f"📖 المقرر: {course}\n"
+        f"📂 النوع: {ctype}"
+        + (f"\n\n📣 سيتم إشعار {subscribers} مشترك" if subscribers else ""),
+        reply_markup=menu.main_keyboard(is_admin=True)
+    )
+
+# ===== زر "إلغاء العملية" =====
+async def on_upload_cancel(ctx, arg):
+    if not ctx.session:
+        return await on_unknown(ctx)
+    await UPLOAD_SESSION.pop(ctx.chat_id)
+    await send_message(ctx.chat_id, "❌ تم إلغاء عملية الرفع.", reply_markup=menu.main_keyboard(is_admin=True))
+
+# ===== أوامر الأدمن =====
+async def on_upload_new(ctx, arg):
+    if not ctx.admin:
+        return await on_unknown(ctx)
+    # بدء جلسة رفع جديدة
+    await UPLOAD_SESSION.put(ctx.chat_id, Session())
+    await send_message(ctx.chat_id, "📤 اختر السمستر الذي تريد رفع الملفات له:", reply_markup=menu.SEMESTERS_KEYBOARD)
+
+async def on_addfile(ctx, arg):
+    if not ctx.admin:
+        return await on_unknown(ctx)
+    parts = ctx.text.split()
+    if len(parts) == 5:
+        semester, course, ctype, file_id = parts[1], parts[2], parts[3], parts[4]
+        await run_in_threadpool(crud.add_material, semester, course, ctype, file_id)
+        await send_message(ctx.chat_id, f"✅ تمت إضافة {ctype} لمادة {course} (سمستر {semester}) بنجاح!")
+    else:
+        await send_message(ctx.chat_id, "❌ الصيغة الصحيحة:\n/addfile <semester> <course> <type> <file_id>")
+
+# ===== أوامر المستخدم =====
+async def on_start(ctx, arg):
+    await USER_STATE.pop(ctx.chat_id)
+    await UPLOAD_SESSION.pop(ctx.chat_id)
+    welcome_text = (
+        "👋 مرحبًا بك في بوت كلية الطب – جامعة المناقل!\n\n"
+        "📚 هذا البوت يساعدك للوصول إلى محتوى المقررات بسهولة.\n"
+        "⚠️ تنويه: البوت في مراحل الصيانة لرفع كميات كبيرة من المواد.\n"
+    )
+    await send_message(ctx.chat_id, welcome_text, reply_markup=menu.main_keyboard(ctx.admin))
+
+async def on_contact(ctx, arg):
+    await send_message(ctx.chat_id, f"📩 تواصل مع المطور: {ADMIN_USERNAME}")
+
+async def on_home(ctx, arg):
+    await USER_STATE.pop(ctx.chat_id)
+    await UPLOAD_SESSION.pop(ctx.chat_id)
+    await send_message(ctx.chat_id, "🏠 عدت إلى القائمة الرئيسية", reply_markup=menu.main_keyboard(ctx.admin))
+
+async def on_begin(ctx, arg):
+    await USER_STATE.pop(ctx.chat_id)
+    await send_message(ctx.chat_id, "📚 اختر الفصل الدراسي:", reply_markup=menu.SEMESTERS_KEYBOARD)
+
+async def on_back(ctx, arg):
+    chat_id = ctx.chat_id
+    state = await USER_STATE.get(chat_id) or Session()
+
+    # إذا كان عند اختيار النوع، نرجع لاختيار المقرر
+    if state.course and state.semester:
+        state.type = None
+        state.course = None
+        await USER_STATE.put(chat_id, state)
+        await send_message(chat_id, f"⬅️ اختر المقرر:", reply_markup=menu.courses_keyboard(state.semester))
+        return
+
+    # إذا كان عند اختيار المقرر، نرجع لاختيار السمستر
+    if state.semester:
+        await USER_STATE.pop(chat_id)
+
+    await send_message(chat_id, "⬅️ اختر الفصل الدراسي:", reply_markup=menu.SEMESTERS_KEYBOARD)
+
+# ===== اختيار السمستر =====
+async def on_semester(ctx, semester):
+    chat_id, session = ctx.chat_id, ctx.session
+
+    # للأدمن في جلسة رفع: حفظ السمستر
+    if session:
+        session.semester = semester
+        await UPLOAD_SESSION.put(chat_id, session)
+        await send_message(chat_id, f"✅ تم اختيار {ctx.text}. الآن اختر المقرر:", reply_markup=menu.courses_keyboard(semester))
+        return
+
+    # للمستخدم العادي: حفظ في USER_STATE
+    await USER_STATE.put(chat_id, Session(semester=semester))
+    await send_message(chat_id, f"📖 اختر المقرر من {ctx.text}:", reply_markup=menu.courses_keyboard(semester))
+
+# ===== اختيار المقرر =====
+async def on_course(ctx, course):
+    chat_id, session = ctx.chat_id, ctx.session
+
+    # للأدمن في جلسة رفع: حفظ المقرر
+    if session:
+        session.course = course
+        await UPLOAD_SESSION.put(chat_id, session)
+        await send_message(chat_id, f"📂 اختر نوع المحتوى لمقرر {course}:", reply_markup=menu.types_keyboard(course))
+        return
+
+    # للمستخدم: حفظ المقرر
+    state = await USER_STATE.get(chat_id)
+    if not state or not state.semester:
+        await send_message(chat_id, "⚠️ يرجى اختيار السمستر أولاً")
+        return
+
+    state.course = course
+    await USER_STATE.put(chat_id, state)
+    await send_message(chat_id, f"📂 اختر نوع المحتوى لمقرر {course}:", reply_markup=menu.types_keyboard(course))
+
+# ===== اختيار نوع الملف =====
+async def on_type(ctx, arg):
+    chat_id, session = ctx.chat_id, ctx.session
+    course_name, ctype = arg
+    file_type_text = menu.TYPE_LABELS[ctype]
+
+    # للأدمن في جلسة رفع: حفظ النوع وانتظار الملفات
+    if session:
+        semester = session.semester
+        course = session.course or course_name
+
+        if not semester or not course:
+            await send_message(chat_id, "❌ بيانات غير مكتملة. أعد العملية.")
+            return
+
+        session.course = course
+        session.type = ctype
+        await UPLOAD_SESSION.put(chat_id, session)
+
+        await send_message(
+            chat_id,
+            f"✅ تم اختيار: {file_type_text}\n\n"
+            f"📚 السمستر: {semester}\n"
+            f"📖 المقرر: {course}\n"
+            f"📂 النوع: {file_type_text}\n\n"
+            f"الآن أرسل الملفات ({file_type_text}) واحداً تلو الآخر.\n"
+            f"عند الانتهاء اضغط '✅ انتهيت من الرفع'",
+            reply_markup=menu.UPLOAD_FINISH_KEYBOARD
+        )
+        return
+
+    # للمستخدم: عرض الملفات مباشرة
+    state = await USER_STATE.get(chat_id) or Session()
+    semester = state.semester
+    course = course_name
+
+    if not semester or not state.course:
+        await send_message(chat_id, "⚠️ يرجى اختيار السمستر والمقرر أولاً")
+        return
+
+    # جلب الملفات من قاعدة البيانات
+    try:
+        mats = await run_in_threadpool(crud.get_materials, semester, course, ctype, use_cache=True)
+    except StorageUnavailable:
+        await send_message(chat_id, "⏳ الخدمة مشغولة حالياً، يرجى المحاولة بعد قليل")
+        return
+
+    if not mats:
+        await send_message(chat_id, f"🚧 لا توجد ملفات متاحة حالياً لـ {course} ({ctype})")
+        return
+
+    # قائمة بالصفحات: الطالب يختار ما يريد بدل إرسال كل الملفات
+    text, markup = menu.files_page(semester, course, ctype, mats)
+    await send_message(chat_id, text, reply_markup=markup)
+
+async def send_all(chat_id, course, ctype, mats):
+    """إرسال كل ملفات القائمة كألبومات مع رسالة تقدّم."""
+    file_ids = [m.get("file_id") for m in mats if m.get("file_id")]
+    status_text = f"📤 جاري إرسال ملفات {course} ({ctype})..."
+    status = await send_message(chat_id, status_text)
+    status_id = (status.get("result") or {}).get("message_id")
+
+    async def progress(done, total, sent):
+        # تحديث رسالة الحالة بعد كل ألبوم (فقط عند وجود أكثر من طلب)
+        if status_id and total > 1:
+            await delivery.call(chat_id, "editMessageText", {
+                "chat_id": chat_id, "message_id": status_id,
+                "text": f"{status_text} ({sent}/{len(file_ids)})"
+            })
+
+    report = await delivery.send_materials(chat_id, file_ids, ctype, progress=progress)
+    logger.info("Delivered %d/%d files in %d requests", report["sent"], len(file_ids), report["requests"])
+    if report["failed"]:
+        await _suspect_files(report["failed"])
+        await send_message(chat_id, f"⚠️ تعذر إرسال {len(report['failed'])} ملف من أصل {len(file_ids)}")
+
+# ===== البحث =====
+async def on_search(ctx, arg):
+    parts = ctx.text.split(maxsplit=1)
+    query = parts[1].strip() if len(parts) > 1 else ""
+    if not query:
+        await send_message(ctx.chat_id, "🔎 اكتب كلمات البحث بعد الأمر، مثال:\n/search anatomy lecture")
+        return
+    try:
+        results = await run_in_threadpool(crud.search_materials, query, menu.SEARCH_LIMIT)
+    except StorageUnavailable:
+        await send_message(ctx.chat_id, "⏳ الخدمة مشغولة حالياً، يرجى المحاولة بعد قليل")
+        return
+    text, markup = menu.search_results(query, results)
+    await send_message(ctx.chat_id, text, reply_markup=markup)
+
+async def on_inline_query(query):
+    """البحث المضمن: @bot كلمات البحث من أي محادثة."""
+    text = (query.get("query") or "").strip()
+    results = []
+    if text:
+        try:
+            found = await run_in_threadpool(crud.search_materials, text, menu.INLINE_SEARCH_LIMIT)
+            results = menu.inline_results(found)
+        except StorageUnavailable:
+            pass
+    await tg.call("answerInlineQuery", {
+        "inline_query_id": query["id"], "results": results, "cache_time": INLINE_CACHE_TIME,
+    })
+
+# ===== الاشتراك في إشعارات الملفات الجديدة =====
+async def _subscription_scope(chat_id):
+    """(السمستر، المقرر) حسب موقع المستخدم في القائمة، المقرر "" = كل السمستر."""
+    state = await USER_STATE.get(chat_id) or Session()
+    return state.semester, state.course or ""
+
+async def on_subscribe(ctx, arg):
+    semester, course = await _subscription_scope(ctx.chat_id)
+    if not semester:
+        current = await run_in_threadpool(BROADCASTS.subscriptions, ctx.chat_id)
+        lines = "\n".join(f"• {menu.subscription_label(s, c)}" for s, c in current)
+        await send_message(ctx.chat_id, (f"🔔 اشتراكاتك الحالية:\n{lines}\n\n" if current else "")
+                           + "🔔 اختر السمستر أو المقرر من القائمة أولاً ثم أرسل /subscribe")
+        return
+    await run_in_threadpool(BROADCASTS.subscribe, ctx.chat_id, semester, course)
+    await send_message(ctx.chat_id, f"🔔 ستصلك إشعارات الملفات الجديدة لـ {menu.subscription_label(semester, course)}\n"
+                                    f"لإلغاء الاشتراك: /unsubscribe")
+
+async def on_unsubscribe(ctx, arg):
+    semester, course = await _subscription_scope(ctx.chat_id)
+    # بدون اختيار في القائمة: إلغاء كل الاشتراكات
+    removed = await run_in_threadpool(BROADCASTS.unsubscribe, ctx.chat_id, semester, course if semester else None)
+    if not removed:
+        await send_message(ctx.chat_id, "🔕 لا توجد اشتراكات لإلغائها")
+    elif semester:
+        await send_message(ctx.chat_id, f"🔕 تم إلغاء الاشتراك في {menu.subscription_label(semester, course)}")
+    else:
+        await send_message(ctx.chat_id, f"🔕 تم إلغاء كل اشتراكاتك ({removed})")
+
+async def report_broadcast(job, report):
+    """تقرير اكتمال البث للأدمن الذي رفع الملفات."""
+    if job.get("admin_chat") and report["total"]:
+        await send_message(job["admin_chat"],
+                           f"📣 اكتمل إشعار {job['course']}: {report['sent']}/{report['total']} مشترك"
+                           + (f"، تعذر {report['failed']}" if report["failed"] else "")
+                           + f" خلال {report['seconds']} ثانية")
+
+# ===== أزرار قائمة الملفات (callback_query) =====
+async def on_callback(query):
+    chat_id = ((query.get("message") or {}).get("chat") or {}).get("id") or query["from"]["id"]
+    parsed = menu.parse_callback(query.get("data"))
+    answer = {"callback_query_id": query["id"]}
+    if parsed is None:
+        await tg.call("answerCallbackQuery", answer | {"text": "⚠️ زر غير صالح، أعد فتح القائمة"})
+        return
+    action, semester, course, ctype, n = parsed
+    if action == "s":
+        await run_in_threadpool(BROADCASTS.subscribe, chat_id, semester, course)
+        await tg.call("answerCallbackQuery", answer | {
+            "text": f"🔔 ستصلك إشعارات الملفات الجديدة لـ {course}"})
+        return
+    try:
+        mats = await run_in_threadpool(crud.get_materials, semester, course, ctype, use_cache=True)
+    except StorageUnavailable:
+        await tg.call("answerCallbackQuery", answer | {"text": "⏳ الخدمة مشغولة حالياً، حاول بعد قليل"})
+        return
+
+    if action == "p":
+        await tg.call("answerCallbackQuery", answer)
+        text, markup = menu.files_page(semester, course, ctype, mats, n)
+        await delivery.call(chat_id, "editMessageText", {
+            "chat_id": chat_id, "message_id": query["message"]["message_id"],
+            "text": text, "reply_markup": markup,
+        })
+    elif action == "f":
+        row = menu.find_file(mats, n)
+        if row is None:
+            await tg.call("answerCallbackQuery", answer | {"text": "⚠️ هذا الملف لم يعد متاحاً، أعد فتح القائمة"})
+            return
+        await tg.call("answerCallbackQuery", answer | {"text": "📤 جاري الإرسال..."})
+        await send_file(chat_id, row["file_id"], ctype)
+    else:
+        await tg.call("answerCallbackQuery", answer)
+        await send_all(chat_id, course, ctype, mats)
+
+# اسم المعالج في menu.ROUTES -> الدالة
+HANDLERS = {
+    "start": on_start,
+    "addfile": on_addfile,
+    "begin": on_begin,
+    "contact": on_contact,
+    "home": on_home,
+    "back": on_back,
+    "upload_new": on_upload_new,
+    "upload_finish": on_upload_finish,
+    "upload_cancel": on_upload_cancel,
+    "semester": on_semester,
+    "course": on_course,
+    "type": on_type,
+    "search": on_search,
+    "subscribe": on_subscribe,
+    "unsubscribe": on_unsubscribe,
+}
+
+# ========= معالجة التحديثات =========
+async def handle_update(update):
+    with logs.correlation(update.get("update_id"), update_chat_id(update)):
+        try:
+            await _handle_update(update)
+        finally:
+            key = delivery_key(update)
+            if key is not None and IN_FLIGHT.get(key) == update.get("update_id"):
+                del IN_FLIGHT[key]
+
+async def _handle_update(update):
+    try:
+        if logger.isEnabledFor(logging.DEBUG) and logs.sampled():
+            logger.debug("Received update: %s", logs.truncate(update))
+        if "callback_query" in update:
+            with metrics.ROUTE_SECONDS.time(route="callback"):
+                await on_callback(update["callback_query"])
+            return
+        if "inline_query" in update:
+            with metrics.ROUTE_SECONDS.time(route="inline_query"):
+                await on_inline_query(update["inline_query"])
+            return
         msg = update.get("message")
         if not msg:
-            return {"ok": True}
+            return
 
-        chat_id = msg["chat"]["id"]
-        text = msg.get("text", "")
-        user = msg.get("from", {})
+        ctx = await Ctx.load(msg)
 
         # التقاط الملفات
-        file_info = None
-        content_type = None
-        if "document" in msg:
-            file_info = msg["document"]
-            content_type = "pdf"
-        elif "video" in msg:
-            file_info = msg["video"]
-            content_type = "video"
-
-        # ===== استقبال الملفات من الأدمن أثناء جلسة رفع نشطة =====
-        if file_info and is_admin(user) and chat_id in UPLOAD_SESSION:
-            session = UPLOAD_SESSION[chat_id]
-            file_id = file_info.get("file_id")
-            
-            # تأكد من أن النوع متطابق
-            if session.get("type") == content_type:
-                session["files"].append(file_id)
-                files_count = len(session["files"])
-                send_message(
-                    chat_id, 
-                    f"✅ تم استلام الملف #{files_count}\n\n"
-                    f"📊 إجمالي الملفات المستلمة: {files_count}\n\n"
-                    f"يمكنك إرسال المزيد أو اضغط '✅ انتهيت من الرفع' للحفظ.",
-                    reply_markup=get_upload_finish_keyboard()
-                )
-            else:
-                send_message(chat_id, f"⚠️ نوع الملف غير متطابق! اخترت {session.get('type')} ولكن أرسلت {content_type}")
-            
-            return {"ok": True}
-
-        # ===== زر "انتهيت من الرفع" - حفظ كل الملفات =====
-        if text == "✅ انتهيت من الرفع" and is_admin(user) and chat_id in UPLOAD_SESSION:
-            session = UPLOAD_SESSION[chat_id]
-            semester = session.get("semester")
-            course = session.get("course")
-            ctype = session.get("type")
-            files = session.get("files", [])
-            
-            if not files:
-                send_message(chat_id, "⚠️ لم يتم رفع أي ملفات! أرسل الملفات أولاً.")
-                return {"ok": True}
-            
-            # حفظ كل الملفات في قاعدة البيانات
-            saved_count = 0
-            for file_id in files:
-                try:
-                    crud.add_material(semester, course, ctype, file_id)
-                    saved_count += 1
-                except Exception as e:
-                    logger.exception(f"Failed to save file {file_id}: {e}")
-            
-            # مسح الجلسة
-            UPLOAD_SESSION.pop(chat_id, None)
-            
-            # رسالة تأكيد
-            send_message(
-                chat_id,
-                f"✅ تم حفظ {saved_count} ملف بنجاح!\n\n"
-                f"📚 السمستر: {semester}\n"
-                f"📖 المقرر: {course}\n"
-                f"📂 النوع: {ctype}",
-                reply_markup=get_main_keyboard(is_admin=True)
-            )
-            return {"ok": True}
-
-        # ===== زر "إلغاء العملية" =====
-        if text == "❌ إلغاء العملية" and is_admin(user) and chat_id in UPLOAD_SESSION:
-            UPLOAD_SESSION.pop(chat_id, None)
-            send_message(chat_id, "❌ تم إلغاء عملية الرفع.", reply_markup=get_main_keyboard(is_admin=True))
-            return {"ok": True}
-
-        # ===== أوامر الأدمن =====
-        if text == "رفع ملف جديد 📤" and is_admin(user):
-            # بدء جلسة رفع جديدة
-            UPLOAD_SESSION[chat_id] = {"semester": None, "course": None, "type": None, "files": []}
-            send_message(chat_id, "📤 اختر السمستر الذي تريد رفع الملفات له:", reply_markup=get_semesters_keyboard())
-            return {"ok": True}
-
-        if text and text.startswith("/addfile") and is_admin(user):
-            parts = text.split()
-            if len(parts) == 5:
-                semester, course, ctype, file_id = parts[1], parts[2], parts[3], parts[4]
-                crud.add_material(semester, course, ctype, file_id)
-                send_message(chat_id, f"✅ تمت إضافة {ctype} لمادة {course} (سمستر {semester}) بنجاح!")
-            else:
-                send_message(chat_id, "❌ الصيغة الصحيحة:\n/addfile <semester> <course> <type> <file_id>")
-            return {"ok": True}
-
-        # ===== أوامر المستخدم =====
-        if text == "/start":
-            USER_STATE.pop(chat_id, None)
-            UPLOAD_SESSION.pop(chat_id, None)
-            welcome_text = (
-                "👋 مرحبًا بك في بوت كلية الطب – جامعة المناقل!\n\n"
-                "📚 هذا البوت يساعدك للوصول إلى محتوى المقررات بسهولة.\n"
-                "⚠️ تنويه: البوت في مراحل الصيانة لرفع كميات كبيرة من المواد.\n"
-            )
-            send_message(chat_id, welcome_text, reply_markup=get_main_keyboard(is_admin(user)))
-            return {"ok": True}
-
-        if text == "تواصل مع المطور 👨‍💻":
-            send_message(chat_id, f"📩 تواصل مع المطور: {ADMIN_USERNAME}")
-            return {"ok": True}
-
-        if text == "🏠 القائمة الرئيسية":
-            USER_STATE.pop(chat_id, None)
-            UPLOAD_SESSION.pop(chat_id, None)
-            send_message(chat_id, "🏠 عدت إلى القائمة الرئيسية", reply_markup=get_main_keyboard(is_admin(user)))
-            return {"ok": True}
-
-        if text == "ابدأ 🎓":
-            USER_STATE.pop(chat_id, None)
-            send_message(chat_id, "📚 اختر الفصل الدراسي:", reply_markup=get_semesters_keyboard())
-            return {"ok": True}
-
-        if text == "⬅️ رجوع":
-            state = USER_STATE.get(chat_id, {})
-            
-            # إذا كان عند اختيار النوع، نرجع لاختيار المقرر
-            if state.get("course") and state.get("semester"):
-                state.pop("type", None)
-                state.pop("course", None)
-                send_message(chat_id, f"⬅️ اختر المقرر:", reply_markup=get_courses_keyboard(state.get("semester")))
-                return {"ok": True}
-            
-            # إذا كان عند اختيار المقرر، نرجع لاختيار السمستر
-            if state.get("semester"):
-                USER_STATE.pop(chat_id, None)
-                send_message(chat_id, "⬅️ اختر الفصل الدراسي:", reply_markup=get_semesters_keyboard())
-                return {"ok": True}
-            
-            # افتراضي: رجوع للسمسترات
-            send_message(chat_id, "⬅️ اختر الفصل الدراسي:", reply_markup=get_semesters_keyboard())
-            return {"ok": True}
-
-        # ===== اختيار السمستر =====
-        semester_map = {
-            "الفصل الأول 1️⃣": "1",
-            "الفصل الثاني 2️⃣": "2",
-            "الفصل الثالث 3️⃣": "3",
-            "الفصل الرابع 4️⃣": "4",
-            "الفصل الخامس 5️⃣": "5",
-            "الفصل السادس 6️⃣": "6",
-            "الفصل السابع 7️⃣": "7",
-            "الفصل الثامن 8️⃣": "8",
-            "الفصل التاسع 9️⃣": "9",
-            "الفصل العاشر 🔟": "10"
-        }
-        
-        if text in semester_map:
-            semester = semester_map[text]
-            
-            # للأدمن في جلسة رفع: حفظ السمستر
-            if is_admin(user) and chat_id in UPLOAD_SESSION:
-                UPLOAD_SESSION[chat_id]["semester"] = semester
-                send_message(chat_id, f"✅ تم اختيار {text}. الآن اختر المقرر:", reply_markup=get_courses_keyboard(semester))
-                return {"ok": True}
-            
-            # للمستخدم العادي: حفظ في USER_STATE
-            USER_STATE[chat_id] = {"semester": semester}
-            send_message(chat_id, f"📖 اختر المقرر من {text}:", reply_markup=get_courses_keyboard(semester))
-            return {"ok": True}
-
-        # ===== اختيار المقرر =====
-        course_names = [
-            # السمستر الثاني
-            "English", "Statistic", "Nutrition", "Ethics", "Embryology", "Computer",
-            # السمستر الثالث
-            "دراسات سودانية", "Community", "Pathology", "musculoskeletal system",
-            # السمستر الرابع
-            "Primary Health Care", "Cardiopulmonary", "Hematology",
-            # السمستر الخامس
-            "Pharmacology", "Endocrinology",
-            # السمستر السادس
-            "Gastrointestinal Tract"
-        ]
-
-        if text in course_names:
-            # للأدمن في جلسة رفع: حفظ المقرر
-            if is_admin(user) and chat_id in UPLOAD_SESSION:
-                UPLOAD_SESSION[chat_id]["course"] = text
-                send_message(chat_id, f"📂 اختر نوع المحتوى لمقرر {text}:", reply_markup=get_types_keyboard(text))
-                return {"ok": True}
-            
-            # للمستخدم: حفظ المقرر
-            state = USER_STATE.get(chat_id, {})
-            if not state.get("semester"):
-                send_message(chat_id, "⚠️ يرجى اختيار السمستر أولاً")
-                return {"ok": True}
-            
-            state["course"] = text
-            USER_STATE[chat_id] = state
-            send_message(chat_id, f"📂 اختر نوع المحتوى لمقرر {text}:", reply_markup=get_types_keyboard(text))
-            return {"ok": True}
-
-        # ===== اختيار نوع الملف =====
-        if text and any(x in text for x in ["PDF", "فيديو", "مرجع"]):
-            course_name = text.split()[0]
-            ctype = "pdf" if "PDF" in text else "video" if "فيديو" in text else "reference"
-
-            # للأدمن في جلسة رفع: حفظ النوع وانتظار الملفات
-            if is_admin(user) and chat_id in UPLOAD_SESSION:
-                session = UPLOAD_SESSION[chat_id]
-                semester = session.get("semester")
-                course = session.get("course") or course_name
-
-                if not semester or not course:
-                    send_message(chat_id, "❌ بيانات غير مكتملة. أعد العملية.")
-                    return {"ok": True}
-
-                session["type"] = ctype
-                
-                file_type_text = "PDF" if ctype == "pdf" else "فيديو" if ctype == "video" else "مرجع"
-                send_message(
-                    chat_id,
-                    f"✅ تم اختيار: {file_type_text}\n\n"
-                    f"📚 السمستر: {semester}\n"
-                    f"📖 المقرر: {course}\n"
-                    f"📂 النوع: {file_type_text}\n\n"
-                    f"الآن أرسل الملفات ({file_type_text}) واحداً تلو الآخر.\n"
-                    f"عند الانتهاء اضغط '✅ انتهيت من الرفع'",
-                    reply_markup=get_upload_finish_keyboard()
-                )
-                return {"ok": True}
-
-            # للمستخدم: عرض الملفات مباشرة
-            state = USER_STATE.get(chat_id, {})
-            semester = state.get("semester")
-            course = state.get("course")
-            
-            if not semester or not course:
-                send_message(chat_id, "⚠️ يرجى اختيار السمستر والمقرر أولاً")
-                return {"ok": True}
-
-            # جلب الملفات من قاعدة البيانات
-            mats = crud.get_materials(semester, course, ctype, use_cache=True)
-            
-            if not mats:
-                send_message(chat_id, f"🚧 لا توجد ملفات متاحة حالياً لـ {course} ({ctype})")
-                return {"ok": True}
-            
-            send_message(chat_id, f"📤 جاري إرسال ملفات {course} ({ctype})...")
-            for m in mats:
-                send_file(chat_id, m.get("file_id"), content_type=ctype)
-            
-            return {"ok": True}
-
-        # افتراضي
-        send_message(chat_id, "🤔 لم أفهم الأمر، يرجى اختيار من القائمة.")
-        return {"ok": True}
+        if ctx.session and ("document" in msg or "video" in msg):
+            with metrics.ROUTE_SECONDS.time(route="upload"):
+                if "document" in msg:
+                    await on_upload_file(ctx, msg["document"], "pdf")
+                else:
+                    await on_upload_file(ctx, msg["video"], "video")
+            return
+
+        # توجيه بعملية بحث واحدة في القاموس
+        route = menu.route(ctx.text) if ctx.text else None
+        if route is None:
+            with metrics.ROUTE_SECONDS.time(route="unknown"):
+                await on_unknown(ctx)
+            return
+        kind, arg = route
+        with metrics.ROUTE_SECONDS.time(route=kind):
+            await HANDLERS[kind](ctx, arg)
+
+    except Exception as e:
+        logger.exception("Exception in webhook processing: %r", e)
+
+# طابور التحديثات: ترتيب داخل كل محادثة وتوازي بين المحادثات
+dispatcher = UpdateDispatcher(handle_update)
+
+# ========= القبول: حد لكل محادثة + دمج طلبات التسليم المكررة =========
+THROTTLE = KeyedThrottle(CHAT_UPDATES_PER_MINUTE / 60, CHAT_UPDATES_BURST, CHAT_COOLDOWN)
+IN_FLIGHT = {}  # مفتاح التسليم -> update_id المقبول (في الطابور أو قيد المعالجة)
+_replies = set()  # مراجع ردود القبول الجارية حتى لا تُجمع مهامها
+
+def update_user(update):
+    for field in ("message", "callback_query", "inline_query"):
+        if field in update:
+            return update[field].get("from") or {}
+    return {}
+
+def delivery_key(update):
+    """
+    مفتاح طلبات الملفات التي تُدمج إن تكررت قبل انتهاء الأولى:
+    زر نوع المحتوى، "إرسال الكل" وإرسال ملف واحد (المحادثة، السمستر، المقرر، النوع[، مفتاح الملف]).
+    """
+    chat_id = update_chat_id(update)
+    if "callback_query" in update:
+        parsed = menu.parse_callback(update["callback_query"].get("data"))
+        if parsed is None or parsed[0] not in ("a", "f"):
+            return None
+        action, semester, course, ctype, n = parsed
+        return (chat_id, semester, course, ctype) + ((n,) if action == "f" else ())
+    text = (update.get("message") or {}).get("text")
+    route = menu.route(text) if text else None
+    if route and route[0] == "type":
+        return (chat_id, "type") + route[1]
+    return None
+
+def _reply_later(coro):
+    task = asyncio.create_task(coro)
+    _replies.add(task)
+    task.add_done_callback(_replies.discard)
+
+async def _answer_rejected(update, text, alert=False):
+    if "callback_query" in update:
+        # الرد على الزر دائماً حتى لا يبقى مؤشر التحميل
+        await tg.call("answerCallbackQuery", {"callback_query_id": update["callback_query"]["id"],
+                                              "text": text, "show_alert": alert})
+    elif alert and "message" in update:
+        chat_id = update["message"]["chat"]["id"]
+        await delivery.call(chat_id, "sendMessage", {"chat_id": chat_id, "text": text})
+
+def admit(update):
+    """
+    قبول تحديث قبل الطابور. يعيد حالة dispatcher.submit أو "throttled" / "coalesced".
+    - المحادثة التي تتجاوز حدها تُوقف CHAT_COOLDOWN ثانية وتُبلَّغ مرة واحدة
+      (البحث المضمن مستثنى: يُخزَّن في Telegram ولا يرسل رسائل)
+    - طلب ملفات مطابق لطلب لم ينتهِ بعد يُدمج معه بدل تكرار الإرسال
+    """
+    chat_id = update_chat_id(update)
+    if chat_id is not None and "inline_query" not in update and not is_admin(update_user(update)):
+        verdict, wait = THROTTLE.check(chat_id)
+        if verdict != "ok":
+            metrics.UPDATES_SHED.inc(reason="throttled")
+            _reply_later(_answer_rejected(
+                update, f"⏳ طلبات كثيرة! انتظر {math.ceil(wait)} ثانية ثم حاول مرة أخرى.",
+                alert=verdict == "notify"))
+            return "throttled"
+    key = delivery_key(update)
+    if key is not None and (key in IN_FLIGHT or key[:4] in IN_FLIGHT):
+        metrics.UPDATES_SHED.inc(reason="coalesced")
+        _reply_later(_answer_rejected(update, "⏳ جاري تنفيذ طلبك السابق لنفس الملفات..."))
+        return "coalesced"
+    status = dispatcher.submit(update)
+    if key is not None and status == "queued":
+        IN_FLIGHT[key] = update.get("update_id")
+    return status
+
+# ========= إشعارات الملفات الجديدة (اشتراكات + بث مستأنف من القرص) =========
+BROADCASTS = BroadcastStore()
+broadcaster = Broadcaster(delivery, BROADCASTS, menu.announcement, on_done=report_broadcast)
+
+# ========= فحص file_id في الخلفية (getFile) وعزل الملفات التالفة =========
+file_checker = FileChecker(tg, crud.FILES, crud.MATERIALS.rows)
+
+# ========= Webhook =========
+@app.post("/webhook")
+async def webhook(update: dict, x_telegram_bot_api_secret_token: str = Header(None)):
+    if WEBHOOK_SECRET_TOKEN and x_telegram_bot_api_secret_token != WEBHOOK_SECRET_TOKEN:
+        logger.warning("Invalid secret token received.")
+        raise HTTPException(status_code=401, detail="Invalid secret header")
+
+    # نرد فوراً والمعالجة تتم في الخلفية حتى لا يعيد Telegram إرسال التحديث
+    status = admit(update)
+    if status == "full":
+        # Telegram سيعيد المحاولة لاحقاً
+        raise HTTPException(status_code=503, detail="Update queue is full")
+    return {"ok": True}
+
+# ========= استيراد/تصدير الكتالوج (للأدمن) =========
+def _check_admin_key(key):
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not key or not hmac.compare_digest(key, ADMIN_API_KEY):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
+
+def _format(fmt):
+    if fmt not in bulk.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(bulk.FORMATS)}")
+    return fmt
+
+async def _body_lines(request):
+    """أسطر جسم الطلب أثناء وصوله (بدون قراءته كاملاً في الذاكرة)."""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig")
+    if pending:
+        yield pending.decode("utf-8-sig")
+
+@app.post("/admin/materials/import")
+async def import_materials(request: Request, format: str = "jsonl", start_line: int = 0,
+                           dry_run: bool = False, x_admin_key: str = Header(None)):
+    """
+    استيراد JSONL/CSV متدفق في جسم الطلب. الرد يتضمن line: آخر سطر محفوظ؛
+    عند انقطاع الطلب يُعاد نفس الملف مع start_line=<line> (والمكرر يُتجاهل على أي حال).
+    """
+    _check_admin_key(x_admin_key)
+    importer = bulk.Importer(_format(format), start_line=start_line)
+
+    async def write(batch):
+        batch = await run_in_threadpool(importer.drop_existing, batch, crud.existing_material_ids)
+        if batch and not dry_run:
+            await run_in_threadpool(crud.import_materials, [values for _, values in batch])
+        importer.committed(batch)
 
+    try:
+        async for line in _body_lines(request):
+            batch = importer.add(line)
+            if batch:
+                await write(batch)
+        await write(importer.take())
     except Exception as e:
-        logger.exception(f"Exception in webhook processing: {e}")
-        return {"ok": True}
+        logger.exception("Materials import stopped at line %s", importer.report["line"])
+        return {"ok": False, "error": str(e), **importer.report}
+    report = importer.finished()
+    logger.info("%s %d materials (%d duplicates, %d invalid)", "Validated" if dry_run else "Imported",
+                report["imported"], report["duplicates"], report["invalid"])
+    return {"ok": True, "dry_run": dry_run, **report}
+
+@app.get("/admin/materials/export")
+async def export_materials(format: str = "jsonl", x_admin_key: str = Header(None)):
+    _check_admin_key(x_admin_key)
+    fmt = _format(format)
+    rows = await run_in_threadpool(crud.export_materials)
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return StreamingResponse(bulk.export_lines(rows, fmt), media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="materials.{fmt}"'})
+
+@app.get("/stats")
+async def stats():
+    return {"updates": dispatcher.stats(), "caches": cache.all_stats(),
+            "storage": crud.STORAGE.stats(),
+            "broadcast": broadcaster.stats() | {
+                "subscribers": await run_in_threadpool(BROADCASTS.subscriber_count)},
+            "throttle": THROTTLE.stats() | {"in_flight_deliveries": len(IN_FLIGHT)},
+            "files": await run_in_threadpool(file_checker.stats)}
+
+@metrics.REGISTRY.collector
+def _collect():
+    """قراءة الإحصائيات الموجودة عند كل طلب /metrics فقط."""
+    updates = dispatcher.stats()
+    caches = cache.all_stats()
+    storage = crud.STORAGE.stats()
+    broadcast = broadcaster.stats()
+    files = file_checker.stats()
+    out = [
+        ("medbot_updates_queued", "gauge", "Updates waiting in the dispatcher", [({}, updates["queued"])]),
+        ("medbot_updates_in_flight", "gauge", "Updates being handled", [({}, updates["in_flight"])]),
+        ("medbot_updates_oldest_lag_seconds", "gauge", "Age of the oldest queued update",
+         [({}, updates["oldest_lag_seconds"])]),
+        ("medbot_updates_total", "counter", "Updates by outcome",
+         [({"outcome": k}, updates[k]) for k in ("processed", "duplicates", "rejected", "failed")]),
+        ("medbot_materials_indexed", "gauge", "Rows in the in-memory materials index", [({}, len(crud.MATERIALS))]),
+        ("medbot_cache_lookups_total", "counter", "Cache lookups by result",
+         [({"cache": name, "result": r}, st[k]) for name, st in caches.items()
+          for r, k in (("hit", "hits"), ("stale", "stale_hits"), ("miss", "misses"))]),
+        ("medbot_cache_hit_ratio", "gauge", "Fresh+stale hits over lookups",
+         [({"cache": name}, st["hit_ratio"]) for name, st in caches.items()]),
+        ("medbot_cache_evictions_total", "counter", "Cache evictions",
+         [({"cache": name}, st["evictions"]) for name, st in caches.items()]),
+        ("medbot_broadcast_remaining", "gauge", "Recipients left in the running broadcast",
+         [({}, (broadcast["active"] or {}).get("remaining", 0))]),
+        ("medbot_files", "gauge", "Stored file_ids by health-check status",
+         [({"status": status}, files[status]) for status in ("ok", "unknown", "dead")]),
+        ("medbot_broadcast_jobs_completed_total", "counter", "Broadcast jobs completed since start",
+         [({}, broadcast["completed"])]),
+    ]
+    if "calls" in storage:
+        out.append(("medbot_sheets_calls_total", "counter", "Google Sheets API calls per crud operation",
+                    [({"operation": op, "kind": kind}, n) for op, counts in storage["calls"].items()
+                     for kind, n in counts.items()]))
+        out.append(("medbot_sheets_retries_total", "counter", "Google Sheets API retries",
+                    [({}, storage["retries"])]))
+        out.append(("medbot_sheets_throttled_seconds_total", "counter", "Time spent waiting for Sheets budget",
+                    [({}, storage["throttled_seconds"])]))
+    return out
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # المجمّعات تقرأ عدادات سجل الملفات من SQLite: خارج حلقة الأحداث
+    body = await run_in_threadpool(metrics.REGISTRY.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
@@ -0,0 +1,68 @@
+import threading
+import time
+from app.storage import MATERIAL_FIELDS
+
+
+def material_key(semester, course, type_):
+    """مفتاح الفهرس: (السمستر، المقرر، النوع) كنصوص بعد إزالة المسافات."""
+    return (str(semester).strip(), str(course).strip(), str(type_).strip())
+
+
+def normalize_row(row):
+    """الصف بحقول MATERIAL_FIELDS فقط، وكل القيم نصوص (المصدر قد يعيد أرقاماً)."""
+    return {f: "" if row.get(f) is None else str(row.get(f)) for f in MATERIAL_FIELDS}
+
+
+class MaterialsIndex:
+    """
+    فهرس المواد في الذاكرة على مستوى العملية:
+    dict مفتاحه (semester, course, type) وقيمته قائمة الصفوف.
+    القوائم لا تُعدّل في مكانها (copy-on-write) لذلك القراءة بدون قفل.
+    """
+
+    def __init__(self):
+        self._by_key = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.loaded_at = None
+        self.version = 0
+        self.source_version = None  # نسخة المصدر التي بُني منها الفهرس
+
+    def load(self, rows, source_version=None):
+        """بناء الفهرس من كل صفوف الورقة واستبداله دفعة واحدة."""
+        by_key = {}
+        for row in rows:
+            if not row.get("file_id"):
+                continue
+            key = material_key(row.get("semester"), row.get("course"), row.get("type"))
+            by_key.setdefault(key, []).append(normalize_row(row))
+        with self._lock:
+            self._by_key = by_key
+            self.source_version = source_version
+            self.loaded = True
+            self.loaded_at = time.time()
+            self.version += 1
+
+    def add_many(self, rows):
+        """إضافة مجموعة صفوف دفعة واحدة (نسخة جديدة من كل قائمة متأثرة)."""
+        grouped = {}
+        for row in rows:
+            key = material_key(row.get("semester"), row.get("course"), row.get("type"))
+            grouped.setdefault(key, []).append(normalize_row(row))
+        with self._lock:
+            for key, new_rows in grouped.items():
+                self._by_key[key] = self._by_key.get(key, []) + new_rows
+            self.version += 1
+
+    def get(self, semester, course, type_):
+        return self._by_key.get(material_key(semester, course, type_), [])
+
+    def groups(self):
+        """[(المفتاح، الصفوف)] لكل المفاتيح (لبناء فهارس أخرى مثل البحث)."""
+        return list(self._by_key.items())
+
+    def rows(self):
+        return [row for rows in list(self._by_key.values()) for row in rows]
+
+    def __len__(self):
+        return sum(len(rows) for rows in list(self._by_key.values()))
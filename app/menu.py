@@ -0,0 +1,287 @@
+import json
+import hashlib
+from app.telegram import RawJSON
+
+# ========= نصوص الأزرار الثابتة =========
+BEGIN = "ابدأ 🎓"
+CONTACT = "تواصل مع المطور 👨‍💻"
+UPLOAD_NEW = "رفع ملف جديد 📤"
+HOME = "🏠 القائمة الرئيسية"
+BACK = "⬅️ رجوع"
+UPLOAD_FINISH = "✅ انتهيت من الرفع"
+UPLOAD_CANCEL = "❌ إلغاء العملية"
+UNAVAILABLE = "🚧 المواد غير متوفرة حالياً"
+NO_COURSES = "لا توجد مقررات"
+SEND_ALL = "📥 إرسال الكل"
+PREV_PAGE = "« السابق"
+NEXT_PAGE = "التالي »"
+SUBSCRIBE = "🔔 إشعاري بالجديد"
+OPEN_FILES = "📂 عرض الملفات"
+
+PAGE_SIZE = 8  # عدد الملفات في صفحة القائمة
+SEARCH_LIMIT = 10         # نتائج /search
+INLINE_SEARCH_LIMIT = 50  # أقصى ما يقبله answerInlineQuery
+
+# ========= شجرة القوائم: السمستر -> صفوف المقررات =========
+# لإضافة مقرر يكفي إضافته هنا؛ المسارات ولوحات المفاتيح تُبنى تلقائياً.
+SEMESTERS = [
+    ("1", "الفصل الأول 1️⃣", []),
+    ("2", "الفصل الثاني 2️⃣", [
+        ["English", "Statistic"],
+        ["Nutrition", "Ethics"],
+        ["Embryology", "Computer"],
+    ]),
+    ("3", "الفصل الثالث 3️⃣", [
+        ["دراسات سودانية", "Community"],
+        ["Pathology", "musculoskeletal system"],
+    ]),
+    ("4", "الفصل الرابع 4️⃣", [
+        ["Primary Health Care"],
+        ["Cardiopulmonary", "Hematology"],
+    ]),
+    ("5", "الفصل الخامس 5️⃣", [
+        ["Primary Health Care", "Pharmacology"],
+        ["Endocrinology", "Cardiopulmonary"],
+    ]),
+    ("6", "الفصل السادس 6️⃣", [
+        ["Gastrointestinal Tract"],
+    ]),
+    ("7", "الفصل السابع 7️⃣", []),
+    ("8", "الفصل الثامن 8️⃣", []),
+    ("9", "الفصل التاسع 9️⃣", []),
+    ("10", "الفصل العاشر 🔟", []),
+]
+
+# نوع المحتوى في قاعدة البيانات، نص الزر (بعد اسم المقرر)، الاسم المختصر
+CONTENT_TYPES = [
+    ("pdf", "📄 PDF", "PDF"),
+    ("video", "🎥 فيديو", "فيديو"),
+    ("reference", "📚 مرجع", "مرجع"),
+]
+
+# أزرار وأوامر ثابتة -> اسم المعالج
+STATIC_ROUTES = {
+    "/start": "start",
+    "/addfile": "addfile",
+    "/search": "search",
+    "/subscribe": "subscribe",
+    "/unsubscribe": "unsubscribe",
+    BEGIN: "begin",
+    CONTACT: "contact",
+    HOME: "home",
+    BACK: "back",
+    UPLOAD_NEW: "upload_new",
+    UPLOAD_FINISH: "upload_finish",
+    UPLOAD_CANCEL: "upload_cancel",
+}
+
+
+def keyboard(rows):
+    """لوحة مفاتيح رد مُسلسلة مسبقاً إلى JSON."""
+    markup = {"keyboard": [[{"text": t} for t in row] for row in rows], "resize_keyboard": True}
+    return RawJSON(json.dumps(markup, ensure_ascii=False).encode())
+
+
+def type_button(course, ctype_label):
+    return f"{course} {ctype_label}"
+
+
+# ========= التجميع عند بدء التشغيل =========
+ROUTES = {}                 # نص -> (اسم المعالج، المعامل)
+SEMESTER_LABELS = {}        # "2" -> "الفصل الثاني 2️⃣"
+COURSES_BY_SEMESTER = {}    # "2" -> ["English", ...]
+COURSES_KEYBOARDS = {}      # "2" -> RawJSON
+TYPES_KEYBOARDS = {}        # "English" -> RawJSON
+TYPE_LABELS = {code: short for code, _, short in CONTENT_TYPES}
+
+for text, handler in STATIC_ROUTES.items():
+    ROUTES[text] = (handler, None)
+
+for code, label, course_rows in SEMESTERS:
+    ROUTES[label] = ("semester", code)
+    SEMESTER_LABELS[code] = label
+    COURSES_BY_SEMESTER[code] = [c for row in course_rows for c in row]
+    rows = course_rows or [[UNAVAILABLE]]
+    COURSES_KEYBOARDS[code] = keyboard(rows + [[BACK, HOME]])
+    for course in COURSES_BY_SEMESTER[code]:
+        ROUTES[course] = ("course", course)
+        if course not in TYPES_KEYBOARDS:
+            pdf, video, reference = (type_button(course, b) for _, b, _ in CONTENT_TYPES)
+            TYPES_KEYBOARDS[course] = keyboard([[pdf, video], [reference], [BACK, HOME]])
+            for ctype, button, _ in CONTENT_TYPES:
+                ROUTES[type_button(course, button)] = ("type", (course, ctype))
+
+ALL_COURSES = set(TYPES_KEYBOARDS)
+
+# رموز قصيرة لـ callback_data (حدها 64 بايت): رقم المقرر وحرف النوع
+COURSE_IDS = {course: i for i, course in enumerate(TYPES_KEYBOARDS)}
+COURSES_BY_ID = list(TYPES_KEYBOARDS)
+TYPE_CODES = {code: code[0] for code, _, _ in CONTENT_TYPES}
+TYPES_BY_CODE = {c: code for code, c in TYPE_CODES.items()}
+assert len(TYPES_BY_CODE) == len(CONTENT_TYPES), "أحرف الأنواع يجب أن تكون مختلفة"
+
+SEMESTERS_KEYBOARD = keyboard(
+    [[label for _, label, _ in SEMESTERS[i:i + 2]] for i in range(0, len(SEMESTERS), 2)] + [[HOME]]
+)
+NO_COURSES_KEYBOARD = keyboard([[NO_COURSES], [BACK, HOME]])
+MAIN_KEYBOARD = keyboard([[BEGIN], [CONTACT]])
+MAIN_KEYBOARD_ADMIN = keyboard([[BEGIN], [CONTACT], [UPLOAD_NEW]])
+UPLOAD_FINISH_KEYBOARD = keyboard([[UPLOAD_FINISH], [UPLOAD_CANCEL]])
+
+
+def route(text):
+    """(اسم المعالج، المعامل) للنص، أو None. الأوامر تُطابق بأول كلمة."""
+    if text.startswith("/"):
+        text = text.split(maxsplit=1)[0]
+    return ROUTES.get(text)
+
+
+def main_keyboard(is_admin=False):
+    return MAIN_KEYBOARD_ADMIN if is_admin else MAIN_KEYBOARD
+
+
+def courses_keyboard(semester):
+    return COURSES_KEYBOARDS.get(semester, NO_COURSES_KEYBOARD)
+
+
+def types_keyboard(course):
+    return TYPES_KEYBOARDS[course]
+
+
+# ========= تصفح الملفات بالصفحات (أزرار inline) =========
+# callback_data: "<action>:<semester>:<course id>:<type code>:<n>"
+#   p = عرض الصفحة n، a = إرسال كل الملفات، s = الاشتراك في المقرر
+#   f = إرسال الملف الذي مفتاحه n (file_key وليس الترتيب: الزر يبقى صحيحاً
+#       بعد عزل ملف أو إضافة ملفات للقائمة)
+FILE_KEY_LENGTH = 10
+
+
+def file_key(file_id):
+    """مفتاح قصير ثابت للملف داخل callback_data (حدها 64 بايت)."""
+    return hashlib.blake2b(str(file_id).encode(), digest_size=FILE_KEY_LENGTH // 2).hexdigest()
+
+
+def callback_data(action, semester, course, ctype, n=0):
+    return f"{action}:{semester}:{COURSE_IDS[course]}:{TYPE_CODES[ctype]}:{n}"
+
+
+def file_callback(semester, course, ctype, row):
+    return callback_data("f", semester, course, ctype, file_key(row["file_id"]))
+
+
+def parse_callback(data):
+    """
+    (action, semester, course, ctype, n) أو None إن كانت البيانات غير صالحة.
+    n رقم الصفحة، أو مفتاح الملف (نص) للإجراء f.
+    """
+    try:
+        action, semester, course_id, type_code, n = (data or "").split(":")
+        course = COURSES_BY_ID[int(course_id)]
+        ctype = TYPES_BY_CODE[type_code]
+        if action == "f":
+            int(n, 16)
+            if len(n) != FILE_KEY_LENGTH:
+                return None
+        else:
+            n = int(n)
+    except (ValueError, IndexError, KeyError):
+        return None
+    if action not in ("p", "f", "a", "s") or semester not in SEMESTER_LABELS or (action != "f" and n < 0):
+        return None
+    return action, semester, course, ctype, n
+
+
+def find_file(rows, key):
+    """الصف الذي مفتاحه key، أو None (حُذف أو عُزل)."""
+    return next((row for row in rows if file_key(row.get("file_id")) == key), None)
+
+
+def human_size(size):
+    try:
+        size = float(size)
+    except (TypeError, ValueError):
+        return ""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def file_label(index, row, limit=48):
+    name = str(row.get("file_name") or "").strip() or f"ملف {index + 1}"
+    if len(name) > limit:
+        name = name[:limit - 1] + "…"
+    size = human_size(row.get("file_size")) if row.get("file_size") else ""
+    return f"{index + 1}. {name}" + (f" ({size})" if size else "")
+
+
+def files_page(semester, course, ctype, rows, page=0):
+    """نص ولوحة inline لصفحة من قائمة الملفات (الصفحة تُصحح إن تجاوزت الحدود)."""
+    pages = max(1, -(-len(rows) // PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    start = page * PAGE_SIZE
+    buttons = [[{"text": file_label(i, rows[i]),
+                 "callback_data": file_callback(semester, course, ctype, rows[i])}]
+               for i in range(start, min(start + PAGE_SIZE, len(rows)))]
+    nav = []
+    if page > 0:
+        nav.append({"text": PREV_PAGE, "callback_data": callback_data("p", semester, course, ctype, page - 1)})
+    if page < pages - 1:
+        nav.append({"text": NEXT_PAGE, "callback_data": callback_data("p", semester, course, ctype, page + 1)})
+    if nav:
+        buttons.append(nav)
+    buttons.append([{"text": f"{SEND_ALL} ({len(rows)})",
+                     "callback_data": callback_data("a", semester, course, ctype)}])
+    buttons.append([{"text": SUBSCRIBE, "callback_data": callback_data("s", semester, course, ctype)}])
+    text = (f"📂 {course} – {TYPE_LABELS[ctype]}: {len(rows)} ملف\n"
+            f"اضغط على الملف الذي تريده"
+            + (f" (صفحة {page + 1}/{pages})" if pages > 1 else ""))
+    return text, {"inline_keyboard": buttons}
+
+
+# ========= إشعارات الملفات الجديدة =========
+def subscription_label(semester, course=""):
+    return f"{course} ({SEMESTER_LABELS.get(semester, semester)})" if course else SEMESTER_LABELS.get(semester, semester)
+
+
+def announcement(job):
+    """نص وزر إشعار البث لمهمة (semester, course, type, files)."""
+    semester, course, ctype = job["semester"], job["course"], job["type"]
+    text = (f"🆕 تمت إضافة {job['files']} ملف ({TYPE_LABELS.get(ctype, ctype)}) لمقرر {course}\n"
+            f"📚 {SEMESTER_LABELS.get(semester, semester)}")
+    if course not in COURSE_IDS or ctype not in TYPE_CODES or semester not in SEMESTER_LABELS:
+        return text, None
+    return text, {"inline_keyboard": [[{"text": OPEN_FILES,
+                                        "callback_data": callback_data("p", semester, course, ctype)}]]}
+
+
+# ========= نتائج البحث =========
+def search_results(query, results):
+    """نص ولوحة inline لنتائج /search (كل زر يرسل الملف عبر نفس callback القائمة)."""
+    results = [r for r in results if r[1] in COURSE_IDS and r[2] in TYPE_CODES]
+    if not results:
+        return f"🔎 لا توجد نتائج لـ «{query}»", None
+    buttons = []
+    for semester, course, ctype, position, row in results:
+        name = str(row.get("file_name") or "").strip() or f"ملف {position + 1}"
+        buttons.append([{"text": f"{name[:40]} · {course} {TYPE_LABELS[ctype]}",
+                         "callback_data": file_callback(semester, course, ctype, row)}])
+    return f"🔎 نتائج البحث عن «{query}»: {len(results)}", {"inline_keyboard": buttons}
+
+
+def inline_results(results):
+    """نتائج answerInlineQuery: ملفات محفوظة في Telegram تُرسل مباشرة من أي محادثة."""
+    out = []
+    for semester, course, ctype, position, row in results:
+        if course not in COURSE_IDS or ctype not in TYPE_CODES:
+            continue
+        name = str(row.get("file_name") or "").strip() or f"{course} {TYPE_LABELS[ctype]} {position + 1}"
+        result_id = file_callback(semester, course, ctype, row)
+        description = f"{course} · {TYPE_LABELS[ctype]} · {SEMESTER_LABELS[semester]}"
+        if ctype == "video":
+            out.append({"type": "video", "id": result_id, "video_file_id": row["file_id"],
+                        "title": name, "description": description})
+        else:
+            out.append({"type": "document", "id": result_id, "document_file_id": row["file_id"],
+                        "title": name, "description": description})
+    return out
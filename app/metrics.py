@@ -0,0 +1,167 @@
+import time
+import threading
+from bisect import bisect_left
+
+# حدود الـ histogram الافتراضية بالثواني
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    histogram بحدود ثابتة: كل ملاحظة = بحث ثنائي + زيادة عدّاد تحت قفل قصير،
+    لذلك يمكن إبقاؤه مفعّلاً في الإنتاج.
+    """
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [عدّادات كل حد + Inf، المجموع]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _labels(self.labelnames, key, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total!r}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    """
+    المقاييس المسجلة + دوال جمع (collectors) تُستدعى عند كل طلب /metrics
+    لقراءة الإحصائيات الموجودة أصلاً (الطابور، الكاش...) بدون تكلفة في المسار الساخن.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """
+        fn() تعيد قائمة (name, type, help, [(labels dict, value)]).
+        تُستخدم كـ decorator.
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, kind, help, samples in collect():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ===== المقاييس المشتركة بين الوحدات =====
+ROUTE_SECONDS = REGISTRY.histogram(
+    "medbot_route_seconds", "Update handling time per route", ["route"])
+CRUD_SECONDS = REGISTRY.histogram(
+    "medbot_crud_seconds", "crud function latency", ["function"])
+SHEETS_SECONDS = REGISTRY.histogram(
+    "medbot_sheets_request_seconds", "Google Sheets API request latency", ["kind"])
+SHEETS_ERRORS = REGISTRY.counter(
+    "medbot_sheets_errors_total", "Google Sheets API errors by HTTP status", ["code"])
+TELEGRAM_SECONDS = REGISTRY.histogram(
+    "medbot_telegram_request_seconds", "Telegram Bot API request latency", ["method"])
+TELEGRAM_REQUESTS = REGISTRY.counter(
+    "medbot_telegram_requests_total", "Telegram Bot API requests by outcome", ["method", "outcome"])
+BROADCAST_MESSAGES = REGISTRY.counter(
+    "medbot_broadcast_messages_total", "Broadcast notifications by outcome", ["outcome"])
+UPDATES_SHED = REGISTRY.counter(
+    "medbot_updates_shed_total", "Updates answered before the queue (per-chat throttle or duplicate delivery)",
+    ["reason"])
@@ -0,0 +1,58 @@
+"""
+نقل البيانات مرة واحدة من Google Sheets إلى قاعدة SQL.
+
+الاستخدام:
+    python -m app.migrate                 # DATABASE_URL من البيئة
+    python -m app.migrate --url sqlite:///./medbot.db --force
+"""
+import argparse
+from app.storage import DATABASE_URL, MATERIAL_FIELDS, WAITING_FIELDS
+from app.storage_sheets import SheetsStorage
+from app.storage_sql import SqlStorage, materials, waiting_files
+
+BATCH_SIZE = 1000
+
+
+def _text(value):
+    return "" if value is None else str(value)
+
+
+def migrate(source, target, force=False):
+    """
+    نسخ materials و waiting_files من source إلى target. يعيد عدد الصفوف المنسوخة.
+    القراءة من المصدر تتم أولاً، ثم الحذف والإدخال في معاملة واحدة: فشل القراءة
+    (حصة Google مثلاً) أو الكتابة لا يترك قاعدة الهدف فارغة.
+    """
+    target.init_schema()
+    with target.engine.connect() as conn:
+        if conn.execute(materials.select().limit(1)).first() and not force:
+            raise SystemExit("❌ قاعدة الهدف تحتوي على مواد بالفعل (استخدم --force للاستبدال)")
+
+    rows = [{f: _text(row.get(f)) for f in MATERIAL_FIELDS} for row in source.fetch_materials()
+            if row.get("file_id")]
+    # صف واحد لكل محادثة (الفهرس فريد على chat_id): الأخير يغلب كما في upsert
+    waiting = {str(row.get("chat_id")): {f: _text(row.get(f)) for f in WAITING_FIELDS}
+               for row in source.fetch_waiting() if row.get("chat_id")}
+
+    with target.engine.begin() as conn:
+        conn.execute(materials.delete())
+        conn.execute(waiting_files.delete())
+        for i in range(0, len(rows), BATCH_SIZE):
+            conn.execute(materials.insert(), rows[i:i + BATCH_SIZE])
+        if waiting:
+            conn.execute(waiting_files.insert(), list(waiting.values()))
+    return len(rows), len(waiting)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="نقل بيانات Google Sheets إلى SQL")
+    parser.add_argument("--url", default=DATABASE_URL, help="رابط قاعدة البيانات الهدف")
+    parser.add_argument("--force", action="store_true", help="استبدال البيانات الموجودة في الهدف")
+    args = parser.parse_args()
+
+    n_materials, n_waiting = migrate(SheetsStorage(), SqlStorage(args.url), force=args.force)
+    print(f"✅ تم نقل {n_materials} مادة و {n_waiting} ملف مؤقت إلى {args.url}")
+
+
+if __name__ == "__main__":
+    main()
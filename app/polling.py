@@ -0,0 +1,141 @@
+"""
+تشغيل البوت بسحب التحديثات (getUpdates long polling) بدل الـ webhook: لا يحتاج
+رابطاً عاماً ولا طلبات HTTP واردة.
+
+    python -m app.polling           # يعمل حتى Ctrl+C / SIGTERM
+    python -m app.polling --drain   # معالجة التحديثات المتراكمة ثم الخروج
+
+التحديثات تمر بنفس مسار الـ webhook (admit ← طابور UpdateDispatcher ← handle_update)،
+فالترتيب داخل المحادثة والتوازي بين المحادثات وحدود كل محادثة كما هي.
+لا يعمل السحب والـ webhook معاً: عند البدء يُحذف الـ webhook المسجل (بدون حذف المتراكم).
+"""
+import os
+import signal
+import asyncio
+import logging
+import argparse
+
+logger = logging.getLogger(__name__)
+
+# ===== إعدادات السحب =====
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "50"))  # ثواني انتظار Telegram عند عدم وجود تحديثات
+POLL_LIMIT = int(os.getenv("POLL_LIMIT", "100"))     # تحديثات في كل دفعة (أقصى حد في Telegram 100)
+POLL_ALLOWED_UPDATES = [u.strip() for u in os.getenv(
+    "POLL_ALLOWED_UPDATES", "message,callback_query,inline_query").split(",") if u.strip()]
+POLL_RETRY = float(os.getenv("POLL_RETRY", "5"))     # ثواني قبل إعادة المحاولة بعد خطأ
+QUEUE_FULL_BACKOFF = 0.5                             # ثواني انتظار تفريغ الطابور الممتلئ
+
+
+class UpdatePoller:
+    """
+    سحب التحديثات على دفعات وتمريرها لـ admit (نفس قبول الـ webhook).
+    offset يتقدم بعد كل تحديث قُبل، فيؤكد Telegram استلام ما قبله في الطلب التالي.
+    إن امتلأ الطابور نتوقف عند أول تحديث مرفوض ونعيد طلبه منه بعد قليل
+    (مثل رد 503 للـ webhook الذي يجعل Telegram يعيد الإرسال).
+    """
+
+    def __init__(self, client, admit, timeout=POLL_TIMEOUT, limit=POLL_LIMIT,
+                 allowed_updates=POLL_ALLOWED_UPDATES, retry=POLL_RETRY):
+        self.client = client
+        self.admit = admit
+        self.timeout = timeout
+        self.limit = limit
+        self.allowed_updates = allowed_updates
+        self.retry = retry
+        self.offset = None
+        self.batches = 0
+        self.received = 0
+        self.errors = 0
+        self.statuses = {}
+
+    async def poll_once(self, timeout=None):
+        """
+        دفعة واحدة. يعيد عدد التحديثات المستلمة، أو None بعد خطأ مؤقت
+        (وبعد انتظار retry_after أو POLL_RETRY). توكن مرفوض (401) يرفع RuntimeError.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        payload = {"timeout": timeout, "limit": self.limit, "allowed_updates": self.allowed_updates}
+        if self.offset is not None:
+            payload["offset"] = self.offset
+        # مهلة القراءة أطول من انتظار Telegram حتى لا يُقطع الطلب الفارغ كخطأ شبكة
+        r = await self.client.call("getUpdates", payload, timeout=timeout + 10)
+        if not r.get("ok"):
+            self.errors += 1
+            code = r.get("error_code")
+            if code == 401:
+                raise RuntimeError("Telegram rejected BOT_TOKEN (401)")
+            if code == 409:
+                logger.warning("getUpdates conflict: a webhook is set or another poller is running")
+            else:
+                logger.warning(f"getUpdates failed: {code} {r.get('description')}")
+            await asyncio.sleep((r.get("parameters") or {}).get("retry_after") or self.retry)
+            return None
+
+        updates = r.get("result") or []
+        self.batches += 1
+        for update in updates:
+            status = self.admit(update)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == "full":
+                self.offset = update["update_id"]
+                await asyncio.sleep(QUEUE_FULL_BACKOFF)
+                break
+            self.received += 1
+            self.offset = update["update_id"] + 1
+        return len(updates)
+
+    async def run(self, stop, drain=False):
+        """
+        السحب حتى يُضبط stop (asyncio.Event). drain=True: بدون انتظار
+        (timeout=0) والخروج عند أول دفعة فارغة.
+        """
+        while not stop.is_set():
+            poll = asyncio.create_task(self.poll_once(0 if drain else None))
+            halt = asyncio.create_task(stop.wait())
+            await asyncio.wait({poll, halt}, return_when=asyncio.FIRST_COMPLETED)
+            halt.cancel()
+            if not poll.done():
+                # الدفعة الجارية لم تُقبل بعد؛ Telegram يعيدها للمشغل التالي لأن offset لم يتقدم
+                poll.cancel()
+                await asyncio.gather(poll, return_exceptions=True)
+                break
+            if poll.result() == 0 and drain:
+                break
+
+    def stats(self):
+        return {"offset": self.offset, "batches": self.batches, "received": self.received,
+                "errors": self.errors, "statuses": dict(self.statuses)}
+
+
+async def serve(drain=False):
+    from app import main as bot
+
+    r = await bot.tg.call("deleteWebhook", {"drop_pending_updates": False})
+    if not r.get("ok"):
+        logger.warning(f"deleteWebhook failed: {r.get('error_code')} {r.get('description')}")
+    await bot.startup()
+    poller = UpdatePoller(bot.tg, bot.admit)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    logger.info(f"✅ Polling for updates (timeout={poller.timeout}s, limit={poller.limit})")
+    try:
+        await poller.run(stop, drain)
+        # --drain: انتظار انتهاء معالجة ما سُحب قبل الإيقاف
+        while drain and not stop.is_set() and (bot.dispatcher.queued or bot.dispatcher.in_flight):
+            await asyncio.sleep(0.05)
+    finally:
+        await bot.shutdown()
+        logger.info(f"Polling stopped: {poller.stats()} | updates: {bot.dispatcher.stats()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="تشغيل البوت بـ getUpdates بدل الـ webhook")
+    parser.add_argument("--drain", action="store_true", help="معالجة التحديثات المتراكمة ثم الخروج")
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.drain))
+
+
+if __name__ == "__main__":
+    main()
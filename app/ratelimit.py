@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """
+    دلو رموز (token bucket) آمن بين الخيوط.
+    rate: عدد الرموز المضافة في الثانية، capacity: أقصى رصيد (حجم الدفعة).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def reserve(self, n=1, max_wait=None):
+        """
+        حجز n رموز وإرجاع زمن الانتظار (بالثواني) حتى تصبح متاحة.
+        طلب أكبر من capacity ينتظر دلواً ممتلئاً فقط والباقي دَين على الطلبات التالية.
+        max_wait: إن كان الانتظار أطول منه لا يُحجز شيء ويُعاد None.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            delay = max(0.0, (min(n, self.capacity) - self._tokens) / self.rate)
+            if max_wait is not None and delay > max_wait:
+                return None
+            self._tokens -= n
+            return delay
+
+    def try_acquire(self, n=1):
+        """أخذ n رموز فقط إن كانت متاحة الآن، بدون انتظار."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= n:
+                self._tokens -= n
+                return True
+            return False
+
+    def penalize(self, seconds):
+        """إفراغ الدلو لمدة معينة (مثلاً عند رد 429 مع retry_after)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+    async def acquire(self, n=1):
+        delay = self.reserve(n)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class KeyedThrottle:
+    """
+    حد معدل لكل مفتاح (مثل chat_id) مع فترة تهدئة: عند نفاد رصيد المفتاح
+    يُرفض كل طلباته لمدة cooldown ثانية، ويُبلَّغ المستخدم مرة واحدة فقط خلالها.
+    المفاتيح الأقدم استخداماً تُحذف فوق max_keys.
+    """
+
+    def __init__(self, rate, burst, cooldown, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.cooldown = cooldown
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> TokenBucket
+        self._cooling = {}              # key -> نهاية فترة التهدئة (monotonic)
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = 0
+        self.notices = 0
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_keys:
+                old, _ = self._buckets.popitem(last=False)
+                self._cooling.pop(old, None)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def check(self, key):
+        """
+        ("ok", 0) إن كان مسموحاً، ("notify", ثواني الانتظار) لأول طلب زائد
+        (يجب إبلاغ المستخدم)، أو ("drop", ثواني الانتظار) خلال فترة التهدئة.
+        """
+        with self._lock:
+            bucket = self._bucket(key)
+            now = time.monotonic()
+            until = self._cooling.get(key, 0.0)
+            if now >= until and bucket.try_acquire():
+                self._cooling.pop(key, None)
+                self.allowed += 1
+                return "ok", 0.0
+            self.throttled += 1
+            if now < until:
+                return "drop", until - now
+            self._cooling[key] = until = now + self.cooldown
+            self.notices += 1
+            return "notify", self.cooldown
+
+    def stats(self):
+        return {"allowed": self.allowed, "throttled": self.throttled, "notices": self.notices,
+                "cooling": sum(1 for until in list(self._cooling.values()) if until > time.monotonic())}
@@ -0,0 +1,134 @@
+import re
+import threading
+from bisect import bisect_left
+
+# ===== توحيد النص العربي والإنجليزي =====
+_DIACRITICS = re.compile("[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")  # تشكيل وتطويل
+_ARABIC_MAP = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ئ": "ي", "ؤ": "و", "ة": "ه",
+    **{chr(0x0660 + d): str(d) for d in range(10)},   # ٠١٢... -> 0 1 2
+    **{chr(0x06F0 + d): str(d) for d in range(10)},   # ۰۱۲... (فارسية)
+})
+_NON_WORD = re.compile(r"[^\w]+|_")
+# أداة التعريف وما يسبقها ("الالتهاب" و"بالالتهاب" -> "التهاب")
+_ARTICLES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+MIN_FUZZY_LENGTH = 4  # لا مطابقة تقريبية للكلمات القصيرة (تكثر النتائج الخاطئة)
+
+# أوزان الترتيب
+EXACT, PREFIX, FUZZY = 3, 2, 1
+
+
+def normalize(text):
+    text = _DIACRITICS.sub("", str(text or "").lower()).translate(_ARABIC_MAP)
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def _forms(token):
+    """
+    الكلمة وكل صيغها بعد حذف أداة التعريف تكراراً:
+    "الالتهاب" -> الالتهاب، التهاب، تهاب. فتتطابق "التهاب" و"الالتهاب" في الاتجاهين.
+    """
+    forms = [token]
+    while True:
+        for article in _ARTICLES:
+            if token.startswith(article) and len(token) - len(article) >= 2:
+                token = token[len(article):]
+                forms.append(token)
+                break
+        else:
+            return forms
+
+
+def tokenize(text):
+    return normalize(text).split()
+
+
+def _deletes(term):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+class SearchIndex:
+    """
+    فهرس معكوس في الذاكرة: كلمة -> مجموعة أرقام المستندات.
+    - مطابقة تامة، وبادئة عبر قائمة مفردات مرتبة (bisect)
+    - مطابقة تقريبية بمسافة تعديل 1 عبر فهرس الحذف (symmetric delete)
+    المستند = (مفتاح، ترتيبه داخل قائمة المفتاح، الصف). البناء يستبدل الفهرس دفعة واحدة.
+    """
+
+    def __init__(self):
+        self._state = ([], {}, [], {})  # docs, postings, vocab مرتبة, deletes
+        self._lock = threading.Lock()
+        self.version = None
+
+    def build(self, groups, describe, version=None):
+        """
+        groups: [(key, rows)]، describe(key, row) -> نص البحث للمستند.
+        """
+        docs, postings = [], {}
+        for key, rows in groups:
+            for position, row in enumerate(rows):
+                doc_id = len(docs)
+                docs.append((key, position, row))
+                terms = {form for token in tokenize(describe(key, row)) for form in _forms(token)}
+                for token in terms:
+                    postings.setdefault(token, set()).add(doc_id)
+        deletes = {}
+        for term in postings:
+            if len(term) >= MIN_FUZZY_LENGTH:
+                for variant in _deletes(term):
+                    deletes.setdefault(variant, set()).add(term)
+        with self._lock:
+            self._state = (docs, postings, sorted(postings), deletes)
+            self.version = version
+
+    def _term_scores(self, token, postings, vocab, deletes):
+        """رقم المستند -> أفضل وزن لهذه الكلمة."""
+        scores = {}
+        # البادئة تشمل المطابقة التامة
+        i = bisect_left(vocab, token)
+        while i < len(vocab) and vocab[i].startswith(token):
+            weight = EXACT if vocab[i] == token else PREFIX
+            for doc_id in postings[vocab[i]]:
+                if scores.get(doc_id, 0) < weight:
+                    scores[doc_id] = weight
+            i += 1
+        if len(token) >= MIN_FUZZY_LENGTH:
+            candidates = set(deletes.get(token, ()))
+            for variant in _deletes(token):
+                candidates.update(deletes.get(variant, ()))
+                if variant in postings:
+                    candidates.add(variant)
+            for term in candidates:
+                for doc_id in postings[term]:
+                    scores.setdefault(doc_id, FUZZY)
+        return scores
+
+    def search(self, query, limit=10):
+        """
+        المستندات التي تطابق كل كلمات البحث (تامة أو بادئة أو تقريبية)،
+        مرتبة بمجموع الأوزان ثم الأحدث أولاً. يعيد [(key, position, row)].
+        """
+        docs, postings, vocab, deletes = self._state
+        tokens = tokenize(query)
+        if not tokens or not docs:
+            return []
+        total = None
+        for token in dict.fromkeys(tokens):
+            scores = {}
+            for form in _forms(token):
+                for doc_id, weight in self._term_scores(form, postings, vocab, deletes).items():
+                    if scores.get(doc_id, 0) < weight:
+                        scores[doc_id] = weight
+            if total is None:
+                total = scores
+            else:
+                total = {d: s + scores[d] for d, s in total.items() if d in scores}
+            if not total:
+                return []
+        ranked = sorted(total.items(), key=lambda item: (-item[1], -item[0]))
+        return [docs[doc_id] for doc_id, _ in ranked[:limit]]
+
+    def __len__(self):
+        return len(self._state[0])
@@ -0,0 +1,186 @@
+import os
+import time
+import random
+import threading
+import logging
+import gspread
+from google.auth.exceptions import RefreshError, TransportError
+from app.ratelimit import TokenBucket
+from app.metrics import SHEETS_SECONDS, SHEETS_ERRORS
+from app.storage import StorageUnavailable, current_operation
+
+logger = logging.getLogger(__name__)
+
+# ===== ميزانية طلبات Google Sheets API =====
+# الحد الافتراضي لـ Google: 60 قراءة و60 كتابة في الدقيقة لكل حساب خدمة
+SHEETS_READS_PER_MINUTE = float(os.getenv("SHEETS_READS_PER_MINUTE", "60"))
+SHEETS_WRITES_PER_MINUTE = float(os.getenv("SHEETS_WRITES_PER_MINUTE", "60"))
+SHEETS_MAX_WAIT = float(os.getenv("SHEETS_MAX_WAIT", "10"))      # أقصى انتظار للميزانية قبل الاستسلام
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", "4"))   # لأخطاء 429 و5xx
+SHEETS_BACKOFF_CAP = float(os.getenv("SHEETS_BACKOFF_CAP", "32"))
+
+
+def _status_code(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+class QuotaExceeded(StorageUnavailable):
+    """الميزانية مستنفدة أو استمر رد 429/5xx بعد كل المحاولات."""
+
+
+class SheetHandles:
+    """
+    مدير مقابض Google Sheets: يفتح الملف مرة واحدة ويحتفظ بكائنات
+    Worksheet حسب العنوان، ويعيد الفتح/التفويض عند انتهاء الصلاحية أو
+    عند خطأ "غير موجود". آمن للاستخدام من عدة خيوط.
+
+    كل طلب يمر عبر call() التي تفرض ميزانية قراءة/كتابة في الدقيقة
+    (token bucket)، وتعيد المحاولة عند 429/5xx مع تأخير أسّي عشوائي،
+    وتحصي عدد الطلبات لكل عملية crud.
+    """
+
+    def __init__(self, authorize, spreadsheet_name, reads_per_minute=SHEETS_READS_PER_MINUTE,
+                 writes_per_minute=SHEETS_WRITES_PER_MINUTE, max_wait=SHEETS_MAX_WAIT,
+                 max_retries=SHEETS_MAX_RETRIES, backoff_cap=SHEETS_BACKOFF_CAP):
+        self._authorize = authorize  # دالة تعيد gspread.Client جديد
+        self.spreadsheet_name = spreadsheet_name
+        self._client = None
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._lock = threading.RLock()
+        # سعة الدلو = ميزانية 10 ثوانٍ حتى لا تُستهلك حصة الدقيقة كلها دفعة واحدة
+        self.buckets = {
+            "read": TokenBucket(reads_per_minute / 60, max(1, reads_per_minute / 6)),
+            "write": TokenBucket(writes_per_minute / 60, max(1, writes_per_minute / 6)),
+        }
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff_cap = backoff_cap
+        self._stats_lock = threading.Lock()
+        self.calls = {}   # العملية -> {"read": n, "write": n}
+        self.retries = 0
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.quota_errors = 0
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._authorize()
+            return self._client
+
+    def spreadsheet(self, create=False):
+        with self._lock:
+            if self._spreadsheet is None:
+                try:
+                    self._spreadsheet = self.client.open(self.spreadsheet_name)
+                except gspread.SpreadsheetNotFound:
+                    if not create:
+                        raise
+                    self._spreadsheet = self.client.create(self.spreadsheet_name)
+            return self._spreadsheet
+
+    def worksheet(self, title):
+        ws = self._worksheets.get(title)
+        if ws is not None:
+            return ws
+        with self._lock:
+            ws = self._worksheets.get(title)
+            if ws is None:
+                ws = self.spreadsheet().worksheet(title)
+                self._worksheets[title] = ws
+            return ws
+
+    def invalidate(self, reauth=False):
+        """نسيان المقابض المخزنة (ومع reauth نسيان العميل لإعادة التفويض)."""
+        with self._lock:
+            self._worksheets = {}
+            self._spreadsheet = None
+            if reauth:
+                self._client = None
+
+    def _target(self, title):
+        return self.spreadsheet() if title is None else self.worksheet(title)
+
+    # ----- الميزانية والإحصاء -----
+    def _spend(self, kind):
+        """أخذ رمز من ميزانية النوع؛ QuotaExceeded إن كان الانتظار أطول من max_wait."""
+        delay = self.buckets[kind].reserve(1, max_wait=self.max_wait)
+        if delay is None:
+            with self._stats_lock:
+                self.quota_errors += 1
+            raise QuotaExceeded(f"Sheets {kind} budget exhausted")
+        if delay > 0:
+            with self._stats_lock:
+                self.throttled += 1
+                self.throttled_seconds += delay
+            time.sleep(delay)
+        with self._stats_lock:
+            counts = self.calls.setdefault(current_operation(), {"read": 0, "write": 0})
+            counts[kind] += 1
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_cap, 2 ** attempt))
+
+    def call(self, title, fn, kind="read"):
+        """
+        تنفيذ fn(worksheet) ضمن ميزانية kind ("read" أو "write").
+        - انتهاء التفويض أو ملف/ورقة غير موجودة: إعادة محاولة واحدة بعد تحديث المقابض
+        - 429: انتظار عشوائي متزايد مع تجميد الميزانية لبقية الخيوط
+        - 5xx: نفس الشيء للقراءة فقط (append_rows مثلاً ليست آمنة للتكرار)
+        title=None: تنفيذ fn(spreadsheet) على الملف نفسه.
+        """
+        refreshed = False
+        attempt = 0
+        while True:
+            self._spend(kind)
+            try:
+                with SHEETS_SECONDS.time(kind=kind):
+                    return fn(self._target(title))
+            except (RefreshError, TransportError) as e:
+                if refreshed:
+                    raise
+                logger.warning(f"Sheets auth expired ({e!r}), re-authorizing")
+                self.invalidate(reauth=True)
+                refreshed = True
+            except (gspread.SpreadsheetNotFound, gspread.WorksheetNotFound) as e:
+                if refreshed:
+                    raise
+                logger.warning(f"Sheets handle for {title!r} is stale ({e!r}), reopening")
+                self.invalidate()
+                refreshed = True
+            except gspread.exceptions.APIError as e:
+                code = _status_code(e)
+                SHEETS_ERRORS.inc(code=code)
+                if code in (401, 404) and not refreshed:
+                    self.invalidate(reauth=code == 401)
+                    refreshed = True
+                    logger.warning(f"Sheets API {code} on {title!r}, refreshing handles")
+                    continue
+                retryable = code == 429 or (kind == "read" and code is not None and code >= 500)
+                if not retryable:
+                    raise
+                if attempt >= self.max_retries:
+                    with self._stats_lock:
+                        self.quota_errors += 1
+                    raise QuotaExceeded(f"Sheets API {code} on {title!r} after {attempt} retries") from e
+                delay = self._backoff(attempt)
+                if code == 429:
+                    self.buckets[kind].penalize(delay)
+                attempt += 1
+                with self._stats_lock:
+                    self.retries += 1
+                logger.warning(f"Sheets API {code} on {title!r}, retry {attempt} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "calls": {op: dict(counts) for op, counts in self.calls.items()},
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+                "quota_errors": self.quota_errors,
+            }
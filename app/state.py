@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+
+# ===== إعدادات حالة المحادثات =====
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()  # memory | sqlite
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "./medbot-state.db")
+STATE_TTL = float(os.getenv("STATE_TTL", str(6 * 3600)))       # ثواني بدون نشاط قبل الحذف
+STATE_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", "50000"))
+
+
+class Session:
+    """سجل حالة محادثة واحدة (مضغوط بـ __slots__)."""
+
+    __slots__ = ("semester", "course", "type", "files")
+
+    def __init__(self, semester=None, course=None, type=None, files=None):
+        self.semester = semester
+        self.course = course
+        self.type = type
+        self.files = files if files is not None else []
+
+    def to_dict(self):
+        return {"semester": self.semester, "course": self.course,
+                "type": self.type, "files": self.files}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("semester"), data.get("course"), data.get("type"), data.get("files"))
+
+
+class MemoryStateStore:
+    """مخزن داخل العملية مع انتهاء صلاحية (TTL) وإخلاء الأقدم استخداماً (LRU)."""
+
+    blocking = False  # عمليات في الذاكرة: تُستدعى مباشرة من حلقة الأحداث
+
+    def __init__(self, ttl=STATE_TTL, max_entries=STATE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # (ns, chat_id) -> (آخر استخدام، Session)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, ns, chat_id):
+        key = (ns, chat_id)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._data[key]
+                self.evictions += 1
+                return None
+            self._data[key] = (time.monotonic(), entry[1])
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def put(self, ns, chat_id, session):
+        key = (ns, chat_id)
+        with self._lock:
+            self._data[key] = (time.monotonic(), session)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, ns, chat_id):
+        with self._lock:
+            entry = self._data.pop((ns, chat_id), None)
+            return entry[1] if entry else None
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteStateStore:
+    """
+    مخزن مشترك في ملف SQLite: يسمح لعدة عمال uvicorn (أو عدة نسخ على نفس القرص)
+    بخدمة نفس المحادثات، ويحفظ الحالة عبر إعادة التشغيل.
+    """
+
+    blocking = True  # قراءة/كتابة قرص مع قفل بين العمليات: تُنفذ خارج حلقة الأحداث
+
+    def __init__(self, path=STATE_DB_PATH, ttl=STATE_TTL, max_entries=STATE_MAX_ENTRIES,
+                 prune_every=500, touch_interval=60):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        # القراءة تمدد الصلاحية مثل المخزن في الذاكرة، لكن بكتابة واحدة كل touch_interval ثانية على الأكثر
+        self.touch_interval = min(touch_interval, ttl / 10)
+        self._writes = 0
+        self.evictions = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "ns TEXT NOT NULL, chat_id TEXT NOT NULL, data TEXT NOT NULL, "
+            "touched REAL NOT NULL, PRIMARY KEY (ns, chat_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_state_touched ON state (touched)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, ns, chat_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, touched FROM state WHERE ns = ? AND chat_id = ?",
+                (ns, str(chat_id))).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM state WHERE ns = ? AND chat_id = ?", (ns, str(chat_id)))
+                self._conn.commit()
+                self.evictions += 1
+                return None
+            if now - row[1] > self.touch_interval:
+                self._conn.execute("UPDATE state SET touched = ? WHERE ns = ? AND chat_id = ?",
+                                   (now, ns, str(chat_id)))
+                self._conn.commit()
+            return Session.from_dict(json.loads(row[0]))
+
+    def put(self, ns, chat_id, session):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO state (ns, chat_id, data, touched) VALUES (?, ?, ?, ?)",
+                (ns, str(chat_id), json.dumps(session.to_dict(), ensure_ascii=False), time.time()))
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self._prune()
+            self._conn.commit()
+
+    def _prune(self):
+        """حذف المنتهية صلاحيتها ثم الأقدم استخداماً فوق الحد الأقصى."""
+        cur = self._conn.execute("DELETE FROM state WHERE touched < ?", (time.time() - self.ttl,))
+        self.evictions += cur.rowcount
+        cur = self._conn.execute(
+            "DELETE FROM state WHERE rowid IN (SELECT rowid FROM state ORDER BY touched DESC "
+            "LIMIT -1 OFFSET ?)", (self.max_entries,))
+        self.evictions += cur.rowcount
+
+    def pop(self, ns, chat_id):
+        session = self.get(ns, chat_id)
+        if session is not None:
+            with self._lock:
+                self._conn.execute("DELETE FROM state WHERE ns = ? AND chat_id = ?", (ns, str(chat_id)))
+                self._conn.commit()
+        return session
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM state").fetchone()[0]
+
+
+class StateNamespace:
+    """
+    واجهة مختصرة لنوع واحد من الحالة (user أو upload) داخل المخزن.
+    الدوال async: مخزن SQLite يُستدعى في خيط (asyncio.to_thread) حتى لا يوقف
+    قفل الملف بين العمال كل المحادثات، ومخزن الذاكرة يُستدعى مباشرة.
+    """
+
+    def __init__(self, store, ns):
+        self.store = store
+        self.ns = ns
+
+    async def _call(self, fn, *args):
+        if self.store.blocking:
+            return await asyncio.to_thread(fn, self.ns, *args)
+        return fn(self.ns, *args)
+
+    async def get(self, chat_id):
+        return await self._call(self.store.get, chat_id)
+
+    async def put(self, chat_id, session):
+        await self._call(self.store.put, chat_id, session)
+
+    async def pop(self, chat_id):
+        return await self._call(self.store.pop, chat_id)
+
+
+def get_state_store(backend=None):
+    backend = (backend or STATE_BACKEND).lower()
+    if backend == "sqlite":
+        return SqliteStateStore()
+    if backend == "memory":
+        return MemoryStateStore()
+    raise ValueError(f"❌ مخزن حالة غير معروف: {backend}")
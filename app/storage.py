@@ -0,0 +1,134 @@
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# ===== اختيار محرك التخزين =====
+# sheets: Google Sheets (الافتراضي) | sql: SQLAlchemy (SQLite افتراضياً عبر DATABASE_URL)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sheets").lower()
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./medbot.db")
+
+# اسم عملية crud الجارية (لإحصاء طلبات API لكل عملية)
+OPERATION = ContextVar("storage_operation", default=None)
+
+
+class StorageUnavailable(Exception):
+    """المصدر غير متاح حالياً (حصة مستنفدة أو خطأ مؤقت) ولا توجد نسخة محفوظة."""
+
+
+@contextmanager
+def operation(name):
+    token = OPERATION.set(name)
+    try:
+        yield
+    finally:
+        OPERATION.reset(token)
+
+
+def current_operation():
+    """العملية الحالية، أو اسم الخيط للأعمال الخلفية (journal-flush, materials-refresher...)."""
+    return OPERATION.get() or threading.current_thread().name
+
+
+MATERIAL_FIELDS = ["semester", "course", "type", "file_id", "created_at", "file_name", "file_size",
+                   "file_unique_id"]
+WAITING_FIELDS = ["chat_id", "file_id", "type", "semester"]
+
+
+class Storage:
+    """
+    الواجهة المشتركة لمحركات التخزين.
+    crud يتعامل مع هذه الدوال فقط؛ الفهرس والكاش يبقيان في crud.
+    """
+
+    name = "base"
+
+    def init_schema(self):
+        """إنشاء الجداول/الأوراق والتحقق من رؤوس الأعمدة."""
+        raise NotImplementedError
+
+    # ----- المواد -----
+    def fetch_materials(self):
+        """كل صفوف المواد كقائمة dict بحقول MATERIAL_FIELDS."""
+        raise NotImplementedError
+
+    def iter_materials(self):
+        """صفوف المواد واحداً تلو الآخر (للتصدير). المحركات التي تدعم القراءة المتدفقة تعيد تعريفها."""
+        yield from self.fetch_materials()
+
+    def get_materials(self, semester, course, type_):
+        """قراءة مباشرة من المصدر لمقرر ونوع معينين (بدون الفهرس في الذاكرة)."""
+        key = (str(semester), str(course), str(type_))
+        return [row for row in self.fetch_materials()
+                if (str(row.get("semester")), str(row.get("course")), str(row.get("type"))) == key]
+
+    def existing_ids(self, keys):
+        """
+        المواد الموجودة في مفاتيح keys [(semester, course, type)] لاستبعاد المكرر عند الاستيراد:
+        ({(المفتاح، file_id)}, {(المفتاح، file_unique_id)}). قراءة متدفقة بدون الاحتفاظ بالصفوف.
+        """
+        keys = set(keys)
+        file_ids, unique_ids = set(), set()
+        for row in self.iter_materials():
+            key = (str(row.get("semester")).strip(), str(row.get("course")).strip(), str(row.get("type")).strip())
+            if key in keys:
+                file_ids.add((key, str(row.get("file_id"))))
+                if row.get("file_unique_id"):
+                    unique_ids.add((key, str(row.get("file_unique_id"))))
+        return file_ids, unique_ids
+
+    def source_version(self):
+        """
+        قيمة رخيصة تتغير عند تغيّر بيانات المواد في المصدر (للتحديث عند التغيير فقط).
+        None تعني أن المحرك لا يدعم ذلك فيُعاد التحميل في كل دورة.
+        """
+        return None
+
+    def append_materials(self, rows):
+        """إضافة صفوف (قوائم بترتيب MATERIAL_FIELDS) بعملية كتابة واحدة."""
+        raise NotImplementedError
+
+    # ----- الملفات المؤقتة -----
+    def fetch_waiting(self):
+        """كل صفوف waiting_files كقائمة dict بحقول WAITING_FIELDS."""
+        raise NotImplementedError
+
+    def get_waiting(self, chat_id):
+        """صف المحادثة أو None."""
+        raise NotImplementedError
+
+    def upsert_waiting(self, chat_id, file_id="", type_="", semester=""):
+        """إنشاء صف المحادثة أو استبدال قيمه."""
+        raise NotImplementedError
+
+    def update_waiting(self, chat_id, **fields):
+        """تحديث حقول صف موجود فقط. يعيد False إن لم يوجد الصف."""
+        raise NotImplementedError
+
+    def upsert_waiting_many(self, changes):
+        """تطبيق عدة تحديثات: changes = {chat_id: {field: value}} (إنشاء الصف إن لم يوجد)."""
+        for chat_id, fields in changes.items():
+            row = self.get_waiting(chat_id) or {}
+            row.update(fields)
+            self.upsert_waiting(chat_id, row.get("file_id") or "", row.get("type") or "",
+                                row.get("semester") or "")
+
+    def delete_waiting(self, chat_id):
+        """حذف صف المحادثة إن وجد."""
+        raise NotImplementedError
+
+    def stats(self):
+        """إحصائيات المحرك (عدد طلبات API وما شابه)."""
+        return {}
+
+
+def get_storage(backend=None):
+    """إنشاء محرك التخزين حسب STORAGE_BACKEND."""
+    backend = (backend or STORAGE_BACKEND).lower()
+    if backend == "sql":
+        from app.storage_sql import SqlStorage
+        return SqlStorage(DATABASE_URL)
+    if backend == "sheets":
+        from app.storage_sheets import SheetsStorage
+        return SheetsStorage()
+    raise ValueError(f"❌ محرك تخزين غير معروف: {backend}")
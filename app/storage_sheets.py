@@ -0,0 +1,200 @@
+import os
+import re
+import json
+import time
+import threading
+import logging
+import gspread
+from google.oauth2.service_account import Credentials
+from app.sheets import SheetHandles
+from app.storage import Storage, MATERIAL_FIELDS, WAITING_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# ===== إعداد Google Sheets =====
+GOOGLE_SHEET_NAME = os.getenv("GOOGLE_SHEET_NAME", "MedBot Files")
+# ثواني قبل إعادة قراءة أرقام صفوف waiting_files (لالتقاط تعديل يدوي أو نسخة أخرى)
+WAITING_INDEX_TTL = float(os.getenv("WAITING_INDEX_TTL", "300"))
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"
+]
+
+
+def _load_credentials():
+    service_account_json = os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON")
+    if not service_account_json:
+        raise ValueError("❌ متغير البيئة GOOGLE_SERVICE_ACCOUNT_JSON غير موجود!")
+    creds_info = json.loads(service_account_json)
+    return Credentials.from_service_account_info(creds_info, scopes=SCOPES)
+
+
+def _authorize():
+    # قراءة بيانات الاعتماد عند أول طلب فعلي وليس عند استيراد الوحدة
+    return gspread.authorize(_load_credentials())
+
+
+def _ensure_header(handles, titles, title, header, rows):
+    """
+    إنشاء الورقة برأس الأعمدة أو تصحيح الرأس إن كان مختلفاً.
+    كل طلب يمر عبر handles.call (الميزانية وإعادة المحاولة عند 429).
+    """
+    if title not in titles:
+        handles.call(None, lambda spreadsheet: spreadsheet.add_worksheet(
+            title=title, rows=rows, cols=len(header)), kind="write")
+        handles.call(title, lambda sheet: sheet.append_row(header), kind="write")
+        return
+    if handles.call(title, lambda sheet: sheet.row_values(1))[: len(header)] == header:
+        return
+    # أعمدة جديدة (مثل file_name و file_size) تتطلب توسيع الورقة قبل كتابة الرأس
+    sheet = handles.worksheet(title)
+    if sheet.col_count < len(header):
+        handles.call(title, lambda sheet: sheet.add_cols(len(header) - sheet.col_count), kind="write")
+    try:
+        handles.call(title, lambda sheet: sheet.delete_rows(1), kind="write")
+    except Exception:
+        pass
+    handles.call(title, lambda sheet: sheet.insert_row(header, 1), kind="write")
+
+
+def _first_appended_row(response):
+    """رقم أول صف مُضاف من رد append_rows (مثل 'waiting_files!A5:D6')."""
+    try:
+        updated = response["updates"]["updatedRange"]
+        return int(re.match(r"[A-Z]+(\d+)", updated.split("!")[-1]).group(1))
+    except (TypeError, KeyError, AttributeError, ValueError):
+        return None
+
+
+class SheetsStorage(Storage):
+    """محرك Google Sheets: ورقة materials وورقة waiting_files."""
+
+    name = "sheets"
+
+    def __init__(self, handles=None):
+        if handles is None:
+            handles = SheetHandles(_authorize, GOOGLE_SHEET_NAME)
+        self.handles = handles
+        # gspread ليس آمناً للخيوط في عمليات القراءة-ثم-الكتابة
+        self.lock = threading.Lock()
+        # نسخة waiting_files في الذاكرة: chat_id -> [رقم الصف في الورقة، الصف]
+        # تُحمَّل بقراءة واحدة، وبعدها كل عملية = طلب API واحد.
+        self._waiting = None
+        self._waiting_loaded = 0.0
+
+    def init_schema(self):
+        with self.lock:
+            # فتح الملف (أو إنشاؤه عند أول تشغيل) ثم كل الطلبات عبر handles.call
+            self.handles.spreadsheet(create=True)
+            titles = self.handles.call(None, lambda spreadsheet: [s.title for s in spreadsheet.worksheets()])
+            # materials: semester, course, type, file_id, created_at, file_name, file_size, file_unique_id
+            _ensure_header(self.handles, titles, "materials", MATERIAL_FIELDS, 5000)
+            # waiting_files: chat_id, file_id, type, semester
+            _ensure_header(self.handles, titles, "waiting_files", WAITING_FIELDS, 1000)
+
+    # ----- المواد -----
+    def fetch_materials(self):
+        # بدون تحويل الخلايا لأرقام: اسم ملف مثل "007" يبقى نصاً كما كُتب
+        return self.handles.call("materials", lambda sheet: sheet.get_all_records(numericise_ignore=["all"]))
+
+    def source_version(self):
+        # modifiedTime من Drive: طلب بيانات وصفية واحد بدل تنزيل الورقة
+        return self.handles.call(None, lambda spreadsheet: spreadsheet.get_lastUpdateTime())
+
+    def append_materials(self, rows):
+        with self.lock:
+            self.handles.call("materials", lambda sheet: sheet.append_rows(rows), kind="write")
+
+    def stats(self):
+        return self.handles.stats()
+
+    # ----- الملفات المؤقتة -----
+    def fetch_waiting(self):
+        return self.handles.call("waiting_files", lambda sheet: sheet.get_all_records())
+
+    def _waiting_index(self):
+        """
+        الفهرس من الذاكرة بدون طلب إضافي قبل الكتابة. يُعاد تحميله بعد فشل كتابة،
+        أو عند انزياح صفوف لاحظه رد append_rows، أو بعد WAITING_INDEX_TTL ثانية.
+        """
+        if self._waiting is None or time.monotonic() - self._waiting_loaded > WAITING_INDEX_TTL:
+            index = {}
+            for i, row in enumerate(self.fetch_waiting(), start=2):
+                index.setdefault(str(row.get("chat_id")), [i, row])
+            self._waiting = index
+            self._waiting_loaded = time.monotonic()
+        return self._waiting
+
+    def _write(self, fn):
+        """تنفيذ كتابة على الورقة؛ عند الفشل نُسقط الفهرس لأن أرقام الصفوف قد تكون تغيرت."""
+        try:
+            return self.handles.call("waiting_files", fn, kind="write")
+        except Exception:
+            self._waiting = None
+            raise
+
+    def get_waiting(self, chat_id):
+        with self.lock:
+            entry = self._waiting_index().get(str(chat_id))
+            return dict(entry[1]) if entry else None
+
+    def upsert_waiting(self, chat_id, file_id="", type_="", semester=""):
+        self.upsert_waiting_many({chat_id: {"file_id": file_id, "type": type_,
+                                            "semester": semester or ""}})
+
+    def update_waiting(self, chat_id, **fields):
+        with self.lock:
+            if str(chat_id) not in self._waiting_index():
+                return False
+            self._apply_waiting({chat_id: fields}, insert=False)
+            return True
+
+    def upsert_waiting_many(self, changes):
+        """
+        تطبيق عدة تحديثات دفعة واحدة: changes = {chat_id: {field: value}}.
+        الصفوف الموجودة تُحدَّث بطلب batch_update واحد، والجديدة بطلب append_rows واحد.
+        """
+        with self.lock:
+            self._apply_waiting(changes, insert=True)
+
+    def _apply_waiting(self, changes, insert):
+        index = self._waiting_index()
+        updates, appends = [], []
+        for chat_id, fields in changes.items():
+            entry = index.get(str(chat_id))
+            if entry is None and not insert:
+                continue
+            row = dict(entry[1]) if entry else {"chat_id": chat_id, "file_id": "", "type": "", "semester": ""}
+            row.update(fields)
+            values = [row.get(f) if row.get(f) is not None else "" for f in WAITING_FIELDS]
+            if entry:
+                updates.append({"range": f"A{entry[0]}:D{entry[0]}", "values": [values]})
+                entry[1] = row
+            else:
+                appends.append((str(chat_id), row, values))
+        if updates:
+            self._write(lambda sheet: sheet.batch_update(updates))
+        if appends:
+            expected = 1 + max((entry[0] for entry in index.values()), default=1)
+            response = self._write(lambda sheet: sheet.append_rows([values for _, _, values in appends]))
+            first = _first_appended_row(response)
+            if first is not None and first != expected:
+                # الورقة تغيرت من خارج هذه النسخة: أرقام الصفوف في الذاكرة لم تعد موثوقة
+                logger.warning("waiting_files rows moved since last read, reloading the row index")
+                self._waiting = None
+                return
+            for offset, (key, row, _) in enumerate(appends):
+                index[key] = [expected + offset, row]
+
+    def delete_waiting(self, chat_id):
+        with self.lock:
+            index = self._waiting_index()
+            entry = index.pop(str(chat_id), None)
+            if entry is None:
+                return
+            row_number = entry[0]
+            self._write(lambda sheet: sheet.delete_rows(row_number))
+            # الصفوف التي بعد المحذوف تنزاح صفاً للأعلى
+            for other in index.values():
+                if other[0] > row_number:
+                    other[0] -= 1
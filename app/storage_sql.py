@@ -0,0 +1,165 @@
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, Index, create_engine, event,
+    select, insert, update, delete, func, inspect, text, and_, or_,
+)
+from app.storage import Storage, MATERIAL_FIELDS, WAITING_FIELDS
+
+metadata = MetaData()
+
+materials = Table(
+    "materials", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("semester", String(8), nullable=False),
+    Column("course", String(128), nullable=False),
+    Column("type", String(16), nullable=False),
+    Column("file_id", String(256), nullable=False),
+    Column("created_at", String(32), nullable=False, default=""),
+    Column("file_name", String(256), nullable=False, default=""),
+    Column("file_size", String(16), nullable=False, default=""),
+    Column("file_unique_id", String(64), nullable=False, default=""),
+    Index("ix_materials_semester_course_type", "semester", "course", "type"),
+)
+
+waiting_files = Table(
+    "waiting_files", metadata,
+    Column("chat_id", String(32), nullable=False),
+    Column("file_id", String(256), nullable=False, default=""),
+    Column("type", String(16), nullable=False, default=""),
+    Column("semester", String(8), nullable=False, default=""),
+    Index("ix_waiting_files_chat_id", "chat_id", unique=True),
+)
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+class SqlStorage(Storage):
+    """محرك SQLAlchemy (SQLite افتراضياً) مع فهارس على الأعمدة المستخدمة في البحث."""
+
+    name = "sql"
+
+    def __init__(self, url):
+        kwargs = {}
+        if url.startswith("sqlite"):
+            kwargs["connect_args"] = {"check_same_thread": False}
+        self.engine = create_engine(url, **kwargs)
+        if url.startswith("sqlite"):
+            event.listen(self.engine, "connect", _sqlite_pragmas)
+
+    def init_schema(self):
+        metadata.create_all(self.engine)
+        self._add_missing_columns()
+
+    def _add_missing_columns(self):
+        """create_all لا يعدّل جداول موجودة: إضافة الأعمدة الجديدة (file_name...) لقواعد قديمة."""
+        for table in (materials, waiting_files):
+            existing = {c["name"] for c in inspect(self.engine).get_columns(table.name)}
+            missing = [c for c in table.columns if c.name not in existing]
+            if not missing:
+                continue
+            with self.engine.begin() as conn:
+                for column in missing:
+                    ddl = column.type.compile(self.engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {ddl} "
+                                      f"NOT NULL DEFAULT ''"))
+
+    # ----- المواد -----
+    def fetch_materials(self):
+        cols = [materials.c[f] for f in MATERIAL_FIELDS]
+        with self.engine.connect() as conn:
+            result = conn.execute(select(*cols).order_by(materials.c.id))
+            return [dict(row._mapping) for row in result]
+
+    def iter_materials(self, batch_size=1000):
+        """قراءة متدفقة بدفعات من المؤشر بدل تحميل الجدول كاملاً."""
+        cols = [materials.c[f] for f in MATERIAL_FIELDS]
+        with self.engine.connect() as conn:
+            result = conn.execution_options(yield_per=batch_size).execute(
+                select(*cols).order_by(materials.c.id))
+            for row in result:
+                yield dict(row._mapping)
+
+    def get_materials(self, semester, course, type_):
+        """بحث مباشر عبر الفهرس المركب (semester, course, type)."""
+        cols = [materials.c[f] for f in MATERIAL_FIELDS]
+        query = (select(*cols)
+                 .where(materials.c.semester == str(semester),
+                        materials.c.course == str(course),
+                        materials.c.type == str(type_))
+                 .order_by(materials.c.id))
+        with self.engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(query)]
+
+    def existing_ids(self, keys):
+        """نفس الواجهة العامة، باستعلام واحد عبر الفهرس المركب لمفاتيح الدفعة فقط."""
+        keys = list(keys)
+        if not keys:
+            return set(), set()
+        query = (select(materials.c.semester, materials.c.course, materials.c.type,
+                        materials.c.file_id, materials.c.file_unique_id)
+                 .where(or_(*[and_(materials.c.semester == semester, materials.c.course == course,
+                                   materials.c.type == type_) for semester, course, type_ in keys])))
+        file_ids, unique_ids = set(), set()
+        with self.engine.connect() as conn:
+            for semester, course, type_, file_id, unique_id in conn.execute(query):
+                key = (semester, course, type_)
+                file_ids.add((key, file_id))
+                if unique_id:
+                    unique_ids.add((key, unique_id))
+        return file_ids, unique_ids
+
+    def source_version(self):
+        # الصفوف تُضاف فقط، فعدد الصفوف وأكبر id يكفيان لكشف التغيير
+        query = select(func.count(), func.max(materials.c.id))
+        with self.engine.connect() as conn:
+            count, max_id = conn.execute(query).one()
+        return f"{count}:{max_id or 0}"
+
+    def append_materials(self, rows):
+        if not rows:
+            return
+        values = [{f: ("" if v is None else str(v)) for f, v in zip(MATERIAL_FIELDS, row)}
+                  for row in rows]
+        with self.engine.begin() as conn:
+            conn.execute(insert(materials), values)
+
+    # ----- الملفات المؤقتة -----
+    def fetch_waiting(self):
+        cols = [waiting_files.c[f] for f in WAITING_FIELDS]
+        with self.engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(select(*cols))]
+
+    def get_waiting(self, chat_id):
+        cols = [waiting_files.c[f] for f in WAITING_FIELDS]
+        query = select(*cols).where(waiting_files.c.chat_id == str(chat_id))
+        with self.engine.connect() as conn:
+            row = conn.execute(query).first()
+            return dict(row._mapping) if row else None
+
+    def upsert_waiting(self, chat_id, file_id="", type_="", semester=""):
+        values = {"file_id": file_id or "", "type": type_ or "", "semester": str(semester or "")}
+        with self.engine.begin() as conn:
+            result = conn.execute(update(waiting_files)
+                                  .where(waiting_files.c.chat_id == str(chat_id))
+                                  .values(**values))
+            if not result.rowcount:
+                conn.execute(insert(waiting_files).values(chat_id=str(chat_id), **values))
+
+    def update_waiting(self, chat_id, **fields):
+        values = {k: ("" if v is None else str(v)) for k, v in fields.items()
+                  if k in WAITING_FIELDS and k != "chat_id"}
+        if not values:
+            return self.get_waiting(chat_id) is not None
+        with self.engine.begin() as conn:
+            result = conn.execute(update(waiting_files)
+                                  .where(waiting_files.c.chat_id == str(chat_id))
+                                  .values(**values))
+            return result.rowcount > 0
+
+    def delete_waiting(self, chat_id):
+        with self.engine.begin() as conn:
+            conn.execute(delete(waiting_files).where(waiting_files.c.chat_id == str(chat_id)))
@@ -0,0 +1,94 @@
+import os
+import json
+import asyncio
+import logging
+import time
+import httpx
+from app.metrics import TELEGRAM_SECONDS, TELEGRAM_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# ===== إعدادات الاتصال بـ Telegram Bot API =====
+TELEGRAM_TIMEOUT = float(os.getenv("TELEGRAM_TIMEOUT", "15"))  # ثواني
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "5"))
+TELEGRAM_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_MAX_CONNECTIONS", "50"))
+TELEGRAM_KEEPALIVE = int(os.getenv("TELEGRAM_KEEPALIVE", "20"))
+TELEGRAM_CONCURRENCY = int(os.getenv("TELEGRAM_CONCURRENCY", "30"))  # أقصى عدد طلبات متزامنة
+
+
+class RawJSON(bytes):
+    """قيمة JSON مُسلسلة مسبقاً (مثل لوحات المفاتيح الثابتة) تُدرج كما هي في جسم الطلب."""
+
+
+def encode_payload(payload):
+    """تحويل payload إلى bytes بدون إعادة تسلسل قيم RawJSON."""
+    raw = {k: v for k, v in payload.items() if isinstance(v, RawJSON)}
+    rest = {k: v for k, v in payload.items() if not isinstance(v, RawJSON)}
+    body = json.dumps(rest, ensure_ascii=False).encode()
+    if not raw:
+        return body
+    parts = b",".join(json.dumps(k).encode() + b":" + v for k, v in raw.items())
+    return body[:-1] + (b"," if rest else b"") + parts + b"}"
+
+
+class TelegramClient:
+    """
+    عميل غير متزامن لـ Bot API يستخدم مجمّع اتصالات مشترك (keep-alive)
+    مع مهلات زمنية وحد أعلى للطلبات المتزامنة.
+    """
+
+    def __init__(self, token, max_connections=TELEGRAM_MAX_CONNECTIONS,
+                 keepalive=TELEGRAM_KEEPALIVE, concurrency=TELEGRAM_CONCURRENCY,
+                 timeout=TELEGRAM_TIMEOUT, transport=None):
+        self.base_url = f"https://api.telegram.org/bot{token}/"
+        self._limits = httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=keepalive)
+        self._timeout = httpx.Timeout(timeout, connect=TELEGRAM_CONNECT_TIMEOUT)
+        self._concurrency = concurrency
+        self._transport = transport
+        self._client = None
+        self._sem = None
+
+    def _get_client(self):
+        # يُنشأ عند أول استخدام داخل حلقة الأحداث الفعلية
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=self._limits,
+                timeout=self._timeout,
+                transport=self._transport,
+            )
+            self._sem = asyncio.Semaphore(self._concurrency)
+        return self._client
+
+    async def call(self, method, payload=None, timeout=None):
+        """
+        استدعاء دالة من Bot API وإرجاع الرد كـ dict.
+        لا يرفع استثناءات شبكة؛ في حال الفشل يعيد {"ok": False, ...}.
+        timeout: مهلة القراءة لهذا الطلب فقط (getUpdates ينتظر أطول من الافتراضي).
+        """
+        client = self._get_client()
+        async with self._sem:
+            start = time.perf_counter()
+            try:
+                r = await client.post(method, content=encode_payload(payload or {}),
+                                      headers={"Content-Type": "application/json"},
+                                      timeout=httpx.USE_CLIENT_DEFAULT if timeout is None else
+                                      httpx.Timeout(timeout, connect=TELEGRAM_CONNECT_TIMEOUT))
+            except httpx.HTTPError as e:
+                logger.warning(f"Telegram {method} failed: {e!r}")
+                TELEGRAM_REQUESTS.inc(method=method, outcome="network")
+                return {"ok": False, "description": str(e) or e.__class__.__name__}
+            finally:
+                TELEGRAM_SECONDS.observe(time.perf_counter() - start, method=method)
+        try:
+            result = r.json()
+        except ValueError:
+            result = {"ok": False, "error_code": r.status_code, "description": r.text[:200]}
+        TELEGRAM_REQUESTS.inc(method=method, outcome="ok" if result.get("ok") else str(result.get("error_code")))
+        return result
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,138 @@
+import json
+import time
+import random
+import threading
+from collections import Counter
+import gspread
+import requests
+
+
+def _api_error(code, message):
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({"error": {"code": code, "message": message,
+                                              "status": "RESOURCE_EXHAUSTED"}}).encode()
+    return gspread.exceptions.APIError(response)
+
+
+class FakeSheetsBackend:
+    """
+    حالة مشتركة لـ gspread الوهمي: زمن كل طلب، نسبة 429، وعدّاد الطلبات حسب الدالة.
+    """
+
+    def __init__(self, latency=0.0, rate_429=0.0, seed=None):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.lock = threading.Lock()
+        self.spreadsheet = FakeSpreadsheet(self)
+
+    def request(self, name):
+        with self.lock:
+            self.calls[name] += 1
+            throttled = self.rate_429 and self.random.random() < self.rate_429
+            if throttled:
+                self.throttled[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            raise _api_error(429, "Quota exceeded for quota metric 'Read requests'")
+
+    def client(self):
+        return FakeClient(self)
+
+
+class FakeClient:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def open(self, name):
+        self.backend.request("open")
+        return self.backend.spreadsheet
+
+    def create(self, name):
+        return self.backend.spreadsheet
+
+
+class FakeSpreadsheet:
+    def __init__(self, backend):
+        self.backend = backend
+        self.sheets = {}
+        self.modified = 0
+
+    def touch(self):
+        self.modified += 1
+
+    def worksheets(self):
+        self.backend.request("worksheets")
+        return list(self.sheets.values())
+
+    def worksheet(self, title):
+        self.backend.request("worksheet")
+        if title not in self.sheets:
+            raise gspread.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def add_worksheet(self, title, rows, cols):
+        self.backend.request("add_worksheet")
+        self.sheets[title] = FakeWorksheet(self, title)
+        return self.sheets[title]
+
+    def get_lastUpdateTime(self):
+        self.backend.request("get_lastUpdateTime")
+        return f"2024-01-01T00:00:00.{self.modified:06d}Z"
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title):
+        self.spreadsheet = spreadsheet
+        self.backend = spreadsheet.backend
+        self.title = title
+        self.rows = []
+        self.col_count = 26
+
+    def add_cols(self, count):
+        self.backend.request("add_cols")
+        self.col_count += count
+
+    def get_all_records(self, **kwargs):
+        self.backend.request("get_all_records")
+        if not self.rows:
+            return []
+        header = self.rows[0]
+        return [dict(zip(header, row + [""] * (len(header) - len(row)))) for row in self.rows[1:]]
+
+    def row_values(self, index):
+        self.backend.request("row_values")
+        return list(self.rows[index - 1]) if index <= len(self.rows) else []
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values])
+
+    def append_rows(self, values, **kwargs):
+        self.backend.request("append_rows")
+        first = len(self.rows) + 1
+        self.rows.extend([str(v) for v in row] for row in values)
+        self.spreadsheet.touch()
+        return {"updates": {"updatedRange": f"{self.title}!A{first}:E{len(self.rows)}"}}
+
+    def insert_row(self, values, index=1):
+        self.backend.request("insert_row")
+        self.rows.insert(index - 1, [str(v) for v in values])
+        self.spreadsheet.touch()
+
+    def delete_rows(self, start, end=None):
+        self.backend.request("delete_rows")
+        del self.rows[start - 1:(end or start)]
+        self.spreadsheet.touch()
+
+    def batch_update(self, data, **kwargs):
+        self.backend.request("batch_update")
+        for item in data:
+            row = int("".join(ch for ch in item["range"].split(":")[0] if ch.isdigit()))
+            while len(self.rows) < row:
+                self.rows.append([])
+            self.rows[row - 1] = [str(v) for v in item["values"][0]]
+        self.spreadsheet.touch()
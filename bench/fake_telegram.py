@@ -0,0 +1,59 @@
+import json
+import random
+import asyncio
+from collections import Counter
+import httpx
+
+
+class FakeTelegram:
+    """
+    بديل محلي لـ Telegram Bot API يُركَّب كـ transport في TelegramClient.
+    latency: زمن كل طلب بالثواني، rate_429: نسبة الطلبات التي ترد بـ 429.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_429=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.throttled = Counter()
+        self._message_id = 0
+        self.updates = []  # تحديثات تنتظر getUpdates (بترتيب update_id)
+
+    def queue_updates(self, updates):
+        self.updates.extend(updates)
+        self.updates.sort(key=lambda u: u["update_id"])
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request):
+        method = request.url.path.rsplit("/", 1)[-1]
+        self.calls[method] += 1
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.rate_429 and self.random.random() < self.rate_429:
+            self.throttled[method] += 1
+            return httpx.Response(429, json={
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+        payload = json.loads(request.content or b"{}")
+        self._message_id += 1
+        if method == "getUpdates":
+            # المؤكد (أقل من offset) يُحذف كما في Telegram؛ لا انتظار عند عدم وجود تحديثات
+            offset = payload.get("offset") or 0
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            result = self.updates[:payload.get("limit", 100)]
+        elif method == "sendMediaGroup":
+            result = [{"message_id": self._message_id + i} for i in range(len(payload.get("media", [])))]
+        elif method == "getFile":
+            file_id = payload.get("file_id", "")
+            result = {"file_id": file_id, "file_unique_id": f"u-{file_id[-16:]}", "file_size": 1024}
+        else:
+            result = {"message_id": self._message_id, "chat": {"id": payload.get("chat_id")}}
+        return httpx.Response(200, json={"ok": True, "result": result})
@@ -0,0 +1,240 @@
+"""
+قياس أداء مسار /webhook محلياً: Telegram و Google Sheets وهميان داخل العملية
+مع زمن استجابة ونسبة 429 قابلين للضبط.
+
+    python -m bench.run --chats 500 --admins 5 --tg-latency 0.05 --tg-429 0.01 \\
+        --sheets-latency 0.2 --sheets-429 0.02
+
+يطبع p50/p99 لزمن رد /webhook ولزمن المعالجة الكامل (من الإرسال حتى انتهاء
+المعالج) وعدد التحديثات في الثانية، مع عدد طلبات كل API.
+--mode polling: كل التحديثات تنتظر في getUpdates (متراكم بعد توقف) ويسحبها
+UpdatePoller بدل /webhook، فيُقاس المعالج بدون طبقة HTTP الواردة.
+"""
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for /webhook")
+    parser.add_argument("--mode", choices=["webhook", "polling"], default="webhook",
+                        help="إدخال التحديثات عبر /webhook أو getUpdates")
+    parser.add_argument("--chats", type=int, default=200, help="عدد المحادثات (جلسة لكل محادثة)")
+    parser.add_argument("--admins", type=int, default=2, help="عدد محادثات رفع الأدمن من بينها")
+    parser.add_argument("--concurrency", type=int, default=100, help="محادثات نشطة في نفس الوقت")
+    parser.add_argument("--think", type=float, default=0.0, help="ثواني بين رسائل نفس المحادثة")
+    parser.add_argument("--storage", choices=["sheets", "sql"], default="sheets")
+    parser.add_argument("--tg-latency", type=float, default=0.03)
+    parser.add_argument("--tg-jitter", type=float, default=0.02)
+    parser.add_argument("--tg-429", type=float, default=0.0, help="نسبة ردود 429 من Telegram")
+    parser.add_argument("--tg-retry-after", type=int, default=1)
+    parser.add_argument("--sheets-latency", type=float, default=0.15)
+    parser.add_argument("--sheets-429", type=float, default=0.0, help="نسبة ردود 429 من Sheets")
+    parser.add_argument("--chat-rate", type=float, default=None,
+                        help="تجاوز TELEGRAM_CHAT_RATE (رسالة/ثانية لكل محادثة)")
+    parser.add_argument("--global-rate", type=float, default=None,
+                        help="تجاوز TELEGRAM_GLOBAL_RATE (رسالة/ثانية لكل البوت)")
+    parser.add_argument("--cold", action="store_true", help="بدون انتظار تحميل فهرس المواد")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--json", action="store_true", help="طباعة النتيجة كـ JSON")
+    return parser.parse_args(argv)
+
+
+def configure_env(args, workdir):
+    """يجب أن يتم قبل استيراد app.* لأن الإعدادات تُقرأ عند الاستيراد."""
+    os.environ.update({
+        "BOT_TOKEN": "bench",
+        "STORAGE_BACKEND": args.storage,
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "JOURNAL_PATH": os.path.join(workdir, "journal.db"),
+        "STATE_BACKEND": "memory",
+        "MATERIALS_SNAPSHOT_PATH": os.path.join(workdir, "materials.json"),
+        "BROADCAST_DB_PATH": os.path.join(workdir, "broadcast.db"),
+        "FILES_DB_PATH": os.path.join(workdir, "files.db"),
+    })
+    os.environ.pop("WEBHOOK_SECRET_TOKEN", None)
+    if args.chat_rate is not None:
+        os.environ["TELEGRAM_CHAT_RATE"] = str(args.chat_rate)
+    if args.global_rate is not None:
+        os.environ["TELEGRAM_GLOBAL_RATE"] = str(args.global_rate)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(values):
+    return {f"p{p}": round(percentile(values, p) * 1000, 2) for p in (50, 90, 99)} | {
+        "max": round(max(values, default=0) * 1000, 2)}
+
+
+async def run(args):
+    import httpx
+    from app import main, crud
+    from app.storage import WAITING_FIELDS
+    from app.sheets import SheetHandles
+    from bench.fake_telegram import FakeTelegram
+    from bench.fake_sheets import FakeSheetsBackend
+    from bench import workload
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # ----- الخدمات الوهمية -----
+    telegram = FakeTelegram(args.tg_latency, args.tg_jitter, args.tg_429, args.tg_retry_after, args.seed)
+    main.tg._transport = telegram.transport()
+    sheets = None
+    seed = workload.seed_rows(seed=args.seed)
+    if args.storage == "sheets":
+        sheets = FakeSheetsBackend(args.sheets_latency, args.sheets_429, args.seed)
+        spreadsheet = sheets.spreadsheet
+        spreadsheet.add_worksheet("materials", 1, 1).rows = [list(map(str, row)) for row in seed]
+        spreadsheet.add_worksheet("waiting_files", 1, 1).rows = [WAITING_FIELDS]
+        sheets.calls.clear()
+        crud.STORAGE.handles = SheetHandles(sheets.client, "bench")
+    else:
+        crud.STORAGE.init_schema()
+        crud.STORAGE.append_materials(seed[1:])
+
+    # ----- قياس زمن المعالجة الكامل -----
+    sent_at = {}
+    handled = []
+    done = asyncio.Event()
+    sessions = workload.generate(args.chats, args.admins, main.ADMIN_USERNAME.replace("@", ""), args.seed)
+    total = sum(len(s) for s in sessions)
+    handler = main.dispatcher.handler
+
+    async def timed_handler(update):
+        try:
+            await handler(update)
+        finally:
+            handled.append(time.perf_counter() - sent_at.pop(update["update_id"]))
+            if len(handled) + sum(shed.values()) >= total:
+                done.set()
+
+    main.dispatcher.handler = timed_handler
+
+    # التحديثات المرفوضة قبل الطابور (حد المحادثة أو الدمج) لا تصل للمعالج
+    shed = {}
+    admit = main.admit
+
+    def counted_admit(update):
+        status = admit(update)
+        # في وضع polling يُعاد سحب التحديث المرفوض لامتلاء الطابور
+        if status != "queued" and not (status == "full" and args.mode == "polling"):
+            shed[status] = shed.get(status, 0) + 1
+            sent_at.pop(update["update_id"], None)
+            if len(handled) + sum(shed.values()) >= total:
+                done.set()
+        return status
+
+    main.admit = counted_admit
+
+    await main.startup()
+    if not args.cold:
+        deadline = time.monotonic() + 30
+        while not crud.MATERIALS.loaded and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+    if sheets:
+        sheets.calls.clear()
+
+    # ----- الإرسال -----
+    acks = []
+    statuses = {}
+    gate = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=main.app)
+
+    async def ingest_webhook():
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def play(updates):
+                async with gate:
+                    for update in updates:
+                        sent_at[update["update_id"]] = start = time.perf_counter()
+                        r = await client.post("/webhook", json=update)
+                        acks.append(time.perf_counter() - start)
+                        statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+                        if args.think:
+                            await asyncio.sleep(args.think)
+
+            await asyncio.gather(*(play(s) for s in sessions))
+
+    async def ingest_polling():
+        # كل التحديثات متراكمة منذ البداية، فزمن المعالجة يُحسب من started
+        from app.polling import UpdatePoller
+        for updates in sessions:
+            for update in updates:
+                sent_at[update["update_id"]] = started
+            telegram.queue_updates(updates)
+        poller = UpdatePoller(main.tg, main.admit)
+        await poller.run(asyncio.Event(), drain=True)
+        statuses.update(poller.statuses)
+
+    started = time.perf_counter()
+    await (ingest_polling() if args.mode == "polling" else ingest_webhook())
+    sent_elapsed = time.perf_counter() - started
+    try:
+        await asyncio.wait_for(done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - started
+
+    await main.shutdown()
+
+    return {
+        "updates": total,
+        "handled": len(handled),
+        "chats": args.chats,
+        "mode": args.mode,
+        "elapsed_seconds": round(elapsed, 3),
+        "updates_per_second": round(len(handled) / elapsed, 1) if elapsed else 0.0,
+        "ingest_per_second": round(total / sent_elapsed, 1) if sent_elapsed else 0.0,
+        "webhook_ack_ms": summarize(acks),
+        "end_to_end_ms": summarize(handled),
+        "http_statuses": statuses,
+        "shed": shed,
+        "dispatcher": main.dispatcher.stats(),
+        "telegram_calls": dict(telegram.calls),
+        "telegram_429": sum(telegram.throttled.values()),
+        "sheets_calls": dict(sheets.calls) if sheets else {},
+        "sheets_429": sum(sheets.throttled.values()) if sheets else 0,
+        "materials_indexed": len(crud.MATERIALS),
+    }
+
+
+def print_report(result):
+    print(f"updates: {result['handled']}/{result['updates']} in {result['elapsed_seconds']}s "
+          f"({result['chats']} chats, {result['mode']})")
+    print(f"throughput: {result['updates_per_second']} updates/s handled, "
+          f"{result['ingest_per_second']} updates/s accepted")
+    for name in ("webhook_ack_ms", "end_to_end_ms"):
+        s = result[name]
+        print(f"{name:16} p50={s['p50']:>9} p90={s['p90']:>9} p99={s['p99']:>9} max={s['max']:>9}")
+    label = "http statuses" if result["mode"] == "webhook" else "admit statuses"
+    print(f"{label}: {result['http_statuses']}, not queued: {result['shed']}")
+    print(f"telegram calls: {result['telegram_calls']} (429: {result['telegram_429']})")
+    print(f"sheets calls: {result['sheets_calls']} (429: {result['sheets_429']})")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="medbot-bench-") as workdir:
+        configure_env(args, workdir)
+        result = asyncio.run(run(args))
+    if args.json:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import random
+from datetime import datetime
+from app import menu
+from app.storage import MATERIAL_FIELDS
+
+# (السمستر، تسمية الزر، المقررات) للفصول التي فيها مقررات فقط
+CATALOGUE = [(code, label, [c for row in rows for c in row])
+             for code, label, rows in menu.SEMESTERS if rows]
+TYPE_BUTTONS = [(ctype, button) for ctype, button, _ in menu.CONTENT_TYPES]
+
+
+def message(chat_id, text=None, username=None, **fields):
+    msg = {"message_id": 0, "chat": {"id": chat_id, "type": "private"},
+           "from": {"id": chat_id, "username": username or f"student{chat_id}"}}
+    if text is not None:
+        msg["text"] = text
+    msg.update(fields)
+    return {"message": msg}
+
+
+def callback(chat_id, data, username=None):
+    return {"callback_query": {
+        "id": f"{chat_id}-{data}", "data": data,
+        "from": {"id": chat_id, "username": username or f"student{chat_id}"},
+        "message": {"message_id": 1, "chat": {"id": chat_id, "type": "private"}},
+    }}
+
+
+def seed_file_id(code, course, ctype, i):
+    """file_id ثابت لصفوف seed_rows حتى تشير أزرار الجلسات لملفات موجودة."""
+    return f"seed-{code}-{menu.COURSE_IDS[course]}-{ctype}-{i}"
+
+
+def student_session(chat_id, rng, per_type=3):
+    """
+    طالب يتصفح: البداية -> سمستر -> مقرر -> نوع أو نوعان (مع اختيار ملف
+    من القائمة وأحياناً "إرسال الكل") -> رجوع/الرئيسية.
+    """
+    code, label, courses = rng.choice(CATALOGUE)
+    course = rng.choice(courses)
+    updates = [message(chat_id, "/start"), message(chat_id, menu.BEGIN),
+               message(chat_id, label), message(chat_id, course)]
+    for ctype, button in rng.sample(TYPE_BUTTONS, rng.randint(1, 2)):
+        updates.append(message(chat_id, menu.type_button(course, button)))
+        file_id = seed_file_id(code, course, ctype, rng.randrange(per_type))
+        updates.append(callback(chat_id, menu.file_callback(code, course, ctype, {"file_id": file_id})))
+        if rng.random() < 0.2:
+            updates.append(callback(chat_id, menu.callback_data("a", code, course, ctype)))
+    updates.append(message(chat_id, rng.choice([menu.BACK, menu.HOME])))
+    return updates
+
+
+def admin_upload(chat_id, rng, username, files=5):
+    """الأدمن يرفع عدة ملفات لمقرر واحد ثم ينهي الرفع."""
+    code, label, courses = rng.choice(CATALOGUE)
+    course = rng.choice(courses)
+    ctype, button = rng.choice(TYPE_BUTTONS)
+    updates = [message(chat_id, "/start", username), message(chat_id, menu.UPLOAD_NEW, username),
+               message(chat_id, label, username), message(chat_id, course, username),
+               message(chat_id, menu.type_button(course, button), username)]
+    field = "video" if ctype == "video" else "document"
+    for i in range(files):
+        file_id = f"bench-{chat_id}-{rng.getrandbits(32):08x}-{i}"
+        updates.append(message(chat_id, username=username,
+                               **{field: {"file_id": file_id, "file_unique_id": file_id,
+                                          "file_name": f"{course} {i + 1}.pdf", "file_size": 1024}}))
+    updates.append(message(chat_id, menu.UPLOAD_FINISH, username))
+    return updates
+
+
+def generate(chats, admin_chats=0, admin_username="Mgdad_Ali", seed=None):
+    """
+    قائمة محادثات، كل واحدة قائمة تحديثات بالترتيب (مع update_id فريد).
+    محادثات الأدمن تأتي أولاً، والباقي جلسات طلاب.
+    """
+    rng = random.Random(seed)
+    sessions = []
+    for i in range(chats):
+        chat_id = 100000 + i
+        if i < admin_chats:
+            sessions.append(admin_upload(chat_id, rng, admin_username))
+        else:
+            sessions.append(student_session(chat_id, rng))
+    update_id = 1
+    for updates in sessions:
+        for update in updates:
+            update["update_id"] = update_id
+            if "message" in update:
+                update["message"]["message_id"] = update_id
+            update_id += 1
+    return sessions
+
+
+def seed_rows(per_type=3, seed=None):
+    """صفوف مواد لكل (سمستر، مقرر، نوع) في القائمة، بترتيب MATERIAL_FIELDS."""
+    rng = random.Random(seed)
+    created_at = datetime.utcnow().isoformat()
+    rows = []
+    for code, _, courses in CATALOGUE:
+        for course in courses:
+            for ctype, _ in TYPE_BUTTONS:
+                for i in range(per_type):
+                    rows.append([code, course, ctype, seed_file_id(code, course, ctype, i), created_at,
+                                 f"{course} {ctype} {i + 1}", str(rng.randint(10_000, 50_000_000))])
+    return [MATERIAL_FIELDS] + rows
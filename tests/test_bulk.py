@@ -0,0 +1,59 @@
+from app import bulk
+from app.storage import MATERIAL_FIELDS
+
+
+def _row(file_id, file_name, **extra):
+    return {"semester": "2", "course": "English", "type": "pdf", "file_id": file_id,
+            "created_at": "2026-01-01T00:00:00", "file_name": file_name,
+            "file_size": "1234", "file_unique_id": f"u-{file_id}"} | extra
+
+
+def _import(text, fmt, **kwargs):
+    importer = bulk.Importer(fmt, batch_size=1000, **kwargs)
+    rows = []
+    for line in text.splitlines(keepends=True):
+        rows.extend(importer.add(line) or [])
+    rows.extend(importer.take())
+    importer.committed(rows)
+    return [dict(zip(MATERIAL_FIELDS, values)) for _, values in rows], importer.finished()
+
+
+def test_round_trip_with_newline_comma_and_quote():
+    rows = [_row("F1", 'Lecture 1\nDr. Ali, "Pathology"'), _row("F2", "plain"),
+            _row("F3", "\n\nblank lines inside")]
+    for fmt in bulk.FORMATS:
+        text = "".join(bulk.export_lines(rows, fmt))
+        imported, report = _import(text, fmt)
+        assert imported == rows, fmt
+        assert report["invalid"] == 0 and report["imported"] == 3
+        assert report["line"] == len(text.splitlines())
+
+
+def test_csv_resume_after_multiline_record():
+    rows = [_row("F1", "a\nb"), _row("F2", "c")]
+    text = "".join(bulk.export_lines(rows, "csv"))
+    # السطر 3 آخر أسطر السجل الأول (الرأس + سطرا F1)
+    imported, _ = _import(text, "csv", start_line=3)
+    assert [r["file_id"] for r in imported] == ["F2"]
+
+
+def test_csv_errors_point_at_record_start():
+    text = 'semester,course,type,file_id,file_name\n2,English,pdf,,"x\ny"\n2,English,pdf,F1,"open\n'
+    imported, report = _import(text, "csv")
+    assert imported == []
+    assert [e["line"] for e in report["errors"]] == [2, 4]
+    assert "unterminated" in report["errors"][1]["error"]
+
+
+def test_import_skips_rows_already_in_storage(tmp_path):
+    from app.storage_sql import SqlStorage
+
+    storage = SqlStorage(f"sqlite:///{tmp_path / 'bulk.db'}")
+    storage.init_schema()
+    rows = [_row(f"F{i}", f"file {i}") for i in range(5)]
+    text = "".join(bulk.export_lines(rows, "jsonl"))
+    first = bulk.run_import(storage, text.splitlines(keepends=True), "jsonl", batch_size=2)
+    again = bulk.run_import(storage, text.splitlines(keepends=True), "jsonl", batch_size=2)
+    assert (first["imported"], first["duplicates"]) == (5, 0)
+    assert (again["imported"], again["duplicates"]) == (0, 5) and again["line"] == 5
+    assert len(storage.fetch_materials()) == 5
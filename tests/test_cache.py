@@ -0,0 +1,81 @@
+import time
+import threading
+
+import pytest
+
+from app.cache import Cache
+
+
+def _wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert condition()
+
+
+def test_concurrent_misses_load_once():
+    cache = Cache("test-single-flight", ttl=60)
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(threading.current_thread().name)
+        release.wait(2)
+        return {"file_id": "A"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("chat", loader)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    _wait_until(lambda: cache.misses == 8)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+    assert len(calls) == 1
+    assert results == [{"file_id": "A"}] * 8
+    assert cache.stats()["loads"] == 1
+
+
+def test_failed_load_serves_stale_value():
+    cache = Cache("test-stale", ttl=0.01, stale_ttl=60)
+    assert cache.get_or_load("chat", lambda: "old") == "old"
+    time.sleep(0.02)
+
+    def broken():
+        raise ConnectionError("storage down")
+
+    # القيمة القديمة فوراً، والتحديث في الخلفية يفشل بدون أن يمسحها
+    assert cache.get_or_load("chat", broken) == "old"
+    _wait_until(lambda: cache.load_errors == 1)
+    assert cache.get_or_load("chat", broken) == "old"
+    assert cache.stale_hits == 2
+
+
+def test_failed_load_without_stale_value_raises():
+    cache = Cache("test-no-stale", ttl=0.01, stale_ttl=0)
+
+    def broken():
+        raise ConnectionError("storage down")
+
+    with pytest.raises(ConnectionError):
+        cache.get_or_load("chat", broken)
+    assert cache.stats()["entries"] == 0
+
+
+def test_set_during_load_keeps_the_written_value():
+    cache = Cache("test-write-through", ttl=60)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_loader():
+        started.set()
+        release.wait(2)
+        return "before write"
+
+    reader = threading.Thread(target=cache.get_or_load, args=("chat", slow_loader))
+    reader.start()
+    started.wait(2)
+    cache.set("chat", "after write")
+    release.set()
+    reader.join(2)
+    assert cache.get_or_load("chat", lambda: "reloaded") == "after write"
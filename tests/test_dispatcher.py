@@ -0,0 +1,64 @@
+import asyncio
+import random
+
+from app.dispatcher import UpdateDispatcher
+
+
+def _message(update_id, chat_id):
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": str(update_id)}}
+
+
+async def _run(updates, workers=4, seen_size=100):
+    handled = []
+    active = set()
+    overlaps = []
+
+    async def handler(update):
+        chat_id = update["message"]["chat"]["id"]
+        if chat_id in active:
+            overlaps.append(chat_id)
+        active.add(chat_id)
+        await asyncio.sleep(random.random() / 1000)
+        active.discard(chat_id)
+        handled.append((chat_id, update["update_id"]))
+
+    dispatcher = UpdateDispatcher(handler, workers=workers, seen_size=seen_size)
+    dispatcher.start()
+    statuses = [dispatcher.submit(update) for update in updates]
+    await dispatcher.stop()
+    return dispatcher, statuses, handled, overlaps
+
+
+def test_updates_keep_order_within_each_chat():
+    random.seed(1)
+    updates = [_message(i, i % 5) for i in range(200)]
+    dispatcher, statuses, handled, overlaps = asyncio.run(_run(updates))
+    assert set(statuses) == {"queued"}
+    assert overlaps == []
+    for chat_id in range(5):
+        assert [u for c, u in handled if c == chat_id] == list(range(chat_id, 200, 5))
+    assert dispatcher.processed == 200 and dispatcher.queued == 0
+
+
+def test_duplicate_update_ids_are_dropped():
+    updates = [_message(1, 10), _message(2, 10), _message(1, 10), _message(3, 11), _message(2, 10)]
+    dispatcher, statuses, handled, _ = asyncio.run(_run(updates))
+    assert statuses == ["queued", "queued", "duplicate", "queued", "duplicate"]
+    assert sorted(u for _, u in handled) == [1, 2, 3]
+    assert dispatcher.duplicates == 2
+
+
+def test_full_queue_does_not_remember_the_update():
+    async def scenario():
+        dispatcher = UpdateDispatcher(lambda update: asyncio.sleep(0), workers=1, max_queued=1)
+        dispatcher.start()
+        first = dispatcher.submit(_message(1, 10))
+        rejected = dispatcher.submit(_message(2, 10))
+        await dispatcher.stop()
+        # Telegram يعيد إرسال المرفوض فيُقبل بعد تفريغ الطابور
+        dispatcher.start()
+        retried = dispatcher.submit(_message(2, 10))
+        await dispatcher.stop()
+        return first, rejected, retried
+
+    assert asyncio.run(scenario()) == ("queued", "full", "queued")
@@ -0,0 +1,89 @@
+import pytest
+
+from app.journal import WriteBehindJournal, NOT_PENDING
+
+
+class RecordingStorage:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def append_materials(self, rows):
+        if self.fail:
+            raise ConnectionError("storage down")
+        self.calls.append(("append_materials", rows))
+
+    def upsert_waiting_many(self, changes):
+        if self.fail:
+            raise ConnectionError("storage down")
+        self.calls.append(("upsert_waiting_many", changes))
+
+    def delete_waiting(self, chat_id):
+        if self.fail:
+            raise ConnectionError("storage down")
+        self.calls.append(("delete_waiting", chat_id))
+
+
+def _row(chat_id, file_id):
+    return {"chat_id": chat_id, "file_id": file_id, "type": "pdf", "semester": "2"}
+
+
+def test_pending_writes_replay_after_crash(tmp_path):
+    path = str(tmp_path / "journal.db")
+    crashed = WriteBehindJournal(path, RecordingStorage(fail=True))
+    crashed.append_materials([["2", "English", "pdf", "F1"]])
+    crashed.put_waiting(7, _row("7", "A"))
+    with pytest.raises(ConnectionError):
+        crashed.flush()
+    # العملية ماتت بدون stop(): القيود باقية في الملف فقط
+
+    storage = RecordingStorage()
+    journal = WriteBehindJournal(path, storage)
+    assert journal.pending_count() == 2
+    assert journal.pending_waiting(7) == _row("7", "A")
+    assert journal.pending_material_rows() == [["2", "English", "pdf", "F1"]]
+    assert journal.flush() == 2
+    assert storage.calls == [("append_materials", [["2", "English", "pdf", "F1"]]),
+                             ("upsert_waiting_many", {"7": _row("7", "A")})]
+    assert journal.pending_count() == 0 and journal.pending_waiting(7) is NOT_PENDING
+
+
+def test_writes_coalesce_into_one_flush(tmp_path):
+    storage = RecordingStorage()
+    journal = WriteBehindJournal(str(tmp_path / "journal.db"), storage)
+    journal.append_materials([["2", "English", "pdf", "F1"]])
+    journal.append_materials([["2", "English", "pdf", "F2"]])
+    for file_id in ("A", "B", "C"):
+        journal.put_waiting(7, _row("7", file_id))
+    journal.put_waiting(8, _row("8", "X"))
+    journal.put_waiting(8, None)
+
+    assert journal.pending_waiting(7)["file_id"] == "C"
+    assert journal.pending_waiting(8) is None
+    assert journal.flush() == 7
+    # دفعة مواد واحدة، وآخر حالة فقط لكل محادثة
+    assert storage.calls == [("append_materials", [["2", "English", "pdf", "F1"], ["2", "English", "pdf", "F2"]]),
+                             ("upsert_waiting_many", {"7": _row("7", "C")}),
+                             ("delete_waiting", "8")]
+    assert journal.flush() == 0
+
+
+def test_failed_materials_are_not_written_twice(tmp_path):
+    class WaitingDown(RecordingStorage):
+        waiting_down = True
+
+        def upsert_waiting_many(self, changes):
+            if self.waiting_down:
+                raise ConnectionError("waiting sheet down")
+            super().upsert_waiting_many(changes)
+
+    storage = WaitingDown()
+    journal = WriteBehindJournal(str(tmp_path / "journal.db"), storage)
+    journal.append_materials([["2", "English", "pdf", "F1"]])
+    journal.put_waiting(7, _row("7", "A"))
+    with pytest.raises(ConnectionError):
+        journal.flush()
+    storage.waiting_down = False
+    # المواد حُذفت من السجل فور نجاحها؛ الإعادة تكتب صف المحادثة فقط
+    assert journal.flush() == 1
+    assert [name for name, _ in storage.calls] == ["append_materials", "upsert_waiting_many"]